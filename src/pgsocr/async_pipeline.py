@@ -0,0 +1,322 @@
+import asyncio
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Optional, Sequence
+from PIL import Image
+from pgsocr import img_utils
+from pgsocr.metrics import Metrics, NullMetrics, NULL_METRICS
+from pgsocr.ocr_cache import OCRCache
+from pgsocr.ocr_pool import timed_submit
+from pgsocr.checkpoint import Checkpoint
+from pgsocr.pgsparser import PGStream, PGStreamReader
+from pgsocr.supconvert import _record_run, join_results, open_inputs, prepare_images
+from pgsocr.writers import SubtitleOutput
+
+# Marks the end of the stream in the stage queues
+_DONE = object()
+
+
+class AsyncOCREngine:
+    def __init__(self, engine, metrics: Metrics | NullMetrics = NULL_METRICS):
+        self.engine = engine
+        self.metrics = metrics
+        self.config_key = getattr(engine, "config_key", None)
+        # Pools take care of their own concurrency, a single engine instance is not
+        # thread safe so its calls go through one dedicated thread
+        self.executor = None
+        if not hasattr(engine, "submit"):
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="ocr")
+
+    async def ocr(self, im: Image.Image) -> str:
+        if self.executor is None:
+            submit = timed_submit(self.engine.submit, self.metrics)
+            return await asyncio.wrap_future(submit(im))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._recognize, self.engine.get_ocr_text, im
+        )
+
+    async def ocr_conf(self, im: Image.Image) -> tuple[str, Optional[int]]:
+        # Text and confidence, the confidence is None if the engine does not report one
+        if self.executor is None and hasattr(self.engine, "submit_conf"):
+            submit = timed_submit(self.engine.submit_conf, self.metrics)
+            return await asyncio.wrap_future(submit(im))
+        if self.executor is not None and hasattr(self.engine, "get_ocr_text_conf"):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, self._recognize, self.engine.get_ocr_text_conf, im
+            )
+        return await self.ocr(im), None
+
+    def _recognize(self, recognize: Callable, im: Image.Image):
+        with self.metrics.time("ocr"):
+            return recognize(im)
+
+    def close(self):
+        # Stops the adapter thread but leaves the wrapped engine running
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def quit(self):
+        self.close()
+        self.engine.quit()
+
+
+def as_async_engine(engine, metrics: Metrics | NullMetrics = NULL_METRICS):
+    # Engines that already implement the async protocol are used as they are
+    if inspect.iscoroutinefunction(getattr(engine, "ocr", None)):
+        return engine
+    return AsyncOCREngine(engine, metrics)
+
+
+async def _extract(
+    supfile,
+    queue: asyncio.Queue,
+    palette_cache: img_utils.PaletteCache,
+    metrics: Metrics | NullMetrics,
+    stop: threading.Event,
+    skip: int = 0,
+    merge: bool = False,
+) -> None:
+    # Parsing and composition run in a worker thread which waits while the queue is full
+    loop = asyncio.get_running_loop()
+
+    def put(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stop.is_set():
+            try:
+                future.result(timeout=0.1)
+                return True
+            except TimeoutError:
+                pass
+        future.cancel()
+        return False
+
+    def produce():
+        img_objs = img_utils.extract_images(supfile, palette_cache, metrics, merge)
+        if merge:
+            img_objs = img_utils.merge_similar(img_objs, metrics)
+        try:
+            # Events before the checkpoint are already in the output
+            for img_obj in islice(img_objs, skip, None):
+                if not put(img_obj):
+                    return
+        finally:
+            put(_DONE)
+
+    await asyncio.to_thread(produce)
+
+
+async def _recognize(
+    engine,
+    ims: list[Image.Image],
+    key: Optional[str],
+    ocr_cache: Optional[OCRCache],
+    confidence: bool,
+) -> tuple[str, Optional[int]]:
+    if confidence and hasattr(engine, "ocr_conf"):
+        results = await asyncio.gather(*(engine.ocr_conf(im) for im in ims))
+    else:
+        results = [(t, None) for t in await asyncio.gather(*map(engine.ocr, ims))]
+    text, conf = join_results(results)
+    if key is not None:
+        ocr_cache.put(key, text, conf)  # type: ignore
+    return text, conf
+
+
+async def _cancel(tasks: list[asyncio.Task]) -> None:
+    # Failures of cancelled tasks are collected so they are not reported as unhandled
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _preprocess(
+    engine,
+    decoded: asyncio.Queue,
+    recognized: asyncio.Queue,
+    ocr_cache: Optional[OCRCache],
+    metrics: Metrics | NullMetrics,
+    preprocess: str,
+    split_lines: bool,
+    confidence: bool,
+) -> None:
+    cache_config = (engine.config_key, preprocess, split_lines)
+    try:
+        while (img_obj := await decoded.get()) is not _DONE:
+            key = None
+            if ocr_cache is not None and img_obj.px is not None:
+                key = ocr_cache.make_key(img_obj.px, img_obj.pal, cache_config)
+                known = ocr_cache.get(key)
+                metrics.count("ocr_cache_misses" if known is None else "ocr_cache_hits")
+                if known is not None:
+                    await recognized.put((img_obj, known))
+                    continue
+
+            start = time.perf_counter()
+            ims = await asyncio.to_thread(
+                prepare_images, img_obj, preprocess, split_lines
+            )
+            metrics.observe("preprocess_image", time.perf_counter() - start)
+            # The task is queued right away so several images are recognized at once,
+            # the bounded queue limits how many are in flight
+            task = asyncio.create_task(
+                _recognize(engine, ims, key, ocr_cache, confidence)
+            )
+            try:
+                await recognized.put((img_obj, task))
+            except asyncio.CancelledError:
+                await _cancel([task])
+                raise
+    except Exception as exc:
+        # Raised again by the writer
+        await recognized.put(exc)
+        return
+    await recognized.put(_DONE)
+
+
+async def supconvert_async(
+    in_path: str,
+    out_path: str,
+    ocr_engine,
+    fmt: str | Sequence[str],
+    img_dump_path: Optional[str] = None,
+    use_mmap: bool = False,
+    streaming: bool = False,
+    ocr_cache: Optional[OCRCache] = None,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    preprocess: str = "crop",
+    split_lines: bool = False,
+    merge: bool = False,
+    queue_size: int = 16,
+    resume: bool = False,
+) -> Optional[int]:
+    inputs = await asyncio.to_thread(
+        open_inputs,
+        in_path,
+        out_path,
+        fmt,
+        ocr_engine,
+        use_mmap,
+        streaming,
+        metrics,
+        preprocess,
+        split_lines,
+        merge,
+        resume,
+    )
+    if inputs is None:
+        return None
+    lines = 0
+    for item in inputs:
+        if isinstance(item, int):
+            lines += item
+            continue
+        supfile, checkpoint, size = item
+        lines += await convert_stream_async(
+            supfile,
+            out_path,
+            ocr_engine,
+            fmt,
+            checkpoint,
+            size,
+            img_dump_path,
+            ocr_cache,
+            metrics,
+            preprocess,
+            split_lines,
+            merge,
+            queue_size,
+        )
+    return lines
+
+
+async def convert_stream_async(
+    supfile: PGStream | PGStreamReader,
+    out_path: str,
+    ocr_engine,
+    fmt: str | Sequence[str],
+    checkpoint: Optional[Checkpoint],
+    size: int,
+    img_dump_path: Optional[str] = None,
+    ocr_cache: Optional[OCRCache] = None,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    preprocess: str = "crop",
+    split_lines: bool = False,
+    merge: bool = False,
+    queue_size: int = 16,
+) -> int:
+    started = time.perf_counter()
+    output = SubtitleOutput(supfile, out_path, fmt, checkpoint)
+
+    engine = as_async_engine(ocr_engine, metrics)
+    if engine.config_key is None:
+        ocr_cache = None
+
+    # parse and compose -> decoded -> preprocess and OCR -> recognized -> write
+    decoded: asyncio.Queue = asyncio.Queue(queue_size)
+    recognized: asyncio.Queue = asyncio.Queue(queue_size)
+    palette_cache = img_utils.PaletteCache()
+    stop = threading.Event()
+    skipped = output.events
+    stages = [
+        asyncio.create_task(
+            _extract(supfile, decoded, palette_cache, metrics, stop, skipped, merge)
+        ),
+        asyncio.create_task(
+            _preprocess(
+                engine,
+                decoded,
+                recognized,
+                ocr_cache,
+                metrics,
+                preprocess,
+                split_lines,
+                output.confidence,
+            )
+        ),
+    ]
+
+    try:
+        while (item := await recognized.get()) is not _DONE:
+            if isinstance(item, Exception):
+                raise item
+            img_obj, result = item
+            if isinstance(result, asyncio.Task):
+                result = await result
+            output.write(img_obj, *result)
+            if img_dump_path is not None:
+                img_obj.img.save(
+                    f"{img_dump_path}/{img_obj.start_ms}-{img_obj.end_ms}_{output.events}.png"
+                )
+        await asyncio.gather(*stages)
+        output.finish()
+    finally:
+        # Lets the extraction thread finish if the writer stopped early, it has to
+        # be done with the file before it is closed
+        stop.set()
+        stages[1].cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        # Recognitions that were still queued are not needed anymore
+        pending = []
+        while not recognized.empty():
+            item = recognized.get_nowait()
+            if isinstance(item, tuple) and isinstance(item[1], asyncio.Task):
+                pending.append(item[1])
+        await _cancel(pending)
+        if engine is not ocr_engine:
+            engine.close()
+        output.close()
+        supfile.close()
+    lines = output.events
+
+    if ocr_cache is not None:
+        ocr_cache.flush()
+
+    _record_run(
+        metrics, supfile.file_name, lines, skipped, palette_cache, started, size
+    )
+    return lines
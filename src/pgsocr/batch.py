@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Optional, Sequence
+from tqdm import tqdm
+from pgsocr import ocr_pool
+from pgsocr.metrics import Metrics, NullMetrics, NULL_METRICS
+from pgsocr.ocr_cache import OCRCache
+from pgsocr.supconvert import supconvert
+
+
+_worker_ocr_cache: Optional[OCRCache] = None
+
+
+def _init_batch_worker(engine_factory: Callable, ocr_cache_path: Optional[str]) -> None:
+    global _worker_ocr_cache
+    ocr_pool._init_worker(engine_factory)
+    _worker_ocr_cache = OCRCache(db_path=ocr_cache_path)
+
+
+def _worker_convert(
+    in_path: str,
+    out_path: str,
+    fmt: str | Sequence[str],
+    collect_metrics: bool,
+    options: dict,
+) -> tuple[str, Optional[Metrics], tuple[int, int]]:
+    metrics = Metrics() if collect_metrics else None
+    before = ocr_pool.engine_usage(ocr_pool._worker_engine)
+    supconvert(
+        in_path,
+        out_path,
+        ocr_pool._worker_engine,
+        fmt,
+        progress=False,
+        ocr_cache=_worker_ocr_cache,
+        metrics=metrics if metrics is not None else NULL_METRICS,
+        **options,
+    )
+    after = ocr_pool.engine_usage(ocr_pool._worker_engine)
+    return in_path, metrics, (after[0] - before[0], after[1] - before[1])
+
+
+def batch_convert(
+    in_paths: list[str],
+    out_path: str,
+    engine_factory: Callable,
+    fmt: str | Sequence[str],
+    jobs: int,
+    ocr_cache_path: Optional[str] = None,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    **options,
+) -> tuple[int, int]:
+    # Returns the lines recognized by the primary and the fallback engine of a cascade
+    sizes = {p: os.path.getsize(p) for p in in_paths}
+    # Largest files first, so a long file is never the last one left running
+    in_paths = sorted(in_paths, key=lambda p: sizes[p], reverse=True)
+
+    primary_lines = fallback_lines = 0
+    # Every worker keeps its engine loaded for the whole batch
+    with ProcessPoolExecutor(
+        jobs,
+        initializer=_init_batch_worker,
+        initargs=(engine_factory, ocr_cache_path),
+    ) as executor:
+        futures = [
+            executor.submit(
+                _worker_convert, p, out_path, fmt, metrics.enabled, options
+            )
+            for p in in_paths
+        ]
+        with tqdm(
+            total=sum(sizes.values()),
+            desc=f"{len(in_paths)} files",
+            unit="B",
+            unit_scale=True,
+        ) as progress:
+            for f in as_completed(futures):
+                done, file_metrics, usage = f.result()
+                if file_metrics is not None:
+                    metrics.merge(file_metrics)
+                primary_lines += usage[0]
+                fallback_lines += usage[1]
+                progress.update(sizes[done])
+                progress.set_postfix_str(os.path.basename(done), refresh=False)
+    return primary_lines, fallback_lines
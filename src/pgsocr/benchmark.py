@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Generator
+from pgsocr import img_utils
+from pgsocr.main import add_florence2_arguments, florence2_factory
+from pgsocr.pgsparser import PGStream, ObjectDefinitionSegment
+from pgsocr.synthetic import write_sup
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+@contextmanager
+def timed_stage(
+    report: dict, name: str, items: Callable[[], int]
+) -> Generator[None, None, None]:
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    count = items()
+    report[name] = {
+        "seconds": elapsed,
+        "items": count,
+        "items_per_sec": count / elapsed if elapsed else None,
+    }
+    if tracing:
+        report[name]["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+
+
+def edit_distance(a: str, b: str) -> int:
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, cb in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ca != cb))
+    return row[-1]
+
+
+def agreement(texts: list[str], reference: list[str]) -> dict:
+    # Without ground truth the reference engine stands in for it
+    errors = sum(edit_distance(t, r) for t, r in zip(texts, reference))
+    chars = sum(len(r) for r in reference)
+    return {
+        "cer": errors / chars if chars else 0.0,
+        "exact_lines": (
+            sum(t == r for t, r in zip(texts, reference)) / len(reference)
+            if reference
+            else None
+        ),
+    }
+
+
+def recognize(engine, images: list) -> list[str]:
+    # Batching engines are timed the way conversions run them
+    if hasattr(engine, "imap"):
+        return list(engine.imap(images))
+    return [engine.get_ocr_text(im) for im in images]
+
+
+def run_benchmark(
+    path: str,
+    engine_factory: Callable | None = None,
+    trace_memory: bool = False,
+    reference_factory: Callable | None = None,
+    preprocess: str = "crop",
+) -> dict:
+    stages: dict = {}
+    # Tracing slows down every allocation, so timings are only comparable between runs with the same setting
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with timed_stage(stages, "parse", lambda: len(stream.segments)):
+            stream = PGStream(path)
+            stream.segments
+
+        ods_list = [s for s in stream.segments if isinstance(s, ObjectDefinitionSegment)]
+        with timed_stage(stages, "rle_decode", lambda: len(ods_list)):
+            for ods in ods_list:
+                img_utils.decode_rle(ods.img_data, ods.width, ods.height)
+
+        with timed_stage(stages, "make_image", lambda: len(images)):
+            images = list(img_utils.extract_images(stream))
+
+        with timed_stage(stages, "preprocess_image", lambda: len(canvases)):
+            canvases = [img_utils.preprocess_image(img_obj.img) for img_obj in images]
+
+        with timed_stage(stages, "preprocess_text", lambda: len(crops)):
+            crops = [
+                img_utils.preprocess_text(img_obj.px, img_obj.pal) for img_obj in images
+            ]
+        # The engines are fed what a conversion with the same -p would feed them
+        preprocessed = canvases if preprocess == "canvas" else crops
+
+        texts = reference = None
+        if engine_factory is not None:
+            engine = engine_factory()
+            with timed_stage(stages, "ocr", lambda: len(preprocessed)):
+                texts = recognize(engine, preprocessed)
+            engine.quit()
+        if reference_factory is not None:
+            engine = reference_factory()
+            with timed_stage(stages, "ocr_reference", lambda: len(preprocessed)):
+                reference = recognize(engine, preprocessed)
+            engine.quit()
+    finally:
+        tracemalloc.stop()
+
+    report = {
+        "file": os.path.basename(path),
+        "bytes": os.path.getsize(path),
+        "lines": len(images),
+        "preprocess": preprocess,
+        "stages": stages,
+        "total_seconds": sum(
+            s["seconds"] for name, s in stages.items() if name != "ocr_reference"
+        ),
+    }
+    report["lines_per_sec"] = (
+        report["lines"] / report["total_seconds"] if report["total_seconds"] else None
+    )
+    if texts is not None and reference is not None:
+        report["agreement"] = agreement(texts, reference)
+    if resource is not None:
+        # ru_maxrss is reported in kilobytes on Linux
+        report["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="pgsocr-bench",
+        description="Time each pgsocr stage on a synthetic or existing SUP file and print a JSON report.",
+    )
+    parser.add_argument(
+        "-i", help="Benchmark an existing SUP file instead of a synthetic one."
+    )
+    parser.add_argument("-o", help="Write the JSON report to a file.")
+    parser.add_argument(
+        "-m",
+        help="Also time the OCR stage with the given engine.",
+        choices=["tesseract", "florence2"],
+        type=str.lower,
+    )
+    parser.add_argument(
+        "-p",
+        "--preprocess",
+        help="Specify how images are prepared for the OCR stage, as in pgsocr. Defaults to crop for tesseract and canvas for Florence2.",
+        choices=["crop", "canvas"],
+        type=str.lower,
+    )
+    add_florence2_arguments(parser)
+    parser.add_argument(
+        "--compare",
+        help="Also run the default Florence2 setup (large, full precision, 3 beams) on the same images and report its speed and how closely the engine agrees with it.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--reference-model-path",
+        help="Load the model of --compare from a local directory.",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        help="Report the peak traced memory of every stage. Makes the stages noticeably slower.",
+        action="store_true",
+    )
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--objects", type=int, default=1)
+    parser.add_argument("--object-width", type=int, default=1200)
+    parser.add_argument("--object-height", type=int, default=80)
+    parser.add_argument("--fragment-size", type=int, default=0xFFEF)
+    parser.add_argument("--palette-updates", type=int, default=0)
+    parser.add_argument("--epoch-size", type=int, default=1)
+    parser.add_argument("--refreshes", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine_factory = None
+    if args.m == "tesseract":
+        from .tesseract_ocr_engine import TesseractOCREngine
+
+        engine_factory = partial(TesseractOCREngine, ["eng"], "|`´®")
+    elif args.m == "florence2":
+        engine_factory = florence2_factory(args)
+
+    preprocess = args.preprocess
+    if preprocess is None:
+        preprocess = "crop" if args.m == "tesseract" else "canvas"
+
+    reference_factory = None
+    if args.compare:
+        from .transformer_ocr_engines import Florence2OCREngine
+
+        reference_factory = partial(
+            Florence2OCREngine,
+            args.batch_size,
+            model_path=args.reference_model_path,
+            threads=args.torch_threads,
+        )
+
+    if args.i is not None:
+        report = run_benchmark(
+            args.i, engine_factory, args.trace_memory, reference_factory, preprocess
+        )
+    else:
+        params = {
+            "events": args.events,
+            "width": args.width,
+            "height": args.height,
+            "objects": args.objects,
+            "object_width": args.object_width,
+            "object_height": args.object_height,
+            "fragment_size": args.fragment_size,
+            "palette_updates": args.palette_updates,
+            "epoch_size": args.epoch_size,
+            "refreshes": args.refreshes,
+            "seed": args.seed,
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "synthetic.sup")
+            write_sup(path, **params)
+            report = run_benchmark(
+                path, engine_factory, args.trace_memory, reference_factory, preprocess
+            )
+        report["synthetic"] = params
+
+    output = json.dumps(report, indent=2)
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            f.write(output + "\n")
+    print(output)
@@ -0,0 +1,87 @@
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
+from PIL import Image
+
+
+# Runs a fast engine on every image and hands only the images it is unsure about to a
+# slower, more accurate engine. The primary engine has to report a confidence.
+class CascadeOCREngine:
+    def __init__(
+        self,
+        primary_factory: Callable,
+        fallback_factory: Callable,
+        threshold: float,
+    ):
+        self.primary = primary_factory()
+        self.fallback = fallback_factory()
+        self.threshold = threshold
+        # Number of images each engine had the final say on
+        self.primary_lines = 0
+        self.fallback_lines = 0
+        # Identifies the engine setup in the OCR result cache
+        self.config_key = (
+            "cascade",
+            getattr(self.primary, "config_key", None),
+            getattr(self.fallback, "config_key", None),
+            threshold,
+        )
+
+    def _accept(self, text: str, conf: float) -> bool:
+        if text and conf >= self.threshold:
+            self.primary_lines += 1
+            return True
+        self.fallback_lines += 1
+        return False
+
+    def get_ocr_text(self, im: Image.Image) -> str:
+        text, conf = self.primary.get_ocr_text_conf(im)
+        if self._accept(text, conf):
+            return text
+        return self.fallback.get_ocr_text(im)
+
+    def imap(self, images: Iterable[Image.Image]) -> Iterator[str]:
+        # The images the primary engine is working on are kept for a possible second pass
+        seen: deque[Image.Image] = deque()
+
+        def tee() -> Iterator[Image.Image]:
+            for im in images:
+                seen.append(im)
+                yield im
+
+        if hasattr(self.primary, "imap_conf"):
+            results = self.primary.imap_conf(tee())
+        else:
+            results = (self.primary.get_ocr_text_conf(im) for im in tee())
+
+        # Results in input order, None until the fallback has recognized the image.
+        # Uncertain images are collected into batches for the fallback.
+        pending: deque[list[Optional[str]]] = deque()
+        batch: list[tuple[Image.Image, list[Optional[str]]]] = []
+        for text, conf in results:
+            im = seen.popleft()
+            slot: list[Optional[str]] = [text if self._accept(text, conf) else None]
+            pending.append(slot)
+            if slot[0] is None:
+                batch.append((im, slot))
+                if len(batch) >= getattr(self.fallback, "batch_size", 1):
+                    self._run_fallback(batch)
+                    batch = []
+            while pending and pending[0][0] is not None:
+                yield pending.popleft()[0]  # type: ignore
+        if batch:
+            self._run_fallback(batch)
+        while pending:
+            yield pending.popleft()[0]  # type: ignore
+
+    def _run_fallback(self, batch: list[tuple[Image.Image, list[Optional[str]]]]):
+        images = [im for im, _ in batch]
+        if hasattr(self.fallback, "get_ocr_text_batch"):
+            texts = self.fallback.get_ocr_text_batch(images)
+        else:
+            texts = [self.fallback.get_ocr_text(im) for im in images]
+        for (_, slot), text in zip(batch, texts):
+            slot[0] = text
+
+    def quit(self):
+        self.primary.quit()
+        self.fallback.quit()
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+from typing import BinaryIO, Hashable, Optional, TextIO
+
+READ_SIZE = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class HashingReader:
+    # Computes file_digest of a file while it is being read for something else.
+    # Every byte is hashed once in file order, ranges that are seeked over are read
+    # for the hash and the rest of the file is read when the digest is taken.
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.hash = hashlib.blake2b(digest_size=16)
+        self.pos = 0
+        self.hashed = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self.pos > self.hashed:
+            self._hash_to(self.pos)
+        data = self.f.read(size)
+        end = self.pos + len(data)
+        if end > self.hashed:
+            self.hash.update(data[self.hashed - self.pos :])
+            self.hashed = end
+        self.pos = end
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        # Only seeking forward skips data, it is read lazily by the next read
+        self.pos = self.f.seek(offset, whence)
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def _hash_to(self, end: int) -> None:
+        self.f.seek(self.hashed)
+        while self.hashed < end:
+            chunk = self.f.read(min(READ_SIZE, end - self.hashed))
+            if not chunk:
+                break
+            self.hash.update(chunk)
+            self.hashed += len(chunk)
+        self.f.seek(self.pos)
+
+    def hexdigest(self) -> str:
+        self.f.seek(self.hashed)
+        while chunk := self.f.read(READ_SIZE):
+            self.hash.update(chunk)
+            self.hashed += len(chunk)
+        self.f.seek(self.pos)
+        return self.hash.hexdigest()
+
+
+class Checkpoint:
+    # Number of written events between checkpoints
+    INTERVAL = 16
+
+    def __init__(
+        self,
+        in_path: str,
+        out_files: list[str],
+        config: Hashable,
+        input_hash: Optional[str] = None,
+    ):
+        # Output goes to .part files that are renamed once the input is fully converted,
+        # the .ckpt file next to them records how far every .part file is complete
+        self.out_files = out_files
+        self.part_files = [f + ".part" for f in out_files]
+        base = os.path.splitext(out_files[0])[0]
+        self.ckpt_file = (
+            base + "".join(os.path.splitext(f)[1] for f in out_files) + ".ckpt"
+        )
+        # Tracks demuxed from one container share the hash of the container
+        self.input_hash = input_hash if input_hash is not None else file_digest(in_path)
+        self.config = repr(config)
+        self.events = 0
+        self.offsets: list[int] = []
+        self.done = False
+
+        state = self._load()
+        if state is None:
+            return
+        if state["done"]:
+            # Output removed since then is converted again from the start
+            self.done = all(os.path.exists(f) for f in out_files)
+            if self.done:
+                self.events = state["events"]
+        elif all(
+            os.path.exists(f) and os.path.getsize(f) >= offset
+            for f, offset in zip(self.part_files, state["offsets"])
+        ):
+            self.events = state["events"]
+            self.offsets = state["offsets"]
+
+    def _load(self) -> Optional[dict]:
+        try:
+            with open(self.ckpt_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Results of a different input or different settings cannot be reused
+        if state.get("input") != self.input_hash or state.get("config") != self.config:
+            return None
+        if len(state.get("offsets", [])) != len(self.out_files):
+            return None
+        return state
+
+    def _save(self) -> None:
+        state = {
+            "input": self.input_hash,
+            "config": self.config,
+            "events": self.events,
+            "offsets": self.offsets,
+            "done": self.done,
+        }
+        tmp_file = self.ckpt_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.ckpt_file)
+
+    def restore(self) -> bool:
+        # Anything written after the last checkpoint is dropped and converted again
+        if not self.offsets:
+            return False
+        for part_file, offset in zip(self.part_files, self.offsets):
+            os.truncate(part_file, offset)
+        return True
+
+    def update(self, outfiles: list[TextIO], events: int) -> None:
+        if events - self.events >= self.INTERVAL:
+            self.commit(outfiles, events)
+
+    def commit(self, outfiles: list[TextIO], events: int) -> None:
+        for outfile in outfiles:
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        self.events = events
+        self.offsets = [os.fstat(f.fileno()).st_size for f in outfiles]
+        self._save()
+
+    def finish(self, outfiles: list[TextIO], events: int) -> None:
+        self.commit(outfiles, events)
+        for outfile, part_file, out_file in zip(
+            outfiles, self.part_files, self.out_files
+        ):
+            outfile.close()
+            os.replace(part_file, out_file)
+        self.done = True
+        self._save()
@@ -0,0 +1,15 @@
+import json
+import socket
+from typing import Iterable, Iterator
+
+# Only uses the standard library so that submitting jobs to a running server starts instantly
+
+
+def submit_jobs(socket_path: str, jobs: Iterable[dict]) -> Iterator[dict]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as f:
+            for job in jobs:
+                f.write((json.dumps(job) + "\n").encode())
+                f.flush()
+                yield json.loads(f.readline())
@@ -0,0 +1,297 @@
+import os
+import warnings
+import zlib
+from typing import BinaryIO, Optional
+from pgsocr.pgsparser import PGStream
+
+M2TS_EXTENSIONS = {".m2ts", ".mts", ".ts"}
+MKV_EXTENSIONS = {".mkv", ".mks"}
+# Stream type of Blu-ray presentation graphics in the program map table
+PGS_STREAM_TYPE = 0x90
+PGS_CODEC_ID = "S_HDMV/PGS"
+TS_PACKET_SIZE = 188
+READ_PACKETS = 8192
+
+# Matroska element ids, masters are descended into and everything else is read or skipped
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_TIMESTAMP_SCALE = 0x2AD7B1
+EBML_TRACKS = 0x1654AE6B
+EBML_TRACK_ENTRY = 0xAE
+EBML_TRACK_NUMBER = 0xD7
+EBML_CODEC_ID = 0x86
+EBML_LANGUAGE = 0x22B59C
+EBML_CONTENT_ENCODINGS = 0x6D80
+EBML_CONTENT_ENCODING = 0x6240
+EBML_CONTENT_COMPRESSION = 0x5034
+EBML_CONTENT_COMP_ALGO = 0x4254
+EBML_CONTENT_COMP_SETTINGS = 0x4255
+EBML_CLUSTER = 0x1F43B675
+EBML_CLUSTER_TIMESTAMP = 0xE7
+EBML_BLOCK_GROUP = 0xA0
+EBML_BLOCK = 0xA1
+EBML_SIMPLE_BLOCK = 0xA3
+EBML_MASTERS = {
+    EBML_SEGMENT,
+    EBML_INFO,
+    EBML_TRACKS,
+    EBML_TRACK_ENTRY,
+    EBML_CONTENT_ENCODINGS,
+    EBML_CONTENT_ENCODING,
+    EBML_CONTENT_COMPRESSION,
+    EBML_CLUSTER,
+    EBML_BLOCK_GROUP,
+}
+COMP_ZLIB = 0
+COMP_HEADER_STRIPPING = 3
+
+
+def is_container(path: str) -> bool:
+    ext = os.path.splitext(path)[1].lower()
+    return ext in M2TS_EXTENSIONS or ext in MKV_EXTENSIONS
+
+
+def append_segments(out: bytearray, data: bytes, pts: int, dts: int) -> None:
+    # Containers carry the segments without the PG magic and timestamps of SUP files,
+    # every segment gets the 90 kHz timestamps of the packet it came in
+    header = (
+        b"PG"
+        + (pts & 0xFFFFFFFF).to_bytes(4, byteorder="big")
+        + (dts & 0xFFFFFFFF).to_bytes(4, byteorder="big")
+    )
+    idx = 0
+    while idx + 3 <= len(data):
+        end = idx + 3 + int.from_bytes(data[idx + 1 : idx + 3], byteorder="big")
+        if end > len(data):
+            break
+        out += header
+        out += data[idx:end]
+        idx = end
+    if idx != len(data):
+        warnings.warn(
+            "Incomplete PGS segment in a container packet.",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+
+
+def _pes_timestamp(b: bytes) -> int:
+    return (
+        ((b[0] >> 1) & 0x07) << 30
+        | b[1] << 22
+        | (b[2] >> 1) << 15
+        | b[3] << 7
+        | b[4] >> 1
+    )
+
+
+def _finish_pes(pes: bytearray, out: bytearray) -> None:
+    if len(pes) < 9 or pes[:3] != b"\x00\x00\x01":
+        warnings.warn("Invalid PES packet in PGS stream.", RuntimeWarning, stacklevel=2)
+        return
+    flags = pes[7]
+    start = 9 + pes[8]
+    pts = _pes_timestamp(pes[9:14]) if flags & 0x80 else 0
+    dts = _pes_timestamp(pes[14:19]) if flags & 0x40 else pts
+    length = int.from_bytes(pes[4:6], byteorder="big")
+    end = 6 + length if length else len(pes)
+    append_segments(out, pes[start:end], pts, dts)
+
+
+def _psi_section(payload: memoryview) -> memoryview:
+    # Skips the pointer field, sections are assumed to fit in one packet as on Blu-ray
+    section = payload[1 + payload[0] :]
+    length = ((section[1] & 0x0F) << 8) | section[2]
+    # Without the CRC
+    return section[: 3 + length - 4]
+
+
+def demux_m2ts(f: BinaryIO) -> dict[str, bytearray]:
+    head = f.read(TS_PACKET_SIZE * 3 + 12)
+    f.seek(0)
+    # Blu-ray m2ts packets start with a 4 byte timecode, plain transport streams do not
+    for packet_size, sync in ((TS_PACKET_SIZE + 4, 4), (TS_PACKET_SIZE, 0)):
+        if all(
+            len(head) > sync + i * packet_size and head[sync + i * packet_size] == 0x47
+            for i in range(3)
+        ):
+            break
+    else:
+        raise ValueError("Not a valid MPEG transport stream.")
+
+    pmt_pids: set[int] = set()
+    pgs_pids: set[int] = set()
+    pes: dict[int, bytearray] = {}
+    tracks: dict[int, bytearray] = {}
+    while chunk := f.read(packet_size * READ_PACKETS):
+        view = memoryview(chunk)
+        for pos in range(sync, len(chunk) - TS_PACKET_SIZE + 1, packet_size):
+            packet = view[pos : pos + TS_PACKET_SIZE]
+            if packet[0] != 0x47:
+                continue
+            pid = ((packet[1] & 0x1F) << 8) | packet[2]
+            if pid not in pgs_pids and pid not in pmt_pids and pid != 0:
+                continue
+            control = (packet[3] >> 4) & 0x03
+            if not control & 0x01:
+                continue
+            payload = packet[4 + (1 + packet[4] if control & 0x02 else 0) :]
+            unit_start = packet[1] & 0x40
+
+            if pid in pgs_pids:
+                if unit_start:
+                    if pid in pes:
+                        _finish_pes(pes[pid], tracks[pid])
+                    pes[pid] = bytearray(payload)
+                elif pid in pes:
+                    pes[pid] += payload
+            elif not unit_start:
+                continue
+            elif pid == 0:
+                section = _psi_section(payload)
+                for i in range(8, len(section), 4):
+                    program = int.from_bytes(section[i : i + 2], byteorder="big")
+                    if program:
+                        pmt_pids.add(((section[i + 2] & 0x1F) << 8) | section[i + 3])
+            else:
+                section = _psi_section(payload)
+                i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+                while i + 5 <= len(section):
+                    es_pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+                    if section[i] == PGS_STREAM_TYPE and es_pid not in pgs_pids:
+                        pgs_pids.add(es_pid)
+                        tracks[es_pid] = bytearray()
+                    i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
+
+    for pid, buf in pes.items():
+        _finish_pes(buf, tracks[pid])
+    return {f"{pid:04x}": tracks[pid] for pid in sorted(tracks)}
+
+
+def _read_vint(f: BinaryIO, keep_marker: bool) -> Optional[tuple[int, int]]:
+    # Returns the value and its length, the value is -1 for an unknown size
+    first = f.read(1)
+    if not first:
+        return None
+    length = 9 - first[0].bit_length()
+    if length > 8:
+        raise ValueError("Invalid EBML variable size integer.")
+    rest = f.read(length - 1)
+    value = int.from_bytes(first + rest, byteorder="big")
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return -1, length
+    return value, length
+
+
+def _vint_at(data: bytes, idx: int) -> tuple[int, int]:
+    length = 9 - data[idx].bit_length()
+    value = int.from_bytes(data[idx : idx + length], byteorder="big")
+    return value & ((1 << (7 * length)) - 1), length
+
+
+def demux_mkv(f: BinaryIO) -> dict[str, bytearray]:
+    timestamp_scale = 1000000
+    cluster_timestamp = 0
+    # Track number to [codec, language, compression algorithm, compression settings]
+    entries: dict[int, list] = {}
+    entry: list = []
+    tracks: dict[int, bytearray] = {}
+
+    # Elements are read in one flat pass, descending into masters instead of tracking
+    # their ends, which also covers clusters of unknown size
+    while (element := _read_vint(f, keep_marker=True)) is not None:
+        element_id = element[0]
+        size_vint = _read_vint(f, keep_marker=False)
+        if size_vint is None:
+            break
+        size = size_vint[0]
+        if element_id in EBML_MASTERS:
+            if element_id == EBML_TRACK_ENTRY:
+                entry = [None, "und", None, b""]
+            elif element_id == EBML_CONTENT_COMPRESSION:
+                entry[2] = COMP_ZLIB
+            elif element_id == EBML_CLUSTER and not tracks:
+                tracks = {
+                    n: bytearray() for n, e in entries.items() if e[0] == PGS_CODEC_ID
+                }
+                if not tracks:
+                    break
+            continue
+        if size < 0:
+            raise ValueError("Element of unknown size in Matroska file.")
+
+        if element_id in (EBML_SIMPLE_BLOCK, EBML_BLOCK):
+            head = f.read(min(size, 8))
+            track, length = _vint_at(head, 0)
+            if track not in tracks:
+                f.seek(size - len(head), os.SEEK_CUR)
+                continue
+            block = head + f.read(size - len(head))
+            timestamp = cluster_timestamp + int.from_bytes(
+                block[length : length + 2], byteorder="big", signed=True
+            )
+            if block[length + 2] & 0x06:
+                warnings.warn(
+                    "Laced PGS blocks are not supported, skipping block.",
+                    RuntimeWarning,
+                    stacklevel=2,
+                )
+                continue
+            data = block[length + 3 :]
+            _, _, algo, settings = entries[track]
+            if algo == COMP_ZLIB:
+                data = zlib.decompress(data)
+            elif algo == COMP_HEADER_STRIPPING:
+                data = settings + data
+            pts = timestamp * timestamp_scale * 90 // 1000000
+            append_segments(tracks[track], data, pts, pts)
+        elif element_id in (
+            EBML_TIMESTAMP_SCALE,
+            EBML_CLUSTER_TIMESTAMP,
+            EBML_TRACK_NUMBER,
+            EBML_CONTENT_COMP_ALGO,
+        ):
+            value = int.from_bytes(f.read(size), byteorder="big")
+            if element_id == EBML_TIMESTAMP_SCALE:
+                timestamp_scale = value
+            elif element_id == EBML_CLUSTER_TIMESTAMP:
+                cluster_timestamp = value
+            elif element_id == EBML_TRACK_NUMBER:
+                entries[value] = entry
+            else:
+                entry[2] = value
+        elif element_id == EBML_CODEC_ID:
+            entry[0] = f.read(size).rstrip(b"\x00").decode("ascii", "replace")
+        elif element_id == EBML_LANGUAGE:
+            entry[1] = f.read(size).rstrip(b"\x00").decode("ascii", "replace")
+        elif element_id == EBML_CONTENT_COMP_SETTINGS:
+            entry[3] = f.read(size)
+        else:
+            f.seek(size, os.SEEK_CUR)
+
+    return {
+        f"{n}_{entries[n][1]}" if entries[n][1] != "und" else str(n): tracks[n]
+        for n in sorted(tracks)
+    }
+
+
+def demux(path: str, f: Optional[BinaryIO] = None) -> dict[str, bytearray]:
+    # All PGS tracks are collected in a single pass over the container
+    if f is None:
+        with open(path, "rb") as f:
+            return demux(path, f)
+    if os.path.splitext(path)[1].lower() in MKV_EXTENSIONS:
+        return demux_mkv(f)
+    return demux_m2ts(f)
+
+
+def open_tracks(path: str, f: Optional[BinaryIO] = None) -> list[PGStream]:
+    stem = os.path.splitext(os.path.split(path)[1])[0]
+    streams = []
+    for label, data in demux(path, f).items():
+        if data:
+            streams.append(PGStream.from_bytes(data, f"{stem}_{label}.sup"))
+    return streams
@@ -2,10 +2,13 @@ import numpy as np
 import numpy.typing as npt
 from PIL import Image, ImageOps
 import warnings
-from pgsocr.pgsparser import PGStream, ObjectDefinitionSegment, PaletteDefinitionSegment, PGSImageObject
-from typing import Generator
+from pgsocr.pgsparser import COMPOSITION_STATE, PGStream, PGStreamReader, ObjectDefinitionSegment, PaletteDefinitionSegment, PaletteEntry, PGSImageObject
+from pgsocr.metrics import Metrics, NullMetrics, NULL_METRICS
+from collections import deque
+from typing import Generator, Iterable, Optional
 
 
+# Pure Python reference decoder, decode_rle must produce the same pixels.
 def read_rle_bytes(ods_bytes: bytes) -> list[int]:
 
     pixels = []
@@ -54,6 +57,84 @@ def read_rle_bytes(ods_bytes: bytes) -> list[int]:
     return pixels
 
 
+def decode_rle(ods_bytes: bytes, width: int, height: int) -> npt.NDArray[np.uint8]:
+    data = np.frombuffer(ods_bytes, dtype=np.uint8)
+    n = len(data)
+
+    # First pass: walk the escape codes only. Every non zero byte at a code boundary is a
+    # single pixel of that color, so only the bytes following a zero need to be skipped.
+    zeros = np.flatnonzero(data == 0).tolist()
+    escapes = []
+    incrs = []
+    i = -1
+    for z in zeros:
+        if z < i:
+            continue
+        check = ods_bytes[z + 1]
+        if check < 64:
+            incr = 2
+        elif check < 192:
+            incr = 3
+        else:
+            incr = 4
+        escapes.append(z)
+        incrs.append(incr)
+        i = z + incr
+
+    esc = np.array(escapes, dtype=np.intp)
+    esc_incr = np.array(incrs, dtype=np.intp)
+    is_code = np.ones(n, dtype=bool)
+    is_code[esc + 1] = False
+    is_code[(esc + 2)[esc_incr > 2]] = False
+    is_code[(esc + 3)[esc_incr > 3]] = False
+
+    # Second pass: each code points at the byte holding its color and carries a run length,
+    # zero colored runs point at their own escape byte.
+    codes = np.flatnonzero(is_code)
+    lengths = np.ones(len(codes), dtype=np.intp)
+    color_pos = codes.copy()
+    code_esc = np.searchsorted(codes, esc)
+    check = data[esc + 1].astype(np.intp)
+    ext = np.zeros(len(esc), dtype=np.intp)
+    ext[esc_incr > 2] = data[(esc + 2)[esc_incr > 2]]
+    esc_len = np.select(
+        [check < 64, check < 128, check < 192],
+        [check, ((check - 64) << 8) + ext, check - 128],
+        ((check - 192) << 8) + ext,
+    )
+    lengths[code_esc] = esc_len
+    color_pos[code_esc] = np.select(
+        [check < 128, check < 192], [esc, esc + 2], esc + 3
+    )
+
+    flat = data[np.repeat(color_pos, lengths)]
+    line_ends = np.cumsum(lengths)[code_esc[check == 0]]
+
+    if len(flat) != (line_ends[-1] if len(line_ends) else 0):
+        warnings.warn(
+            "Improper image decode; hanging pixels found after the last line.",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+    if len(line_ends) != height:
+        warnings.warn(
+            f"Decoded {len(line_ends)} lines but the object height is {height}.",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+
+    line_starts = np.concatenate(([0], line_ends[:-1]))
+    if len(line_ends) == height and (line_ends - line_starts == width).all():
+        return flat[: width * height].reshape(height, width)
+
+    # Rows shorter than the object width are left padded, matching read_rle_bytes output
+    px = np.full((height, width), 255, dtype=np.uint8)
+    for row, (start, end) in enumerate(zip(line_starts[:height], line_ends[:height])):
+        line = flat[max(start, end - width) : end]
+        px[row, width - len(line) :] = line
+    return px
+
+
 def ycbcr2rgb(ar: npt.NDArray) -> npt.NDArray[np.uint8]:
     xform = np.array([[1, 0, 1.402], [1, -0.34414, -0.71414], [1, 1.772, 0]])
     rgb = ar.astype(float)
@@ -68,30 +149,65 @@ def ycbcr2rgb(ar: npt.NDArray) -> npt.NDArray[np.uint8]:
     return np.uint8(rgb)  # type: ignore
 
 
-def px_rgb_a(
-    ods: ObjectDefinitionSegment, pds: PaletteDefinitionSegment
-) -> tuple[npt.NDArray[np.uint8], npt.NDArray[np.uint8], npt.NDArray[np.uint8]]:
-    px = read_rle_bytes(ods.img_data)
-    px = np.array([[255] * (ods.width - len(l)) + l for l in px], dtype=np.uint8)  # type: ignore
+def palette_lut(pds: PaletteDefinitionSegment) -> npt.NDArray[np.uint8]:
+    # One RGBA row per palette index, so a whole bitmap is composed with lut[px]
+    entries = pds.entries
+    lut = np.empty((256, 4), dtype=np.uint8)
+    lut[:, :3] = ycbcr2rgb(entries[:, :3])
+    lut[:, 3] = entries[:, 3]
+    return lut
 
-    ycbcr = np.array([(entry.Y, entry.Cb, entry.Cr) for entry in pds.palette])
 
-    rgb = ycbcr2rgb(ycbcr)
+class PaletteCache:
+    def __init__(self):
+        self.luts: dict[tuple[int, int, bytes], npt.NDArray[np.uint8]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pds: PaletteDefinitionSegment) -> npt.NDArray[np.uint8]:
+        # The palette content is part of the key, a reused id/version never returns a stale table
+        key = (pds.id, pds.version, bytes(pds.payload))
+        lut = self.luts.get(key)
+        if lut is None:
+            self.misses += 1
+            lut = palette_lut(pds)
+            self.luts[key] = lut
+        else:
+            self.hits += 1
+        return lut
+
+    def invalidate(self, palette_id: int) -> None:
+        for key in [k for k in self.luts if k[0] == palette_id]:
+            del self.luts[key]
+
+    def clear(self) -> None:
+        self.luts.clear()
+
+    def __repr__(self) -> str:
+        return f"PaletteCache(hits={self.hits}, misses={self.misses})"
 
-    a = [entry.Alpha for entry in pds.palette]
-    a = np.array([[a[x] for x in l] for l in px], dtype=np.uint8)
 
-    return px, rgb, a
+def _alpha(pal: list[PaletteEntry]) -> npt.NDArray[np.uint8]:
+    return np.array([entry.Alpha for entry in pal], dtype=np.uint8)
 
 
-def make_image(ods: ObjectDefinitionSegment, pds: PaletteDefinitionSegment):
-    px, rgb, a = px_rgb_a(ods, pds)
-    alpha = Image.fromarray(a, mode="L")
-    img = Image.fromarray(px, mode="P")
-    img.putpalette(rgb)
-    img.putalpha(alpha)
-    img = img.convert("RGBA")
-    return img
+def compose_image(px: npt.NDArray[np.uint8], lut: npt.NDArray[np.uint8]) -> Image.Image:
+    rgba = lut[px]
+    height, width = px.shape
+    # The image shares memory with the composed array
+    return Image.frombuffer(
+        "RGBA", (width, height), rgba, "raw", "RGBA", 0, 1  # type: ignore
+    )
+
+
+def make_image(
+    ods: ObjectDefinitionSegment,
+    pds: PaletteDefinitionSegment,
+    palette_cache: Optional[PaletteCache] = None,
+):
+    px = decode_rle(ods.img_data, ods.width, ods.height)
+    lut = palette_cache.get(pds) if palette_cache is not None else palette_lut(pds)
+    return compose_image(px, lut)
 
 
 def preprocess_image(im: Image.Image) -> Image.Image:
@@ -107,47 +223,390 @@ def preprocess_image(im: Image.Image) -> Image.Image:
     return canvas
 
 
-def extract_images(pgsobj: PGStream) -> Generator[PGSImageObject, None, None]:
-    seen_pcs = set()
-    for e in pgsobj.epochs:
-        ods_cache: dict[int, ObjectDefinitionSegment] = {}
-        pds_cache: dict[int, PaletteDefinitionSegment] = {}
+# Tesseract is most accurate with an x-height of roughly 20 to 30 pixels
+TARGET_X_HEIGHT = 24
+TEXT_MARGIN = 10
 
-        screen: dict[ObjectDefinitionSegment, PGSImageObject] = {}
-        for ds in e.display_sets:
-            for pal in ds.pds:
-                pds_cache[pal.id] = pal
 
-            for obj in ds.ods:
-                ods_cache[obj.id] = obj
+def text_lines(mask: npt.NDArray[np.bool_]) -> list[tuple[int, int]]:
+    # Bands of consecutive rows that contain any text pixels, as (top, bottom) pairs
+    rows = np.concatenate(([False], mask.any(axis=1), [False]))
+    edges = np.flatnonzero(rows[1:] != rows[:-1])
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
 
-            pcs = ds.pcs[0]
-            cur_pts = pcs.presentation_timestamp
-            pds_to_use = pds_cache[pcs.palette_id]
 
-            ods_in_ds = set()
-            if pcs.composition_number in seen_pcs:
-                continue
-            seen_pcs.add(pcs.composition_number)
-            for comp in pcs.composition_objects:
-                ods_to_use = ods_cache[comp.object_id]
-                img = make_image(ods_to_use, pds_to_use)
-                if comp.is_cropped:
-                    crop_rect = (
-                        comp.crop_x_offset,
-                        comp.crop_y_offset,
-                        comp.crop_x_offset + comp.crop_width,
-                        comp.crop_y_offset + comp.crop_height,
-                    )
-                    img = img.crop(crop_rect)
-
-                ods_in_ds.add(ods_to_use)
-                screen[ods_to_use] = PGSImageObject(
-                    img, comp.x_pos, comp.y_pos, cur_pts, -1, pds_to_use.palette
+def estimate_x_height(mask: npt.NDArray[np.bool_]) -> int:
+    heights = []
+    for top, bottom in text_lines(mask):
+        # Rows inside the x-height are far denser than the ascender and descender rows
+        density = mask[top:bottom].sum(axis=1)
+        heights.append(int((density >= density.max() / 2).sum()))
+    return int(np.median(heights)) if heights else 0
+
+
+def otsu_threshold(gray: npt.NDArray[np.uint8]) -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(float)
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+
+def preprocess_text(
+    px: npt.NDArray[np.uint8], pal: list[PaletteEntry]
+) -> Image.Image:
+    # Luma composited over black and opacity of every palette entry
+    gray_lut = np.array([entry.Y * entry.Alpha // 255 for entry in pal], dtype=np.uint8)
+    alpha_lut = np.array([entry.Alpha for entry in pal], dtype=np.uint8)
+
+    visible = alpha_lut[px] > 0
+    if not visible.any():
+        return Image.new("L", (2 * TEXT_MARGIN, 2 * TEXT_MARGIN), 255)
+    rows = np.flatnonzero(visible.any(axis=1))
+    cols = np.flatnonzero(visible.any(axis=0))
+    gray = gray_lut[px[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]]
+
+    threshold = otsu_threshold(gray)
+    x_height = estimate_x_height(gray > threshold)
+    im = Image.fromarray(gray, mode="L")
+    if x_height:
+        scale = min(max(TARGET_X_HEIGHT / x_height, 0.25), 4.0)
+        if abs(scale - 1) > 0.1:
+            size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+            im = im.resize(size, Image.Resampling.LANCZOS)
+
+    # Dark text on a white background
+    im = im.point(lambda p: 0 if p > threshold else 255)
+    return ImageOps.expand(im, border=TEXT_MARGIN, fill=255)
+
+
+def pad_to_square(im: Image.Image) -> Image.Image:
+    # Models that resize every input to a square would stretch a wide text line otherwise
+    if im.width == im.height:
+        return im
+    side = max(im.size)
+    canvas = Image.new(im.mode, (side, side), "white")
+    canvas.paste(im, ((side - im.width) // 2, (side - im.height) // 2))
+    return canvas
+
+
+def preprocess_image_object(img_obj: PGSImageObject, mode: str = "crop") -> Image.Image:
+    if mode == "canvas" or img_obj.px is None:
+        return preprocess_image(img_obj.img)
+    elif mode == "crop":
+        return preprocess_text(img_obj.px, img_obj.pal)
+    else:
+        raise ValueError(f"Unknown preprocessing mode '{mode}' specified.")
+
+
+def line_bands(
+    px: npt.NDArray[np.uint8], pal: list[PaletteEntry]
+) -> list[tuple[int, int]]:
+    bands = text_lines(_alpha(pal)[px] > 0)
+    if len(bands) < 2:
+        return bands
+
+    # Accents, dots and punctuation separated from their line show up as thin bands,
+    # they are merged into the closest full height line
+    tallest = max(bottom - top for top, bottom in bands)
+    lines = [[top, bottom] for top, bottom in bands if bottom - top >= tallest / 3]
+    for top, bottom in bands:
+        if bottom - top >= tallest / 3:
+            continue
+        line = min(lines, key=lambda l: max(l[0] - bottom, top - l[1]))
+        line[0] = min(line[0], top)
+        line[1] = max(line[1], bottom)
+    return [(top, bottom) for top, bottom in lines]
+
+
+def split_lines(
+    px: npt.NDArray[np.uint8], pal: list[PaletteEntry]
+) -> list[npt.NDArray[np.uint8]]:
+    return [px[top:bottom] for top, bottom in line_bands(px, pal)]
+
+
+def preprocess_lines(img_obj: PGSImageObject, mode: str = "crop") -> list[Image.Image]:
+    if img_obj.px is None:
+        return [preprocess_image(img_obj.img)]
+    if mode == "canvas":
+        width = img_obj.img.width
+        return [
+            preprocess_image(img_obj.img.crop((0, top, width, bottom)))
+            for top, bottom in line_bands(img_obj.px, img_obj.pal)
+        ]
+    elif mode == "crop":
+        lines = split_lines(img_obj.px, img_obj.pal)
+        return [preprocess_text(line, img_obj.pal) for line in lines]
+    else:
+        raise ValueError(f"Unknown preprocessing mode '{mode}' specified.")
+
+
+# Composition numbers are 16 bit, one that comes back within half of their range is a repeat
+PCS_REPEAT_WINDOW = 32768
+
+
+def extract_images(
+    pgsobj: PGStream | PGStreamReader,
+    palette_cache: Optional[PaletteCache] = None,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    merge: bool = False,
+) -> Generator[PGSImageObject, None, None]:
+    # With merge, palette changes of an object on screen continue its event instead of
+    # replacing it, as --merge-similar does for subtitles that are sent again
+    if palette_cache is None:
+        palette_cache = PaletteCache()
+    # Composition number to the count of compositions read when it was last seen
+    seen_pcs: dict[int, int] = {}
+    pcs_count = 0
+    # Everything below belongs to the current epoch and is dropped when the next one starts
+    ods_cache: dict[int, ObjectDefinitionSegment] = {}
+    pds_cache: dict[int, PaletteDefinitionSegment] = {}
+    # Composed images of the epoch by object id and version, palette id and version
+    # and crop rectangle. Only the current version of each object and palette is kept.
+    compositions: dict[tuple, tuple[Image.Image, npt.NDArray[np.uint8]]] = {}
+    # Decoded pixels by object id and version, shared by all palettes and crops
+    decoded: dict[tuple[int, int], npt.NDArray[np.uint8]] = {}
+
+    screen: dict[ObjectDefinitionSegment, PGSImageObject] = {}
+    # Composition key and position of every object on screen
+    shown: dict[ObjectDefinitionSegment, tuple] = {}
+    palette_cache.clear()
+    # Display sets are taken one at a time, so streamed input is converted as it is read
+    for ds in pgsobj.display_sets:
+        if ds.composition_state == COMPOSITION_STATE.EPOCH_START:
+            for cache in (ods_cache, pds_cache, compositions, decoded, screen, shown):
+                cache.clear()
+            palette_cache.clear()
+
+        for pal in ds.pds:
+            pds_cache[pal.id] = pal
+            for key in [
+                k for k in compositions if k[2] == pal.id and k[3] != pal.version
+            ]:
+                del compositions[key]
+
+        for obj in ds.ods:
+            ods_cache[obj.id] = obj
+            for key in [k for k in decoded if k[0] == obj.id and k[1] != obj.version]:
+                del decoded[key]
+            for key in [
+                k for k in compositions if k[0] == obj.id and k[1] != obj.version
+            ]:
+                del compositions[key]
+
+        pcs = ds.pcs[0]
+        cur_pts = pcs.presentation_timestamp
+        pds_to_use = pds_cache[pcs.palette_id]
+        if pcs.palette_update:
+            palette_cache.invalidate(pcs.palette_id)
+            for key in [k for k in compositions if k[2] == pcs.palette_id]:
+                del compositions[key]
+
+        ods_in_ds = set()
+        # Numbers wrap around in long streams and are used again
+        last = seen_pcs.get(pcs.composition_number)
+        if last is not None and pcs_count - last < PCS_REPEAT_WINDOW:
+            continue
+        seen_pcs[pcs.composition_number] = pcs_count
+        pcs_count += 1
+        for comp in pcs.composition_objects:
+            ods_to_use = ods_cache[comp.object_id]
+            crop_rect = None
+            if comp.is_cropped:
+                crop_rect = (
+                    comp.crop_x_offset,
+                    comp.crop_y_offset,
+                    comp.crop_x_offset + comp.crop_width,
+                    comp.crop_y_offset + comp.crop_height,
                 )
+            key = (
+                ods_to_use.id,
+                ods_to_use.version,
+                pds_to_use.id,
+                pds_to_use.version,
+                crop_rect,
+            )
+            state = (key, comp.x_pos, comp.y_pos)
+            ods_in_ds.add(ods_to_use)
+
+            # Shown again unchanged, e.g. by an acquisition point, the event continues
+            prev = next((o for o, st in shown.items() if st == state), None)
+            if prev is not None:
+                if prev is not ods_to_use:
+                    screen[ods_to_use] = screen.pop(prev)
+                    shown[ods_to_use] = shown.pop(prev)
+                metrics.count("objects_unchanged")
+                continue
+
+            # Only the palette changed, e.g. a fade step, the event continues with the
+            # most opaque version of the subtitle for OCR
+            current = shown.get(ods_to_use)
+            if (
+                merge
+                and current is not None
+                and current[1:] == state[1:]
+                and current[0][:2] == key[:2]
+                and current[0][4] == key[4]
+            ):
+                img_obj = screen[ods_to_use]
+                lut = palette_cache.get(pds_to_use)
+                alpha = lut[:, 3][img_obj.px]
+                metrics.count("palette_changes")
+                if not alpha.any():
+                    # Hidden by the palette, the subtitle is gone from the screen
+                    img_obj.end_ms = cur_pts
+                    yield img_obj
+                    del screen[ods_to_use]
+                    del shown[ods_to_use]
+                    continue
+                if alpha.mean() > _alpha(img_obj.pal)[img_obj.px].mean():
+                    img_obj.img = compose_image(img_obj.px, lut)  # type: ignore
+                    img_obj.pal = pds_to_use.palette
+                shown[ods_to_use] = state
+                continue
+
+            composed = compositions.get(key)
+            if composed is None:
+                px = decoded.get(key[:2])
+                if px is None:
+                    with metrics.time("rle_decode"):
+                        px = decode_rle(
+                            ods_to_use.img_data, ods_to_use.width, ods_to_use.height
+                        )
+                    decoded[key[:2]] = px
+                with metrics.time("make_image"):
+                    img = compose_image(px, palette_cache.get(pds_to_use))
+                    if crop_rect is not None:
+                        img = img.crop(crop_rect)
+                        px = px[crop_rect[1] : crop_rect[3], crop_rect[0] : crop_rect[2]]
+                composed = compositions[key] = (img, px)
+            else:
+                metrics.count("composition_cache_hits")
+            img, px = composed
+            # An object the palette hides only becomes an event once it is visible
+            if merge and not palette_cache.get(pds_to_use)[:, 3][px].any():
+                continue
+
+            screen[ods_to_use] = PGSImageObject(
+                img, comp.x_pos, comp.y_pos, cur_pts, -1, pds_to_use.palette, px
+            )
+            shown[ods_to_use] = state
+
+        for k, v in screen.copy().items():
+            if k not in ods_in_ds:
+                v.end_ms = cur_pts
+                yield v
+                del screen[k]
+                del shown[k]
+
+
+# Events closer than this are treated as one subtitle re-sent by the stream
+MERGE_MAX_GAP_MS = 50
+# Largest change, in pixels, of the position of the visible pixels between merged events
+MERGE_MAX_SHIFT = 8
+# Smallest intersection over union of the visible pixels of merged events. Different
+# lines of dialogue at the same place differ by far more than the edge pixels a fade
+# step or a re-encode changes.
+MERGE_MIN_IOU = 0.98
+# Number of recent events a new event is compared with, enough for every object on screen
+MERGE_WINDOW = 4
+
+
+def visibility_signature(
+    img_obj: PGSImageObject,
+) -> tuple[tuple[npt.NDArray[np.bool_], int, int], float]:
+    # Mask of the visible pixels, which stays the same through palette fades, cut to the
+    # pixels and with their position on screen, and the mean opacity of the event
+    if img_obj.px is None:
+        alpha = np.asarray(img_obj.img.getchannel("A"))
+    else:
+        alpha = _alpha(img_obj.pal)[img_obj.px]
+    visible = alpha > 0
+    rows = np.flatnonzero(visible.any(axis=1))
+    cols = np.flatnonzero(visible.any(axis=0))
+    if not rows.size:
+        return (visible[:0, :0], img_obj.x_pos, img_obj.y_pos), 0.0
+    mask = visible[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+    x_pos = img_obj.x_pos + int(cols[0])
+    y_pos = img_obj.y_pos + int(rows[0])
+    return (mask, x_pos, y_pos), float(alpha.mean())
+
+
+def _overlap(
+    mask_a: npt.NDArray[np.bool_], mask_b: npt.NDArray[np.bool_], dx: int, dy: int
+) -> float:
+    # Intersection over union of the masks with b placed at (dx, dy) relative to a
+    left, top = min(0, dx), min(0, dy)
+    right = max(mask_a.shape[1], dx + mask_b.shape[1])
+    bottom = max(mask_a.shape[0], dy + mask_b.shape[0])
+    a = np.zeros((bottom - top, right - left), dtype=np.bool_)
+    b = np.zeros_like(a)
+    a[-top : -top + mask_a.shape[0], -left : -left + mask_a.shape[1]] = mask_a
+    b[dy - top : dy - top + mask_b.shape[0], dx - left : dx - left + mask_b.shape[1]] = (
+        mask_b
+    )
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+def _same_subtitle(
+    a: PGSImageObject,
+    b: PGSImageObject,
+    sig_a: tuple[npt.NDArray[np.bool_], int, int],
+    sig_b: tuple[npt.NDArray[np.bool_], int, int],
+) -> bool:
+    if not 0 <= b.start_ms - a.end_ms <= MERGE_MAX_GAP_MS:
+        return False
+    mask_a, x_a, y_a = sig_a
+    mask_b, x_b, y_b = sig_b
+    if abs(x_a - x_b) > MERGE_MAX_SHIFT or abs(y_a - y_b) > MERGE_MAX_SHIFT:
+        return False
+    # Compared where both are shown, which keeps a fade that loses edge pixels together,
+    # and aligned, for a subtitle that moved as a whole
+    return (
+        _overlap(mask_a, mask_b, x_b - x_a, y_b - y_a) >= MERGE_MIN_IOU
+        or _overlap(mask_a, mask_b, 0, 0) >= MERGE_MIN_IOU
+    )
+
 
-            for k, v in screen.copy().items():
-                if k not in ods_in_ds:
-                    v.end_ms = cur_pts
-                    yield v
-                    del screen[k]
+def merge_similar(
+    img_objs: Iterable[PGSImageObject],
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+) -> Generator[PGSImageObject, None, None]:
+    # A subtitle re-sent as a new composition, e.g. as a new object, slightly moved or as
+    # a fade step, continues the event it follows instead of being recognized again.
+    # The most opaque version of the subtitle is kept for OCR.
+    recent: deque[list] = deque()
+    for img_obj in img_objs:
+        with metrics.time("merge_similar"):
+            signature, opacity = visibility_signature(img_obj)
+            match = next(
+                (
+                    r
+                    for r in reversed(recent)
+                    if _same_subtitle(r[0], img_obj, r[1], signature)
+                ),
+                None,
+            )
+        if match is not None:
+            kept = match[0]
+            if opacity > match[2]:
+                kept.img = img_obj.img
+                kept.x_pos = img_obj.x_pos
+                kept.y_pos = img_obj.y_pos
+                kept.pal = img_obj.pal
+                kept.px = img_obj.px
+                match[1] = signature
+                match[2] = opacity
+            kept.end_ms = img_obj.end_ms
+            metrics.count("events_merged")
+            continue
+        recent.append([img_obj, signature, opacity])
+        if len(recent) > MERGE_WINDOW:
+            yield recent.popleft()[0]
+    for r in recent:
+        yield r[0]
@@ -1,10 +1,312 @@
 import argparse
+import os
+import sys
 import textwrap
+from functools import partial
 from pathlib import Path
-from pgsocr.supconvert import supconvert
+
+# Everything that pulls in NumPy, PIL or an OCR library is imported once it is needed,
+# so argument errors, --help and --connect return without paying for it
+
+
+def add_florence2_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--batch-size",
+        help="(Only if using Florence2) Specify the number of images to run through the model at once.",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--florence2-model",
+        help="(Only if using Florence2) Specify the model size. base is several times faster than large and a little less accurate.",
+        choices=["base", "large"],
+        type=str.lower,
+        default="large",
+    )
+    parser.add_argument(
+        "--model-path",
+        help="(Only if using Florence2) Load the model from a local directory instead of downloading it. Nothing is fetched from the network.",
+    )
+    parser.add_argument(
+        "--quantize",
+        help="(Only if using Florence2) Quantize the linear layers of the model to int8 when loading it. Runs on the CPU, much faster there than full precision.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--num-beams",
+        help="(Only if using Florence2) Specify the number of beams to search while decoding. 1 is greedy decoding, the fastest.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--torch-threads",
+        help="(Only if using Florence2) Specify the number of CPU threads PyTorch uses.",
+        type=int,
+    )
+
+
+def add_engine_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "-m",
+        help="Specify the OCR model to use. hybrid runs Tesseract on every line and Florence2 only on the lines Tesseract is not confident about.",
+        choices=["tesseract", "florence2", "hybrid"],
+        type=str.lower,
+        default="tesseract",
+    )
+    parser.add_argument(
+        "-l",
+        nargs="+",
+        help="(Only if using Tesseract) Specify the list of languages to use separated by spaces.",
+        type=str.lower,
+        default=["eng"],
+    )
+    parser.add_argument(
+        "-b",
+        help="(Only if using Tesseract) Specify a custom character blacklist for Tesseract. Enter an empty string to turn off the default blacklist.",
+        default="|`´®",
+    )
+    parser.add_argument(
+        "--confidence-threshold",
+        help="(Only if using hybrid) Specify the mean word confidence from 0 to 100 below which a line recognized by Tesseract is recognized again by Florence2.",
+        type=float,
+        default=75,
+    )
+    parser.add_argument(
+        "-p",
+        "--preprocess",
+        help="Specify how images are prepared for OCR. crop cuts the text out, scales it to a fixed x-height and binarizes it, canvas pastes the whole image onto a fixed 1000x1000 canvas. Defaults to canvas for florence2 and crop otherwise.",
+        choices=["crop", "canvas"],
+        type=str.lower,
+    )
+    parser.add_argument(
+        "--split-lines",
+        help="Split subtitles into single text lines and recognize every line separately. Lines are spread across workers when using -j.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        help="(Only if using Tesseract) Specify the number of Tesseract instances to run in parallel threads.",
+        type=int,
+        default=1,
+    )
+    add_florence2_arguments(parser)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Specify the number of OCR worker processes to run in parallel. In batch mode whole files are distributed across the workers.",
+        type=int,
+        default=1,
+    )
+
+
+def add_conversion_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--resume",
+        help="Checkpoint the progress of every file so an interrupted run continues where it stopped. Files that are already converted are skipped.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--merge-similar",
+        help="Merge consecutive events that show the same subtitle again, e.g. re-sent as a new object, slightly moved or as fade steps, into one event before OCR.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--mmap",
+        help="Memory map the input files instead of reading them into memory. Useful for very large SUP files.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stream",
+        help="Parse the input incrementally while converting instead of loading the whole file first.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--ocr-cache",
+        help="Specify a file to keep OCR results in across runs. Identical subtitle images are only recognized once.",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Collect per stage timings and counters and write them to the given file. Files ending in .prom use the Prometheus text format, anything else is written as JSON.",
+    )
+
+
+def tesseract_factory(args: argparse.Namespace):
+    from .tesseract_ocr_engine import TesseractOCREngine
+
+    psm = 7 if args.split_lines else 6
+    if args.threads > 1:
+        from .tesseract_ocr_engine import TesseractEnginePool
+
+        return partial(TesseractEnginePool, args.l, args.b, args.threads, psm)
+    return partial(TesseractOCREngine, args.l, args.b, psm)
+
+
+def florence2_factory(args: argparse.Namespace):
+    from .transformer_ocr_engines import Florence2OCREngine
+
+    if args.model_path is not None and not os.path.isdir(args.model_path):
+        print("Model directory not found, make sure you have specified the correct path.")
+        exit(1)
+    return partial(
+        Florence2OCREngine,
+        args.batch_size,
+        args.florence2_model,
+        args.model_path,
+        args.quantize,
+        args.num_beams,
+        args.torch_threads,
+    )
+
+
+def make_engine_factory(args: argparse.Namespace):
+    if args.m == "tesseract":
+        return tesseract_factory(args)
+    elif args.m == "florence2":
+        return florence2_factory(args)
+    elif args.m == "hybrid":
+        from .cascade_ocr_engine import CascadeOCREngine
+
+        return partial(
+            CascadeOCREngine,
+            tesseract_factory(args),
+            florence2_factory(args),
+            args.confidence_threshold,
+        )
+    else:
+        raise ValueError(f"Unknown OCR engine '{args.m}' specified.")
+
+
+def report_engine_usage(primary_lines: int, fallback_lines: int, metrics) -> None:
+    # Only a cascade counts the lines of its engines
+    total = primary_lines + fallback_lines
+    if not total:
+        return
+    metrics.count("primary_engine_lines", primary_lines)
+    metrics.count("fallback_engine_lines", fallback_lines)
+    print(
+        f"Tesseract recognized {primary_lines} of {total} lines ({primary_lines / total:.1%}), "
+        f"Florence2 {fallback_lines} ({fallback_lines / total:.1%})."
+    )
+
+
+def preprocess_mode(args: argparse.Namespace) -> str:
+    # crop is tuned for Tesseract, which also reads every line first in hybrid mode
+    if args.preprocess is not None:
+        return args.preprocess
+    return "canvas" if args.m == "florence2" else "crop"
+
+
+def conversion_options(args: argparse.Namespace) -> dict:
+    # Conversion settings shared by every input file
+    return {
+        "use_mmap": args.mmap,
+        "streaming": args.stream,
+        "preprocess": preprocess_mode(args),
+        "split_lines": args.split_lines,
+        "merge": args.merge_similar,
+        "resume": args.resume,
+    }
+
+
+def load_engine(args: argparse.Namespace, engine_factory, metrics):
+    print("Loading OCR engine...")
+    with metrics.time("engine_startup"):
+        if args.jobs > 1:
+            from .ocr_pool import ProcessOCRPool
+
+            engine = ProcessOCRPool(engine_factory, args.jobs)
+        else:
+            engine = engine_factory()
+    print("OCR engine loaded.")
+    return engine
+
+
+def serve_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="pgsocr serve",
+        description="Keep an OCR engine loaded and convert the files sent to a local Unix socket by pgsocr --connect.",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Specify the path of the Unix socket to listen on.",
+        required=True,
+    )
+    add_engine_arguments(parser)
+    add_conversion_arguments(parser)
+    args = parser.parse_args(argv)
+
+    from .metrics import Metrics, NULL_METRICS
+    from .ocr_cache import OCRCache
+    from .ocr_pool import engine_usage
+    from .server import OCRServer, socket_in_use
+
+    if socket_in_use(args.socket):
+        print(f"Another server is already listening on {args.socket}.")
+        exit(1)
+
+    metrics = Metrics() if args.metrics else NULL_METRICS
+    engine = load_engine(args, make_engine_factory(args), metrics)
+    ocr_cache = OCRCache(db_path=args.ocr_cache)
+    options = conversion_options(args)
+    server = OCRServer(args.socket, engine, ocr_cache, metrics, options)
+    print(f"Listening on {args.socket}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        report_engine_usage(*engine_usage(engine), metrics)
+        engine.quit()
+        ocr_cache.close()
+        if args.metrics:
+            metrics.write(args.metrics)
+    exit(0)
+
+
+def info_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="pgsocr info",
+        description="Print the resolution, duration, number of display sets, epochs and events and the total bitmap area of SUP files as JSON. Only the segment headers are read.",
+    )
+    parser.add_argument("files", nargs="+", help="SUP files or directories.")
+    parser.add_argument(
+        "--write-index",
+        help="Store the index next to every file (.sup.idx.npz) so later scans can reuse it. Existing up to date indexes are always used.",
+        action="store_true",
+    )
+    args = parser.parse_args(argv)
+
+    import json
+    from .sup_index import load_index, summarize
+
+    paths = []
+    for f in map(Path, args.files):
+        if f.is_dir():
+            paths.extend(sorted(str(x) for x in f.iterdir() if x.suffix == ".sup"))
+        elif f.is_file():
+            paths.append(str(f))
+        else:
+            print(f"{f} not found, make sure you have specified the correct path.")
+            exit(1)
+
+    infos = []
+    for path in paths:
+        try:
+            infos.append(summarize(load_index(path, write_sidecar=args.write_index)))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+    print(json.dumps(infos, indent=2))
+    exit(0)
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "info":
+        info_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(
         prog="pgsocr",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -18,47 +320,45 @@ def main():
 
             # Multiple files in a directory
             pgsocr -i /path/to/inputdir -o /path/to/outputdir -m florence2
+
+            # Keep the engine loaded and send it files
+            pgsocr serve --socket /tmp/pgsocr.sock -m tesseract
+            pgsocr -i /path/to/file -o path/to/outputdir --connect /tmp/pgsocr.sock
         """
         ),
     )
     parser.add_argument(
         "-i",
-        help="Specify the path to the SUP file or (batch mode) directory.",
+        help="Specify the path to the SUP file or (batch mode) directory. Use - to read a SUP stream from stdin.",
         required=True,
     )
     parser.add_argument(
         "-o", help="Specify the path to the output directory.", required=True
     )
-    parser.add_argument(
-        "-m",
-        help="Specify the OCR model to use.",
-        choices=["tesseract", "florence2"],
-        type=str.lower,
-        default="tesseract",
-    )
     parser.add_argument(
         "-f",
-        help="Specify the output format",
-        choices=["srt", "ass"],
+        help="Specify the output formats. Every format is written from the same OCR pass.",
+        nargs="+",
+        choices=["srt", "ass", "vtt", "jsonl"],
         type=str.lower,
-        default="srt",
+        default=["srt"],
     )
+    add_engine_arguments(parser)
+    add_conversion_arguments(parser)
     parser.add_argument(
-        "-l",
-        nargs="+",
-        help="(Only if using Tesseract) Specify the list of languages to use separated by spaces.",
-        type=str.lower,
-        default=["eng"],
+        "--async",
+        help="Run decoding, preprocessing, OCR and writing as separate stages connected by bounded queues so they overlap.",
+        action="store_true",
+        dest="async_pipeline",
     )
     parser.add_argument(
-        "-b",
-        help="(Only if using Tesseract) Specify a custom character blacklist for Tesseract. Enter an empty string to turn off the default blacklist.",
-        default="|`´®",
+        "--connect",
+        help="Send the files to a running pgsocr serve instance listening on the given Unix socket instead of loading an engine. The engine settings of the server are used.",
     )
     args = parser.parse_args()
 
     inp = Path(args.i)
-    if not inp.exists():
+    if args.i != "-" and not inp.exists():
         print("Input file not found, make sure you have specified the correct path.")
         exit(1)
     op = Path(args.o)
@@ -68,24 +368,114 @@ def main():
         )
         exit(1)
 
-    langs = args.l
+    if args.connect is not None:
+        from .client import submit_jobs
 
-    print("Loading OCR engine...")
-    if args.m == "tesseract":
-        from .tesseract_ocr_engine import TesseractOCREngine
+        if args.i == "-":
+            print("Reading from stdin is not supported with --connect.")
+            exit(1)
+        paths = [args.i] if inp.is_file() else [str(x) for x in inp.iterdir()]
+        # The server has its own working directory
+        output = os.path.abspath(args.o)
+        jobs = [
+            {"input": os.path.abspath(p), "output": output, "format": args.f}
+            for p in paths
+        ]
+        failed = False
+        try:
+            for job, reply in zip(jobs, submit_jobs(args.connect, jobs)):
+                if reply["ok"]:
+                    print(f"{job['input']}: {reply['lines']} lines")
+                else:
+                    print(f"{job['input']}: {reply['error']}")
+                    failed = True
+        except OSError as e:
+            print(f"Could not reach a pgsocr server on {args.connect}: {e.strerror}")
+            exit(1)
+        exit(1 if failed else 0)
 
-        engine = TesseractOCREngine(langs, args.b)
-    elif args.m == "florence2":
-        from .transformer_ocr_engines import Florence2OCREngine
+    from .metrics import Metrics, NULL_METRICS
+    from .ocr_cache import OCRCache
+    from .ocr_pool import engine_usage
+    from .supconvert import supconvert
 
-        engine = Florence2OCREngine()
-    else:
-        raise ValueError(f"Unknown OCR engine '{args.m}' specified.")
-    print("OCR engine loaded.")
+    metrics = Metrics() if args.metrics else NULL_METRICS
+
+    engine_factory = make_engine_factory(args)
+    options = conversion_options(args)
 
-    if inp.is_file():
-        supconvert(str(inp), args.o, engine, args.f)
+    if inp.is_dir() and args.jobs > 1:
+        from .batch import batch_convert
+
+        # Whole files are spread across the workers instead of single lines
+        files = [str(x) for x in inp.iterdir() if x.is_file()]
+        usage = batch_convert(
+            files,
+            args.o,
+            engine_factory,
+            args.f,
+            args.jobs,
+            ocr_cache_path=args.ocr_cache,
+            metrics=metrics,
+            **options,
+        )
+        report_engine_usage(*usage, metrics)
+        if args.metrics:
+            metrics.write(args.metrics)
+        exit(0)
+
+    engine = load_engine(args, engine_factory, metrics)
+    ocr_cache = OCRCache(db_path=args.ocr_cache)
+
+    if args.async_pipeline:
+        import asyncio
+        from .async_pipeline import as_async_engine, supconvert_async
+
+        async_engine = as_async_engine(engine, metrics)
+        if args.i == "-" or inp.is_file():
+            paths = [args.i]
+        else:
+            paths = [str(x) for x in inp.iterdir()]
+
+        async def convert_all():
+            for path in paths:
+                await supconvert_async(
+                    path,
+                    args.o,
+                    async_engine,
+                    args.f,
+                    ocr_cache=ocr_cache,
+                    metrics=metrics,
+                    **options,
+                )
+
+        asyncio.run(convert_all())
+        if async_engine is not engine:
+            async_engine.close()
+    elif args.i == "-" or inp.is_file():
+        supconvert(
+            args.i,
+            args.o,
+            engine,
+            args.f,
+            ocr_cache=ocr_cache,
+            metrics=metrics,
+            **options,
+        )
     elif inp.is_dir():
         for x in inp.iterdir():
-            supconvert(str(x), args.o, engine, args.f)
+            supconvert(
+                str(x),
+                args.o,
+                engine,
+                args.f,
+                ocr_cache=ocr_cache,
+                metrics=metrics,
+                **options,
+            )
+    report_engine_usage(*engine_usage(engine), metrics)
+    engine.quit()
+    ocr_cache.close()
+    if args.metrics:
+        metrics.write(args.metrics)
     exit(0)
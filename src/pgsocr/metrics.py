@@ -0,0 +1,137 @@
+import json
+import time
+from collections import defaultdict
+import numpy as np
+
+
+class _Timer:
+    def __init__(self, samples: list[float]):
+        self.samples = samples
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Metrics:
+    enabled = True
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counters: defaultdict[str, float] = defaultdict(float)
+        self.timings: defaultdict[str, list[float]] = defaultdict(list)
+        self.files: dict[str, dict] = {}
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.counters[name] += value
+
+    def time(self, stage: str) -> _Timer:
+        return _Timer(self.timings[stage])
+
+    def observe(self, stage: str, seconds: float) -> None:
+        self.timings[stage].append(seconds)
+
+    def file_done(self, file_name: str, lines: int, seconds: float, size: int) -> None:
+        self.files[file_name] = {"lines": lines, "seconds": seconds, "bytes": size}
+
+    def merge(self, other: "Metrics") -> None:
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for stage, samples in other.timings.items():
+            self.timings[stage].extend(samples)
+        self.files.update(other.files)
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        stages = {}
+        for stage, samples in self.timings.items():
+            ar = np.array(samples)
+            stages[stage] = {
+                "count": len(samples),
+                "seconds": float(ar.sum()),
+                "mean": float(ar.mean()) if len(ar) else 0.0,
+                "max": float(ar.max()) if len(ar) else 0.0,
+                **{
+                    f"p{int(q * 100)}": float(np.quantile(ar, q)) if len(ar) else 0.0
+                    for q in self.QUANTILES
+                },
+            }
+        lines = self.counters.get("lines", 0)
+        return {
+            "elapsed_seconds": elapsed,
+            "images_per_sec": lines / elapsed if elapsed else 0.0,
+            "counters": dict(self.counters),
+            "stages": stages,
+            "files": self.files,
+        }
+
+    def to_prometheus(self) -> str:
+        summary = self.summary()
+        out = [
+            "# TYPE pgsocr_elapsed_seconds gauge",
+            f"pgsocr_elapsed_seconds {summary['elapsed_seconds']}",
+            "# TYPE pgsocr_images_per_second gauge",
+            f"pgsocr_images_per_second {summary['images_per_sec']}",
+        ]
+        for name, value in summary["counters"].items():
+            out.append(f"# TYPE pgsocr_{name}_total counter")
+            out.append(f"pgsocr_{name}_total {value}")
+        out.append("# TYPE pgsocr_stage_seconds summary")
+        for stage, stats in summary["stages"].items():
+            for q in self.QUANTILES:
+                out.append(
+                    f'pgsocr_stage_seconds{{stage="{stage}",quantile="{q}"}} {stats[f"p{int(q * 100)}"]}'
+                )
+            out.append(f'pgsocr_stage_seconds_sum{{stage="{stage}"}} {stats["seconds"]}')
+            out.append(f'pgsocr_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for key in ("seconds", "lines", "bytes"):
+            out.append(f"# TYPE pgsocr_file_{key} gauge")
+            for file_name, stats in summary["files"].items():
+                label = file_name.replace("\\", "\\\\").replace('"', '\\"')
+                out.append(f'pgsocr_file_{key}{{file="{label}"}} {stats[key]}')
+        return "\n".join(out) + "\n"
+
+    def write(self, path: str) -> None:
+        # Prometheus text format for .prom files, JSON otherwise
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+                f.write("\n")
+
+
+# Drop-in replacement used when instrumentation is turned off, every call is a no-op
+class NullMetrics:
+    enabled = False
+    _timer = _NullTimer()
+
+    def count(self, name: str, value: float = 1) -> None:
+        pass
+
+    def time(self, stage: str) -> _NullTimer:
+        return self._timer
+
+    def observe(self, stage: str, seconds: float) -> None:
+        pass
+
+    def file_done(self, file_name: str, lines: int, seconds: float, size: int) -> None:
+        pass
+
+    def merge(self, other: Metrics) -> None:
+        pass
+
+
+NULL_METRICS = NullMetrics()
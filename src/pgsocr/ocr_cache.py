@@ -0,0 +1,94 @@
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from typing import Hashable, Optional
+import numpy as np
+import numpy.typing as npt
+from pgsocr.pgsparser import PaletteEntry
+
+
+class OCRCache:
+    # Number of inserts between commits of the on-disk store
+    COMMIT_INTERVAL = 64
+
+    def __init__(self, max_size: int = 4096, db_path: Optional[str] = None):
+        self.max_size = max_size
+        # Text and confidence, the confidence is None for engines that do not report one
+        self.entries: OrderedDict[str, tuple[str, Optional[int]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db: Optional[sqlite3.Connection] = None
+        self._uncommitted = 0
+        if db_path is not None:
+            # Several batch workers may share the same store
+            self.db = sqlite3.connect(db_path, timeout=30)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr"
+                " (key TEXT PRIMARY KEY, text TEXT NOT NULL, confidence INTEGER)"
+            )
+            # Stores created before confidences were kept
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(ocr)")]
+            if "confidence" not in columns:
+                self.db.execute("ALTER TABLE ocr ADD COLUMN confidence INTEGER")
+            self.db.commit()
+
+    @staticmethod
+    def make_key(
+        px: npt.NDArray[np.uint8], pal: list[PaletteEntry], engine_config: Hashable
+    ) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr(engine_config).encode())
+        h.update(repr(px.shape).encode())
+        h.update(np.ascontiguousarray(px).data)
+        # Preprocessing takes luma and alpha from the palette, so the same bitmap shown
+        # with another palette can read differently, or not at all
+        h.update(np.array(pal, dtype=np.uint8).data)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[tuple[str, Optional[int]]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute(
+                "SELECT text, confidence FROM ocr WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                entry = (row[0], row[1])
+                self._remember(key, entry)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, text: str, confidence: Optional[int] = None) -> None:
+        self._remember(key, (text, confidence))
+        if self.db is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO ocr (key, text, confidence) VALUES (?, ?, ?)",
+                (key, text, confidence),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.COMMIT_INTERVAL:
+                self.flush()
+
+    def _remember(self, key: str, entry: tuple[str, Optional[int]]) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def flush(self) -> None:
+        if self.db is not None and self._uncommitted:
+            self.db.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __repr__(self) -> str:
+        return f"OCRCache(hits={self.hits}, misses={self.misses})"
@@ -0,0 +1,112 @@
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator
+from PIL import Image
+
+
+# Engine owned by the current worker process, created by the pool initializer
+_worker_engine = None
+
+
+def _init_worker(engine_factory: Callable) -> None:
+    global _worker_engine
+    _worker_engine = engine_factory()
+
+
+def _worker_config_key():
+    return getattr(_worker_engine, "config_key", None)
+
+
+def engine_usage(engine) -> tuple[int, int]:
+    # Lines the primary and the fallback engine of a cascade had the final say on,
+    # engines without a fallback do not count them
+    return getattr(engine, "primary_lines", 0), getattr(engine, "fallback_lines", 0)
+
+
+def _worker_ocr(im: Image.Image) -> tuple[str, tuple[int, int]]:
+    # The counts stay in the worker, so the lines added by this image are sent along
+    before = engine_usage(_worker_engine)
+    text = _worker_engine.get_ocr_text(im)  # type: ignore
+    after = engine_usage(_worker_engine)
+    return text, (after[0] - before[0], after[1] - before[1])
+
+
+def ordered_imap(
+    submit: Callable[[Image.Image], Future[str]],
+    images: Iterable[Image.Image],
+    max_pending: int,
+) -> Iterator[str]:
+    # Results are returned in submission order, at most max_pending images are in flight
+    pending: deque[Future[str]] = deque()
+    for im in images:
+        pending.append(submit(im))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def timed_submit(
+    submit: Callable[[Image.Image], Future[str]], metrics
+) -> Callable[[Image.Image], Future[str]]:
+    # Records the time from submission until the result is ready for every image
+    if not metrics.enabled:
+        return submit
+
+    def run(im: Image.Image) -> Future[str]:
+        start = time.perf_counter()
+        future = submit(im)
+        future.add_done_callback(
+            lambda _: metrics.observe("ocr", time.perf_counter() - start)
+        )
+        return future
+
+    return run
+
+
+class ProcessOCRPool:
+    def __init__(
+        self, engine_factory: Callable, jobs: int, max_pending: int | None = None
+    ):
+        self.jobs = jobs
+        self.primary_lines = 0
+        self.fallback_lines = 0
+        self.max_pending = max_pending if max_pending is not None else jobs * 4
+        self.executor = ProcessPoolExecutor(
+            jobs, initializer=_init_worker, initargs=(engine_factory,)
+        )
+        # Start every worker up front so engine errors surface before any work is queued
+        try:
+            futures = [self.executor.submit(_worker_config_key) for _ in range(jobs)]
+            self.config_key = [f.result() for f in futures][0]
+        except BrokenProcessPool:
+            print("Failed to start the OCR worker processes.")
+            exit(1)
+
+    def get_ocr_text(self, im: Image.Image) -> str:
+        return self.submit(im).result()
+
+    def submit(self, im: Image.Image) -> Future[str]:
+        result: Future[str] = Future()
+
+        def done(future: Future) -> None:
+            if future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                text, (primary_lines, fallback_lines) = future.result()
+                self.primary_lines += primary_lines
+                self.fallback_lines += fallback_lines
+                result.set_result(text)
+
+        self.executor.submit(_worker_ocr, im).add_done_callback(done)
+        return result
+
+    def imap(self, images: Iterable[Image.Image]) -> Iterator[str]:
+        return ordered_imap(self.submit, images, self.max_pending)
+
+    def quit(self):
+        self.executor.shutdown(cancel_futures=True)
@@ -4,6 +4,11 @@ from dataclasses import dataclass
 import warnings
 from enum import Enum
 import os.path
+import mmap
+from itertools import chain
+from typing import BinaryIO, Generator, Iterable
+import numpy as np
+import numpy.typing as npt
 from PIL import Image
 
 
@@ -23,7 +28,10 @@ class SEGMENT_TYPE(Enum):
 
 
 class BaseSegment:
+    # Hundreds of thousands of segments are created for a long stream, slots keep them small
+    __slots__ = ("pts", "dts", "type", "size", "payload")
 
+    # raw_bytes is usually a memoryview window into the stream buffer, never copied
     def __init__(self, raw_bytes: bytes):
         if raw_bytes[:2] != b"PG":
             raise InvalidSegmentError
@@ -49,18 +57,44 @@ PaletteEntry = namedtuple("PaletteEntry", ["Y", "Cb", "Cr", "Alpha"])
 
 
 class PaletteDefinitionSegment(BaseSegment):
+    __slots__ = ("id", "version", "_entries", "_palette")
+
     def __init__(self, raw_bytes: bytes):
         super().__init__(raw_bytes)
         self.id: int = self.payload[0]
         self.version: int = self.payload[1]
-        # Multiple palette entries, iterate and store all
-        self.palette = [PaletteEntry(0, 0, 0, 0)] * 256
-        for entry in range(len(self.payload[2:]) // 5):
-            i = 2 + entry * 5
-            self.palette[self.payload[i]] = PaletteEntry(*self.payload[i + 1 : i + 5])
+        # Entries are only decoded for palettes that are actually used
+        self._entries: npt.NDArray[np.uint8] | None = None
+        self._palette: list[PaletteEntry] | None = None
+
+    @property
+    def entries(self) -> npt.NDArray[np.uint8]:
+        # Y, Cb, Cr and alpha of all 256 palette indices, undefined ones are zero
+        if self._entries is None:
+            count = max((len(self.payload) - 2) // 5, 0)
+            raw = np.frombuffer(self.payload, np.uint8, count * 5, 2).reshape(count, 5)
+            self._entries = np.zeros((256, 4), dtype=np.uint8)
+            self._entries[raw[:, 0]] = raw[:, 1:]
+        return self._entries
+
+    @property
+    def palette(self) -> list[PaletteEntry]:
+        if self._palette is None:
+            self._palette = [PaletteEntry(*entry) for entry in self.entries.tolist()]
+        return self._palette
 
 
 class ObjectDefinitionSegment(BaseSegment):
+    __slots__ = (
+        "id",
+        "version",
+        "is_first",
+        "is_last",
+        "data_len",
+        "width",
+        "height",
+        "fragments",
+    )
     SEQUENCE = {0x40: "Last", 0x80: "First", 0xC0: "First and last"}
 
     def __init__(self, raw_bytes: bytes):
@@ -72,12 +106,20 @@ class ObjectDefinitionSegment(BaseSegment):
         # Image data can be fragmented across multiple ODS
         # Data length, height, width properties only present in first ODS in a sequence
         if not self.is_first:
-            self.img_data: bytes = self.payload[4:]
+            self.fragments: list[bytes] = [self.payload[4:]]
         else:
             self.data_len: int = int.from_bytes(self.payload[4:7], byteorder="big")
             self.width: int = int.from_bytes(self.payload[7:9], byteorder="big")
             self.height: int = int.from_bytes(self.payload[9:11], byteorder="big")
-            self.img_data: bytes = self.payload[11:]
+            self.fragments: list[bytes] = [self.payload[11:]]
+
+    @property
+    def img_data(self) -> bytes:
+        # Fragments stay windows into the stream and are only joined for decoding,
+        # the joined copy is not kept
+        if len(self.fragments) == 1:
+            return self.fragments[0]
+        return b"".join(self.fragments)
 
 
 # Helper function to join ODS segments as described above
@@ -85,9 +127,8 @@ def make_ods(ods_list: list[ObjectDefinitionSegment]) -> ObjectDefinitionSegment
     if len(ods_list) == 1:
         return ods_list[0]
     ret = ods_list[0]
-    for ods in ods_list[1:]:
-        ret.img_data += ods.img_data
-    if len(ret.img_data) != ret.data_len - 4:
+    ret.fragments = [fragment for ods in ods_list for fragment in ods.fragments]
+    if sum(len(fragment) for fragment in ret.fragments) != ret.data_len - 4:
         warnings.warn(
             "Image data length from header does not match the length found.",
             RuntimeWarning,
@@ -105,6 +146,19 @@ class COMPOSITION_STATE(Enum):
 
 
 class CompositionObject:
+    __slots__ = (
+        "object_id",
+        "window_id",
+        "is_cropped",
+        "is_forced",
+        "x_pos",
+        "y_pos",
+        "crop_x_offset",
+        "crop_y_offset",
+        "crop_width",
+        "crop_height",
+    )
+
     def __init__(self, raw_bytes: bytes):
         self.object_id: int = int.from_bytes(raw_bytes[0:2], byteorder="big")
         self.window_id: int = raw_bytes[2]
@@ -120,6 +174,18 @@ class CompositionObject:
 
 
 class PresentationCompositionSegment(BaseSegment):
+    __slots__ = (
+        "width",
+        "height",
+        "frame_rate",
+        "num",
+        "state",
+        "palette_update",
+        "palette_id",
+        "num_comp_objs",
+        "_composition_objects",
+    )
+
     def __init__(self, raw_bytes: bytes):
         super().__init__(raw_bytes)
         self.width: int = int.from_bytes(self.payload[0:2], byteorder="big")
@@ -130,6 +196,7 @@ class PresentationCompositionSegment(BaseSegment):
         self.palette_update: bool = bool(self.payload[8])
         self.palette_id: int = self.payload[9]
         self.num_comp_objs: int = self.payload[10]
+        self._composition_objects: list[CompositionObject] | None = None
 
     @property
     def composition_number(self) -> int:
@@ -139,8 +206,13 @@ class PresentationCompositionSegment(BaseSegment):
     def composition_state(self) -> COMPOSITION_STATE:
         return self.state
 
-    @cached_property
+    @property
     def composition_objects(self) -> list[CompositionObject]:
+        if self._composition_objects is None:
+            self._composition_objects = self._read_composition_objects()
+        return self._composition_objects
+
+    def _read_composition_objects(self) -> list[CompositionObject]:
         idx = 11
         comps = []
         while idx < len(self.payload):
@@ -157,6 +229,8 @@ class PresentationCompositionSegment(BaseSegment):
 
 
 class WindowObject:
+    __slots__ = ("id", "x_pos", "y_pos", "width", "height")
+
     def __init__(self, raw_bytes: bytes):
         self.id: int = raw_bytes[0]
         self.x_pos: int = int.from_bytes(raw_bytes[1:3], byteorder="big")
@@ -166,12 +240,20 @@ class WindowObject:
 
 
 class WindowDefinitionSegment(BaseSegment):
+    __slots__ = ("num_win_objs", "_window_objects")
+
     def __init__(self, raw_bytes: bytes):
         super().__init__(raw_bytes)
         self.num_win_objs: int = self.payload[0]
+        self._window_objects: list[WindowObject] | None = None
 
-    @cached_property
+    @property
     def window_objects(self) -> list[WindowObject]:
+        if self._window_objects is None:
+            self._window_objects = self._read_window_objects()
+        return self._window_objects
+
+    def _read_window_objects(self) -> list[WindowObject]:
         idx = 1
         windows = []
         while idx < len(self.payload):
@@ -188,10 +270,12 @@ class WindowDefinitionSegment(BaseSegment):
 
 
 class EndOfDisplaySetSegment(BaseSegment):
-    pass
+    __slots__ = ()
 
 
 class DisplaySet:
+    __slots__ = ("segments", "segment_types", "has_image")
+
     def __init__(self, segment_list: list[BaseSegment]):
         self.segments: list[BaseSegment] = segment_list
         self.segment_types: list[SEGMENT_TYPE] = [s.segment_type for s in segment_list]
@@ -221,6 +305,8 @@ class DisplaySet:
 
 
 class Epoch:
+    __slots__ = ("display_sets", "ds_states")
+
     def __init__(self, displayset_list: list[DisplaySet]):
         self.display_sets: list[DisplaySet] = displayset_list
         self.ds_states: list[COMPOSITION_STATE] = [
@@ -237,67 +323,233 @@ class PGStream:
         SEGMENT_TYPE.END: EndOfDisplaySetSegment,
     }
 
-    def __init__(self, filepath: str):
+    def __init__(self, filepath: str, use_mmap: bool = False):
         ext = os.path.splitext(filepath)[1]
         if ext != ".sup":
             raise ValueError(f"File with extension '{ext}' is not a valid SUP.")
         self.file_name: str = os.path.split(filepath)[1]
+        self._mmap: mmap.mmap | None = None
+        self.raw_data: memoryview
         with open(filepath, "rb") as f:
-            self.raw_data: bytes = f.read()
+            if use_mmap:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.raw_data = memoryview(self._mmap)
+            else:
+                self.raw_data = memoryview(f.read())
+        self._read_resolution()
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray, file_name: str) -> "PGStream":
+        # For segments that are already in memory, e.g. demuxed from a container
+        stream = cls.__new__(cls)
+        stream.file_name = file_name
+        stream._mmap = None
+        stream.raw_data = memoryview(data)
+        stream._read_resolution()
+        return stream
+
+    def _read_resolution(self) -> None:
+        if not self.display_sets:
+            raise ValueError(f"{self.file_name} does not contain any display sets.")
         self.res_height = self.display_sets[0].pcs[0].height
         self.res_width = self.display_sets[0].pcs[0].width
 
+    def close(self) -> None:
+        if self._mmap is None:
+            return
+        try:
+            self.raw_data.release()
+            self._mmap.close()
+        except BufferError:
+            # Segments are still referenced elsewhere, the mapping is closed once they are collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     @cached_property
     def segments(self) -> list[BaseSegment]:
+        return list(build_segments(self.raw_segments()))
+
+    def raw_segments(self) -> Generator[memoryview, None, None]:
         idx = 0
-        segs = []
-        ods_list = []
         while idx < len(self.raw_data):
             size = 13 + int.from_bytes(
                 self.raw_data[idx + 11 : idx + 13], byteorder="big"
             )
-            seg_type = SEGMENT_TYPE(self.raw_data[idx + 10])
-            cls = self.TYPE_TO_CLASS[seg_type]
-            seg_instance = cls(self.raw_data[idx : idx + size])
+            yield self.raw_data[idx : idx + size]
             idx += size
-            # ODS need to be handled separately in case of fragmented sequence
-            if seg_type == SEGMENT_TYPE.ODS:
-                ods_list.append(seg_instance)
-                if seg_instance.is_last:
-                    seg_instance = make_ods(ods_list)
-                    ods_list = []
-                else:
-                    continue
-            segs.append(seg_instance)
-        return segs
 
     @cached_property
     def display_sets(self) -> list[DisplaySet]:
-        ds = []
-        cur = []
-        for s in self.segments:
-            cur.append(s)
-            if s.type == SEGMENT_TYPE.END:
-                ds.append(DisplaySet(cur))
-                cur = []
-
+        ds = group_display_sets(self.segments)
         return sorted(ds, key=lambda x: x.pcs[0].presentation_timestamp)
 
     @cached_property
     def epochs(self) -> list[Epoch]:
-        ep = []
-        cur = []
-        for ds in self.display_sets:
-            if ds.pcs[0].composition_state == COMPOSITION_STATE.EPOCH_START:
-                if cur:
-                    ep.append(Epoch(cur))
-                cur = []
-            cur.append(ds)
-        ep.append(Epoch(cur))
-        return ep
-
-
-@dataclass
+        return list(group_epochs(self.display_sets))
+
+
+# Incremental counterpart of PGStream for files, pipes and stdin. Display sets and epochs are
+# parsed as they are read, so the stream can only be iterated once and is never fully held in memory.
+class PGStreamReader:
+    def __init__(self, source: str | BinaryIO, file_name: str = "stdin.sup"):
+        self._file: BinaryIO
+        if isinstance(source, str):
+            ext = os.path.splitext(source)[1]
+            if ext != ".sup":
+                raise ValueError(f"File with extension '{ext}' is not a valid SUP.")
+            self.file_name: str = os.path.split(source)[1]
+            self._file = open(source, "rb")
+            self._owns_file = True
+        else:
+            self.file_name = file_name
+            self._file = source
+            self._owns_file = False
+        self._display_sets = group_display_sets(
+            build_segments(read_raw_segments(self._file))
+        )
+        # The resolution is only known once the first display set has been read
+        self._first = next(self._display_sets, None)
+        if self._first is None:
+            self.close()
+            raise ValueError(f"{self.file_name} does not contain any display sets.")
+        self.res_height = self._first.pcs[0].height
+        self.res_width = self._first.pcs[0].width
+
+    def close(self) -> None:
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def display_sets(self) -> Generator[DisplaySet, None, None]:
+        # Read one display set at a time, unlike the list of PGStream
+        first, self._first = self._first, None
+        if first is None:
+            raise RuntimeError("PGStreamReader display sets can only be iterated once.")
+        return ordered_display_sets(chain([first], self._display_sets))
+
+    @property
+    def epochs(self) -> Generator[Epoch, None, None]:
+        return group_epochs(self.display_sets)
+
+
+def read_raw_segments(f: BinaryIO) -> Generator[bytes, None, None]:
+    while True:
+        header = _read_exact(f, 13)
+        if not header:
+            return
+        size = int.from_bytes(header[11:13], byteorder="big") if len(header) == 13 else 0
+        payload = _read_exact(f, size)
+        if len(header) < 13 or len(payload) < size:
+            warnings.warn(
+                "Stream ended in the middle of a segment.",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+            return
+        yield header + payload
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    # Pipes may return fewer bytes than requested before the end of the stream
+    data = f.read(size)
+    while data and len(data) < size:
+        chunk = f.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def build_segments(raw_segments: Iterable[bytes]) -> Generator[BaseSegment, None, None]:
+    ods_list = []
+    for raw in raw_segments:
+        seg_type = SEGMENT_TYPE(raw[10])
+        cls = PGStream.TYPE_TO_CLASS[seg_type]
+        seg_instance = cls(raw)
+        # ODS need to be handled separately in case of fragmented sequence
+        if seg_type == SEGMENT_TYPE.ODS:
+            ods_list.append(seg_instance)
+            if seg_instance.is_last:
+                seg_instance = make_ods(ods_list)
+                ods_list = []
+            else:
+                continue
+        yield seg_instance
+
+
+def group_display_sets(
+    segments: Iterable[BaseSegment],
+) -> Generator[DisplaySet, None, None]:
+    cur = []
+    for s in segments:
+        cur.append(s)
+        if s.type == SEGMENT_TYPE.END:
+            yield DisplaySet(cur)
+            cur = []
+
+
+def ordered_display_sets(
+    display_sets: Iterable[DisplaySet],
+) -> Generator[DisplaySet, None, None]:
+    last_pts = -1
+    display_sets = iter(display_sets)
+    for ds in display_sets:
+        pts = ds.pcs[0].presentation_timestamp
+        if pts < last_pts:
+            # Display sets already passed on stay where they are, the rest is sorted
+            warnings.warn(
+                "Display sets are not in presentation order, buffering the rest of the stream.",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+            yield from sorted(
+                chain([ds], display_sets), key=lambda x: x.pcs[0].presentation_timestamp
+            )
+            return
+        last_pts = pts
+        yield ds
+
+
+def group_epochs(display_sets: Iterable[DisplaySet]) -> Generator[Epoch, None, None]:
+    cur = []
+    last_pts = -1
+    display_sets = iter(display_sets)
+    for ds in display_sets:
+        pts = ds.pcs[0].presentation_timestamp
+        if pts < last_pts:
+            # Only fall back to buffering and sorting once the stream is known to be out of order
+            warnings.warn(
+                "Display sets are not in presentation order, buffering the rest of the stream.",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+            remaining = sorted(
+                chain(cur, [ds], display_sets),
+                key=lambda x: x.pcs[0].presentation_timestamp,
+            )
+            yield from group_epochs(remaining)
+            return
+        last_pts = pts
+        if ds.pcs[0].composition_state == COMPOSITION_STATE.EPOCH_START:
+            if cur:
+                yield Epoch(cur)
+            cur = []
+        cur.append(ds)
+    yield Epoch(cur)
+
+
+@dataclass(slots=True)
 class PGSImageObject:
     img: Image.Image
     x_pos: int
@@ -305,3 +557,5 @@ class PGSImageObject:
     start_ms: int
     end_ms: int
     pal: list[PaletteEntry]
+    # Palette index plane the image was composed from
+    px: npt.NDArray[np.uint8] | None = None
@@ -0,0 +1,73 @@
+import json
+import os
+import socket
+import socketserver
+from typing import Optional
+from pgsocr.metrics import Metrics, NullMetrics
+from pgsocr.ocr_cache import OCRCache
+from pgsocr.supconvert import supconvert
+
+
+def socket_in_use(socket_path: str) -> bool:
+    if not os.path.exists(socket_path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    # One JSON object per line in both directions
+    def handle(self):
+        for line in self.rfile:
+            try:
+                job = json.loads(line)
+                lines = self.server.convert(job)  # type: ignore
+                if lines is None:
+                    reply = {"ok": False, "error": "Not a SUP file."}
+                else:
+                    reply = {"ok": True, "lines": lines}
+            except Exception as e:
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+# Connections are handled one at a time, so jobs never run concurrently on the engine
+class OCRServer(socketserver.UnixStreamServer):
+    def __init__(
+        self,
+        socket_path: str,
+        engine,
+        ocr_cache: Optional[OCRCache],
+        metrics: Metrics | NullMetrics,
+        options: dict,
+    ):
+        self.socket_path = socket_path
+        self.engine = engine
+        self.ocr_cache = ocr_cache
+        self.metrics = metrics
+        self.options = options
+        # Left behind by a server that did not shut down cleanly
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _JobHandler)
+
+    def convert(self, job: dict) -> Optional[int]:
+        return supconvert(
+            job["input"],
+            job["output"],
+            self.engine,
+            job.get("format", "srt"),
+            progress=False,
+            ocr_cache=self.ocr_cache,
+            metrics=self.metrics,
+            **self.options,
+        )
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,148 @@
+import json
+import os
+import warnings
+from dataclasses import dataclass
+import numpy as np
+import numpy.typing as npt
+from pgsocr.pgsparser import COMPOSITION_STATE, SEGMENT_TYPE
+
+# Bytes of the payload that are read for each segment type, everything else is skipped
+_PREFIX = {
+    SEGMENT_TYPE.PCS.value: 11,
+    SEGMENT_TYPE.ODS.value: 11,
+}
+SIDECAR_SUFFIX = ".idx.npz"
+
+
+@dataclass
+class SupIndex:
+    # One entry per segment: file offset of the header, type, PTS in ms and payload size
+    offsets: npt.NDArray[np.int64]
+    types: npt.NDArray[np.uint8]
+    pts: npt.NDArray[np.int64]
+    sizes: npt.NDArray[np.uint16]
+    summary: dict
+
+    def save(self, path: str) -> None:
+        # np.savez appends .npz to names without it
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                offsets=self.offsets,
+                types=self.types,
+                pts=self.pts,
+                sizes=self.sizes,
+                summary=np.array(json.dumps(self.summary)),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "SupIndex":
+        with np.load(path) as data:
+            return cls(
+                data["offsets"],
+                data["types"],
+                data["pts"],
+                data["sizes"],
+                json.loads(str(data["summary"])),
+            )
+
+
+def build_index(path: str) -> SupIndex:
+    offsets = []
+    types = []
+    pts_list = []
+    sizes = []
+    width = height = 0
+    display_sets = epochs = events = bitmap_area = 0
+    # Current version of every object in the epoch, resent objects are not counted again
+    versions: dict[int, int] = {}
+
+    with open(path, "rb") as f:
+        offset = 0
+        while header := f.read(13):
+            if len(header) < 13 or header[:2] != b"PG":
+                if not offsets:
+                    raise ValueError(f"{os.path.basename(path)} is not a SUP file.")
+                warnings.warn(
+                    "Stream ended in the middle of a segment.",
+                    RuntimeWarning,
+                    stacklevel=2,
+                )
+                break
+            seg_type = header[10]
+            size = int.from_bytes(header[11:13], byteorder="big")
+            pts = int.from_bytes(header[2:6], byteorder="big") // 90
+            offsets.append(offset)
+            types.append(seg_type)
+            pts_list.append(pts)
+            sizes.append(size)
+
+            prefix = f.read(min(_PREFIX.get(seg_type, 0), size))
+            if seg_type == SEGMENT_TYPE.PCS.value and len(prefix) >= 8:
+                display_sets += 1
+                if not width:
+                    width = int.from_bytes(prefix[0:2], byteorder="big")
+                    height = int.from_bytes(prefix[2:4], byteorder="big")
+                if prefix[7] == COMPOSITION_STATE.EPOCH_START.value:
+                    epochs += 1
+                    versions = {}
+            elif seg_type == SEGMENT_TYPE.ODS.value and len(prefix) >= 11:
+                object_id = int.from_bytes(prefix[0:2], byteorder="big")
+                # Only the first fragment of an object carries its size
+                if prefix[3] & 0x80 and versions.get(object_id) != prefix[2]:
+                    versions[object_id] = prefix[2]
+                    events += 1
+                    bitmap_area += int.from_bytes(
+                        prefix[7:9], byteorder="big"
+                    ) * int.from_bytes(prefix[9:11], byteorder="big")
+            f.seek(size - len(prefix), os.SEEK_CUR)
+            offset += 13 + size
+
+    pts = np.array(pts_list, dtype=np.int64)
+    summary = {
+        "file": os.path.basename(path),
+        "bytes": os.path.getsize(path),
+        "width": width,
+        "height": height,
+        "segments": len(offsets),
+        "display_sets": display_sets,
+        "epochs": epochs,
+        "events": events,
+        "bitmap_area": bitmap_area,
+        "start_ms": int(pts.min()) if len(pts) else 0,
+        "end_ms": int(pts.max()) if len(pts) else 0,
+    }
+    summary["duration_ms"] = summary["end_ms"] - summary["start_ms"]
+    return SupIndex(
+        np.array(offsets, dtype=np.int64),
+        np.array(types, dtype=np.uint8),
+        pts,
+        np.array(sizes, dtype=np.uint16),
+        summary,
+    )
+
+
+def load_index(
+    path: str, sidecar: bool = True, write_sidecar: bool = False
+) -> SupIndex:
+    # A sidecar is only used while the SUP file has the size and mtime it was built from
+    sidecar_path = path + SIDECAR_SUFFIX
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    if sidecar and os.path.exists(sidecar_path):
+        try:
+            index = SupIndex.load(sidecar_path)
+            if index.summary.get("source") == stamp:
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = build_index(path)
+    index.summary["source"] = stamp
+    if write_sidecar:
+        index.save(sidecar_path)
+    return index
+
+
+def summarize(index: SupIndex) -> dict:
+    return {k: v for k, v in index.summary.items() if k != "source"}
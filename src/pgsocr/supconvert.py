@@ -1,81 +1,396 @@
 from pgsocr import img_utils
-from pgsocr.pgsparser import PGStream
+import sys
+from collections import deque
+from itertools import islice
+import os
+import time
+from pgsocr import demux
+from pgsocr.checkpoint import Checkpoint, HashingReader
+from pgsocr.metrics import Metrics, NullMetrics, NULL_METRICS
+from pgsocr.ocr_cache import OCRCache
+from pgsocr.ocr_pool import ordered_imap, timed_submit
+from pgsocr.pgsparser import PGStream, PGStreamReader, PGSImageObject
+from pgsocr.writers import SubtitleOutput, formats, output_file
+from PIL import Image
 from tqdm import tqdm
-from typing import Optional
-
-
-def generate_timecode(millis: int, fmt: str) -> str:
-    seconds, milliseconds = divmod(millis, 1000)
-    minutes, seconds = divmod(seconds, 60)
-    hours, minutes = divmod(minutes, 60)
-    if fmt == "srt":
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
-    elif fmt == "ass":
-        hundredths = milliseconds // 10
-        return f"{hours}:{minutes:02d}:{seconds:02d}.{hundredths:02d}"
+from typing import Generator, Iterable, Iterator, Optional, Sequence
+
+
+def prepare_images(
+    img_obj: PGSImageObject, preprocess: str = "crop", split_lines: bool = False
+) -> list[Image.Image]:
+    # Images sent to the engine for one subtitle, empty if nothing is visible
+    if split_lines:
+        return img_utils.preprocess_lines(img_obj, preprocess)
+    return [img_utils.preprocess_image_object(img_obj, preprocess)]
+
+
+def ocr_images(
+    ocr_engine,
+    img_objs: Iterable[PGSImageObject],
+    ocr_cache: Optional[OCRCache] = None,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    preprocess: str = "crop",
+    split_lines: bool = False,
+    confidence: bool = False,
+) -> Generator[tuple[PGSImageObject, str, Optional[int]], None, None]:
+    engine_config = getattr(ocr_engine, "config_key", None)
+    if engine_config is None:
+        ocr_cache = None
+    # Results depend on the preprocessing as much as on the engine
+    cache_config = (engine_config, preprocess, split_lines)
+
+    # Image objects in extraction order with their cache key, their text and confidence
+    # if they are already known and the number of images sent to the engine for them
+    pending: deque[
+        tuple[PGSImageObject, Optional[str], Optional[tuple[str, Optional[int]]], int]
+    ] = deque()
+
+    def misses():
+        for img_obj in img_objs:
+            key = None
+            known = None
+            if ocr_cache is not None and img_obj.px is not None:
+                key = ocr_cache.make_key(img_obj.px, img_obj.pal, cache_config)
+                known = ocr_cache.get(key)
+                metrics.count("ocr_cache_misses" if known is None else "ocr_cache_hits")
+            if known is not None:
+                pending.append((img_obj, key, known, 0))
+                continue
+
+            with metrics.time("preprocess_image"):
+                ims = prepare_images(img_obj, preprocess, split_lines)
+            # Nothing visible to recognize
+            pending.append((img_obj, key, None if ims else ("", None), len(ims)))
+            yield from ims
+
+    results = recognize_images(ocr_engine, misses(), metrics, confidence)
+
+    parts: list[tuple[str, Optional[int]]] = []
+    for result in results:
+        while pending[0][2] is not None:
+            img_obj, _, known, _ = pending.popleft()
+            yield img_obj, *known  # type: ignore
+        img_obj, key, _, num_images = pending[0]
+        parts.append(result)
+        if len(parts) < num_images:
+            continue
+        pending.popleft()
+        text, conf = join_results(parts)
+        parts = []
+        if key is not None:
+            ocr_cache.put(key, text, conf)  # type: ignore
+        yield img_obj, text, conf
+    while pending:
+        img_obj, _, known, _ = pending.popleft()
+        yield img_obj, *known  # type: ignore
+
+
+def join_results(
+    results: Sequence[tuple[str, Optional[int]]]
+) -> tuple[str, Optional[int]]:
+    # Lines recognized one by one make up one subtitle, its confidence is the mean of
+    # the lines with text. Tesseract reports whole numbers.
+    text = "\n".join(t for t, _ in results if t)
+    confs = [c for t, c in results if t and c is not None]
+    return text, sum(confs) // len(confs) if confs else None
+
+
+def recognize_images(
+    ocr_engine,
+    images: Iterable[Image.Image],
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    confidence: bool = False,
+) -> Iterator[tuple[str, Optional[int]]]:
+    # Text and confidence of every image in order, the confidence is None unless it
+    # is asked for and the engine reports one
+    if confidence and hasattr(ocr_engine, "submit_conf"):
+        return ordered_imap(
+            timed_submit(ocr_engine.submit_conf, metrics),
+            images,
+            ocr_engine.max_pending,
+        )
+    if confidence and hasattr(ocr_engine, "get_ocr_text_conf"):
+
+        def recognize_conf(im: Image.Image) -> tuple[str, Optional[int]]:
+            with metrics.time("ocr"):
+                return ocr_engine.get_ocr_text_conf(im)
+
+        return map(recognize_conf, images)
+
+    # Pools run every image in its own future and return the results in the order
+    # the images were extracted, as do other engines with an imap method.
+    if hasattr(ocr_engine, "submit"):
+        texts = ordered_imap(
+            timed_submit(ocr_engine.submit, metrics), images, ocr_engine.max_pending
+        )
+    elif hasattr(ocr_engine, "imap"):
+        texts = ocr_engine.imap(images)
     else:
-        raise ValueError(f"Unknown format '{fmt}' specified.")
+
+        def recognize(im: Image.Image) -> str:
+            with metrics.time("ocr"):
+                return ocr_engine.get_ocr_text(im)
+
+        texts = map(recognize, images)
+    return ((text, None) for text in texts)
+
+
+def open_supfile(
+    in_path: str,
+    use_mmap: bool = False,
+    streaming: bool = False,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+) -> Optional[PGStream | PGStreamReader]:
+    try:
+        if in_path == "-":
+            return PGStreamReader(sys.stdin.buffer)
+        elif streaming:
+            return PGStreamReader(in_path)
+        with metrics.time("parse"):
+            supfile = PGStream(in_path, use_mmap)
+            metrics.count("bytes_parsed", len(supfile.raw_data))
+        return supfile
+    except ValueError:
+        print(f"{in_path} is not a SUP file.")
+        return None
+
+
+def open_checkpoint(
+    in_path: str,
+    out_path: str,
+    fmt: str | Sequence[str],
+    ocr_engine,
+    preprocess: str,
+    split_lines: bool,
+    merge: bool = False,
+    file_name: Optional[str] = None,
+    input_hash: Optional[str] = None,
+) -> Optional[Checkpoint]:
+    if in_path == "-":
+        return None
+    # Merging changes which events are written, so it is part of the settings
+    config = (getattr(ocr_engine, "config_key", None), preprocess, split_lines, merge)
+    if file_name is None:
+        file_name = os.path.split(in_path)[1]
+    out_files = [output_file(out_path, file_name, f) for f in formats(fmt)]
+    return Checkpoint(in_path, out_files, config, input_hash)
+
+
+def open_container(
+    in_path: str, metrics: Metrics | NullMetrics = NULL_METRICS, resume: bool = False
+) -> tuple[list[PGStream], Optional[str]]:
+    # The hash for the checkpoints is taken in the same pass over the container
+    input_hash = None
+    try:
+        with metrics.time("demux"), open(in_path, "rb") as f:
+            if resume:
+                reader = HashingReader(f)
+                tracks = demux.open_tracks(in_path, reader)  # type: ignore
+                input_hash = reader.hexdigest()
+            else:
+                tracks = demux.open_tracks(in_path, f)
+    except ValueError as e:
+        print(f"{in_path} could not be read: {e}")
+        return [], None
+    if not tracks:
+        print(f"{in_path} does not contain any PGS tracks.")
+    return tracks, input_hash
+
+
+def open_inputs(
+    in_path: str,
+    out_path: str,
+    fmt: str | Sequence[str],
+    ocr_engine,
+    use_mmap: bool = False,
+    streaming: bool = False,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    preprocess: str = "crop",
+    split_lines: bool = False,
+    merge: bool = False,
+    resume: bool = False,
+) -> Optional[list[tuple[PGStream | PGStreamReader, Optional[Checkpoint], int] | int]]:
+    # Streams to convert with their checkpoint and size, or the number of lines of
+    # a stream that is already converted. None if the input cannot be read.
+    if in_path != "-" and demux.is_container(in_path):
+        # Every PGS track becomes its own output file, named after the container and track
+        tracks, input_hash = open_container(in_path, metrics, resume)
+        if not tracks:
+            return None
+        inputs = []
+        for supfile in tracks:
+            checkpoint = None
+            if resume:
+                checkpoint = open_checkpoint(
+                    in_path,
+                    out_path,
+                    fmt,
+                    ocr_engine,
+                    preprocess,
+                    split_lines,
+                    merge,
+                    supfile.file_name,
+                    input_hash,
+                )
+                if checkpoint.done:  # type: ignore
+                    print(f"{supfile.file_name} is already converted, skipping.")
+                    inputs.append(checkpoint.events)  # type: ignore
+                    continue
+            inputs.append((supfile, checkpoint, len(supfile.raw_data)))
+        return inputs
+
+    checkpoint = None
+    if resume:
+        checkpoint = open_checkpoint(
+            in_path, out_path, fmt, ocr_engine, preprocess, split_lines, merge
+        )
+        if checkpoint is not None and checkpoint.done:
+            print(f"{in_path} is already converted, skipping.")
+            return [checkpoint.events]
+
+    supfile = open_supfile(in_path, use_mmap, streaming, metrics)
+    if supfile is None:
+        return None
+    size = os.path.getsize(in_path) if in_path != "-" else 0
+    return [(supfile, checkpoint, size)]
 
 
 def supconvert(
     in_path: str,
     out_path: str,
     ocr_engine,
-    fmt: str,
+    fmt: str | Sequence[str],
     img_dump_path: Optional[str] = None,
-) -> None:
-    try:
-        supfile = PGStream(in_path)
-    except ValueError:
-        print(f"{in_path} is not a SUP file.")
-        return
-
-    file_name = supfile.file_name.split(".")[0]
-    outfile = open(f"{out_path}/{file_name}.{fmt}", "w", buffering=1)
-    if fmt == "ass":
-        outfile.write(
-            f"""
-[Script Info]
-ScriptType: v4.00+
-WrapStyle: 0
-PlayResX: {supfile.res_width}
-PlayResY: {supfile.res_height}
-LayoutResX: {supfile.res_width}
-LayoutResY: {supfile.res_height}
-ScaledBorderAndShadow: yes
-YCbCr Matrix: TV.709
-
-[V4+ Styles]
-Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-Style: Default,LTFinnegan Medium,72,&H00FFFFFF,&H00FFFFFF,&H00000000,&HA0000000,0,0,0,0,100,100,0,0,1,3.6,1.5,2,200,200,60,1
-
-[Events]
-Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
-"""
+    use_mmap: bool = False,
+    streaming: bool = False,
+    progress: bool = True,
+    ocr_cache: Optional[OCRCache] = None,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    preprocess: str = "crop",
+    split_lines: bool = False,
+    merge: bool = False,
+    resume: bool = False,
+) -> Optional[int]:
+    inputs = open_inputs(
+        in_path,
+        out_path,
+        fmt,
+        ocr_engine,
+        use_mmap,
+        streaming,
+        metrics,
+        preprocess,
+        split_lines,
+        merge,
+        resume,
+    )
+    if inputs is None:
+        return None
+    lines = 0
+    for item in inputs:
+        if isinstance(item, int):
+            lines += item
+            continue
+        supfile, checkpoint, size = item
+        lines += convert_stream(
+            supfile,
+            out_path,
+            ocr_engine,
+            fmt,
+            checkpoint,
+            size,
+            img_dump_path,
+            progress,
+            ocr_cache,
+            metrics,
+            preprocess,
+            split_lines,
+            merge,
         )
+    return lines
 
-    seq_num = 1
-    for img_obj in tqdm(
-        img_utils.extract_images(supfile), desc=f"{supfile.file_name}", unit="lines"
-    ):
-        if img_dump_path is not None:
-            img_obj.img.save(
-                f"{img_dump_path}/{img_obj.start_ms}-{img_obj.end_ms}_{seq_num}.png"
-            )
-        text = ocr_engine.get_ocr_text(img_utils.preprocess_image(img_obj.img))
 
-        if fmt == "srt":
-            outfile.write(
-                f"{seq_num}\n{generate_timecode(img_obj.start_ms, 'srt')} --> {generate_timecode(img_obj.end_ms, 'srt')}\n{text}\n\n"
-            )
-            seq_num += 1
-        elif fmt == "ass":
-            text = text.replace("\n", "\\N")
-            posx = img_obj.x_pos + (img_obj.img.width) // 2
-            posy = img_obj.y_pos + (img_obj.img.height) // 2
-            outfile.write(
-                f"Dialogue: 0,{generate_timecode(img_obj.start_ms, 'ass')},{generate_timecode(img_obj.end_ms, 'ass')},Default,,0,0,0,,{{\\an5}}{{\\pos({posx}, {posy})}}{text}\n"
+def convert_stream(
+    supfile: PGStream | PGStreamReader,
+    out_path: str,
+    ocr_engine,
+    fmt: str | Sequence[str],
+    checkpoint: Optional[Checkpoint],
+    size: int,
+    img_dump_path: Optional[str] = None,
+    progress: bool = True,
+    ocr_cache: Optional[OCRCache] = None,
+    metrics: Metrics | NullMetrics = NULL_METRICS,
+    preprocess: str = "crop",
+    split_lines: bool = False,
+    merge: bool = False,
+) -> int:
+    started = time.perf_counter()
+    output = SubtitleOutput(supfile, out_path, fmt, checkpoint)
+
+    skipped = output.events
+    palette_cache = img_utils.PaletteCache()
+    img_objs = img_utils.extract_images(supfile, palette_cache, metrics, merge)
+    if merge:
+        img_objs = img_utils.merge_similar(img_objs, metrics)
+    if skipped:
+        # Events before the checkpoint are already in the output
+        img_objs = islice(img_objs, skipped, None)
+    progress_bar = tqdm(
+        ocr_images(
+            ocr_engine,
+            img_objs,
+            ocr_cache,
+            metrics,
+            preprocess,
+            split_lines,
+            output.confidence,
+        ),
+        desc=f"{supfile.file_name}",
+        unit="lines",
+        initial=skipped,
+        disable=not progress,
+    )
+    try:
+        for img_obj, text, conf in progress_bar:
+            progress_bar.set_postfix(
+                palette_hits=palette_cache.hits,
+                palette_misses=palette_cache.misses,
+                ocr_hits=ocr_cache.hits if ocr_cache is not None else 0,
+                refresh=False,
             )
+            output.write(img_obj, text, conf)
+            if img_dump_path is not None:
+                img_obj.img.save(
+                    f"{img_dump_path}/{img_obj.start_ms}-{img_obj.end_ms}_{output.events}.png"
+                )
+        output.finish()
+    finally:
+        output.close()
+        supfile.close()
+    lines = output.events
+
+    if ocr_cache is not None:
+        ocr_cache.flush()
 
-    ocr_engine.quit()
-    outfile.close()
+    _record_run(
+        metrics, supfile.file_name, lines, skipped, palette_cache, started, size
+    )
+    return lines
+
+
+def _record_run(
+    metrics: Metrics | NullMetrics,
+    file_name: str,
+    lines: int,
+    skipped: int,
+    palette_cache: img_utils.PaletteCache,
+    started: float,
+    size: int,
+) -> None:
+    metrics.count("lines", lines - skipped)
+    metrics.count("resumed_lines", skipped)
+    metrics.count("palette_cache_hits", palette_cache.hits)
+    metrics.count("palette_cache_misses", palette_cache.misses)
+    metrics.file_done(file_name, lines, time.perf_counter() - started, size)
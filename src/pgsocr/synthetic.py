@@ -0,0 +1,259 @@
+import numpy as np
+import numpy.typing as npt
+from pgsocr.pgsparser import SEGMENT_TYPE, COMPOSITION_STATE
+
+# Transparent background, black outline, white fill and a gray anti aliasing edge
+DEFAULT_PALETTE = [
+    (16, 128, 128, 0),
+    (16, 128, 128, 255),
+    (235, 128, 128, 255),
+    (125, 128, 128, 192),
+]
+
+
+def encode_rle(px: npt.NDArray[np.uint8]) -> bytes:
+    out = bytearray()
+    for line in px:
+        # Boundaries of runs of equal pixels in this line
+        starts = np.flatnonzero(np.diff(line, prepend=np.int16(-1)))
+        ends = np.append(starts[1:], len(line))
+        for start, end, color in zip(
+            starts.tolist(), ends.tolist(), line[starts].tolist()
+        ):
+            length = end - start
+            while length:
+                run = min(length, 16383)
+                length -= run
+                if color and run < 3:
+                    out += bytes([color]) * run
+                elif color == 0:
+                    if run < 64:
+                        out += bytes([0, run])
+                    else:
+                        out += bytes([0, 0x40 | (run >> 8), run & 0xFF])
+                elif run < 64:
+                    out += bytes([0, 0x80 | run, color])
+                else:
+                    out += bytes([0, 0xC0 | (run >> 8), run & 0xFF, color])
+        out += b"\x00\x00"
+    return bytes(out)
+
+
+def make_segment(seg_type: SEGMENT_TYPE, pts: int, payload: bytes) -> bytes:
+    return (
+        b"PG"
+        + (pts * 90).to_bytes(4, byteorder="big")
+        + bytes(4)
+        + bytes([seg_type.value])
+        + len(payload).to_bytes(2, byteorder="big")
+        + payload
+    )
+
+
+def make_pcs(
+    pts: int,
+    width: int,
+    height: int,
+    number: int,
+    state: COMPOSITION_STATE,
+    palette_update: bool,
+    palette_id: int,
+    objects: list[tuple[int, int, int]],
+) -> bytes:
+    payload = (
+        width.to_bytes(2, byteorder="big")
+        + height.to_bytes(2, byteorder="big")
+        + bytes([0x10])
+        + number.to_bytes(2, byteorder="big")
+        + bytes([state.value, 0x80 if palette_update else 0, palette_id, len(objects)])
+    )
+    for object_id, x_pos, y_pos in objects:
+        payload += (
+            object_id.to_bytes(2, byteorder="big")
+            + bytes([0, 0])
+            + x_pos.to_bytes(2, byteorder="big")
+            + y_pos.to_bytes(2, byteorder="big")
+        )
+    return make_segment(SEGMENT_TYPE.PCS, pts, payload)
+
+
+def make_wds(pts: int, width: int, height: int) -> bytes:
+    payload = (
+        bytes([1, 0])
+        + bytes(4)
+        + width.to_bytes(2, byteorder="big")
+        + height.to_bytes(2, byteorder="big")
+    )
+    return make_segment(SEGMENT_TYPE.WDS, pts, payload)
+
+
+def make_pds(
+    pts: int, palette_id: int, version: int, entries: list[tuple[int, int, int, int]]
+) -> bytes:
+    payload = bytes([palette_id, version])
+    for idx, (y, cb, cr, alpha) in enumerate(entries):
+        payload += bytes([idx, y, cb, cr, alpha])
+    return make_segment(SEGMENT_TYPE.PDS, pts, payload)
+
+
+def make_ods(
+    pts: int,
+    object_id: int,
+    version: int,
+    px: npt.NDArray[np.uint8],
+    fragment_size: int = 0xFFEF,
+) -> bytes:
+    height, width = px.shape
+    data = encode_rle(px)
+    # The first fragment also carries the data length, width and height
+    first = fragment_size - 7
+    chunks = [data[:first]] + [
+        data[i : i + fragment_size] for i in range(first, len(data), fragment_size)
+    ]
+    out = bytearray()
+    for i, chunk in enumerate(chunks):
+        flags = (0x80 if i == 0 else 0) | (0x40 if i == len(chunks) - 1 else 0)
+        payload = object_id.to_bytes(2, byteorder="big") + bytes([version, flags])
+        if i == 0:
+            payload += (
+                (len(data) + 4).to_bytes(3, byteorder="big")
+                + width.to_bytes(2, byteorder="big")
+                + height.to_bytes(2, byteorder="big")
+            )
+        out += make_segment(SEGMENT_TYPE.ODS, pts, payload + chunk)
+    return bytes(out)
+
+
+def make_end(pts: int) -> bytes:
+    return make_segment(SEGMENT_TYPE.END, pts, b"")
+
+
+def text_bitmap(
+    rng: np.random.Generator, width: int, height: int
+) -> npt.NDArray[np.uint8]:
+    # Blocky glyph shaped strokes with an outline, close enough to real subtitles for the RLE
+    px = np.zeros((height, width), dtype=np.uint8)
+    x = 4
+    while x < width - 24:
+        glyph_width = int(rng.integers(8, 24))
+        top = int(rng.integers(4, max(5, height // 3)))
+        bottom = height - int(rng.integers(4, max(5, height // 6)))
+        px[top:bottom, x : x + glyph_width] = 1
+        px[top + 2 : bottom - 2, x + 2 : x + glyph_width - 2] = 2
+        px[top + 2 : bottom - 2, x + glyph_width // 2] = 3
+        x += glyph_width + int(rng.integers(2, 12))
+        if rng.random() < 0.15:
+            x += 20
+    return px
+
+
+def generate_stream(
+    events: int = 100,
+    width: int = 1920,
+    height: int = 1080,
+    objects: int = 1,
+    object_width: int = 1200,
+    object_height: int = 80,
+    fragment_size: int = 0xFFEF,
+    palette_updates: int = 0,
+    epoch_size: int = 1,
+    refreshes: int = 0,
+    duration_ms: int = 2000,
+    seed: int = 0,
+) -> bytes:
+    rng = np.random.default_rng(seed)
+    out = bytearray()
+    # Composition numbers are 16 bit and wrap around in long streams
+    number = 0
+    pts = 1000
+    palette_version = 0
+    x_pos = (width - object_width) // 2
+    for event in range(events):
+        starts_epoch = event % epoch_size == 0
+        state = (
+            COMPOSITION_STATE.EPOCH_START if starts_epoch else COMPOSITION_STATE.NORMAL
+        )
+        if starts_epoch:
+            palette_version = 0
+        placements = [
+            (i, x_pos, height - (objects - i) * (object_height + 10) - 50)
+            for i in range(objects)
+        ]
+
+        out += make_pcs(pts, width, height, number, state, False, 0, placements)
+        out += make_wds(pts, width, height)
+        out += make_pds(pts, 0, palette_version, DEFAULT_PALETTE)
+        bitmaps = [
+            text_bitmap(rng, object_width, object_height) for _ in range(objects)
+        ]
+        for object_id, px in enumerate(bitmaps):
+            out += make_ods(pts, object_id, event % 256, px, fragment_size)
+        out += make_end(pts)
+        number = (number + 1) % 65536
+
+        # Palette only updates of the objects on screen, e.g. fades, and acquisition points
+        # that repeat everything on screen unchanged so players can start mid-stream
+        fade_step = duration_ms // (palette_updates + 1)
+        refresh_step = duration_ms // (refreshes + 1)
+        timeline = sorted(
+            [(pts + fade_step * (u + 1), False, u) for u in range(palette_updates)]
+            + [(pts + refresh_step * (r + 1), True, r) for r in range(refreshes)]
+        )
+        entries = DEFAULT_PALETTE
+        for upd_pts, is_refresh, update in timeline:
+            if is_refresh:
+                out += make_pcs(
+                    upd_pts,
+                    width,
+                    height,
+                    number,
+                    COMPOSITION_STATE.ACQUISITION_POINT,
+                    False,
+                    0,
+                    placements,
+                )
+                out += make_wds(upd_pts, width, height)
+                out += make_pds(upd_pts, 0, palette_version, entries)
+                for object_id, px in enumerate(bitmaps):
+                    out += make_ods(upd_pts, object_id, event % 256, px, fragment_size)
+            else:
+                palette_version = (palette_version + 1) % 256
+                alpha = 255 * (palette_updates - update) // (palette_updates + 1)
+                entries = [
+                    (y, cb, cr, min(a, alpha)) for y, cb, cr, a in DEFAULT_PALETTE
+                ]
+                out += make_pcs(
+                    upd_pts,
+                    width,
+                    height,
+                    number,
+                    COMPOSITION_STATE.NORMAL,
+                    True,
+                    0,
+                    placements,
+                )
+                out += make_pds(upd_pts, 0, palette_version, entries)
+            out += make_end(upd_pts)
+            number = (number + 1) % 65536
+
+        # Clear the screen
+        out += make_pcs(
+            pts + duration_ms,
+            width,
+            height,
+            number,
+            COMPOSITION_STATE.NORMAL,
+            False,
+            0,
+            [],
+        )
+        out += make_wds(pts + duration_ms, width, height)
+        out += make_end(pts + duration_ms)
+        number = (number + 1) % 65536
+        pts += duration_ms + 500
+    return bytes(out)
+
+
+def write_sup(path: str, **kwargs) -> None:
+    with open(path, "wb") as f:
+        f.write(generate_stream(**kwargs))
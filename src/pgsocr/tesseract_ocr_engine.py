@@ -1,79 +1,130 @@
+import json
 import os
 from pathlib import Path
 from PIL import Image
 from platform import system
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import SimpleQueue
+from typing import Iterable, Iterator, Optional
 
 from tesserocr import PyTessBaseAPI, get_languages
+from pgsocr.ocr_pool import ordered_imap
+
+
+def _discover_tessdata(requested_languages: list[str]) -> str:
+    tesspath, available_languages = get_languages()
+    tesspath = Path(tesspath)
+    if not available_languages:
+        system_name = system()
+
+        # Try to find the system tessdata folder.
+        # Based on https://tesseract-ocr.github.io/tessdoc/Installation.html
+        possible_tessdata_folders: list[Path] = []
+        if system_name == "Windows":
+            possible_tessdata_folders = [
+                Path("C:\\Program Files\\Tesseract-OCR\\tessdata"),
+                Path("C:\\Program Files (x86)\\Tesseract-OCR\\tessdata")
+            ]
+        elif system_name == "Linux":
+            possible_tessdata_folders = [
+                Path("/usr/share/tesseract-ocr/tessdata"),
+                Path("/usr/share/tessdata")
+            ]
+
+            # Verify if path like "/usr/share/tesseract-ocr/4.00/tessdata" exist
+            default_installation_path = Path("/usr/share/tesseract-ocr")
+            if default_installation_path.exists() and default_installation_path.is_dir():
+                for child in default_installation_path.iterdir():
+                    if not child.is_dir():
+                        continue
+                    tessdata_folder = child.joinpath("tessdata")
+                    if tessdata_folder.exists() and tessdata_folder.is_dir():
+                        possible_tessdata_folders.append(tessdata_folder)
+        elif system_name == "Darwin":
+            # Verify if path like "/usr/local/Cellar/tesseract/3.05.02/share/tessdata" exist
+            default_installation_path = Path("/usr/local/Cellar/tesseract")
+            if default_installation_path.exists() and default_installation_path.is_dir():
+                for child in default_installation_path.iterdir():
+                    if not child.is_dir():
+                        continue
+                    tessdata_folder = child.joinpath("share").joinpath("tessdata")
+                    if tessdata_folder.exists() and tessdata_folder.is_dir():
+                        possible_tessdata_folders.append(tessdata_folder)
+
+        found_valid_tessdata_folder = False
+        for tessdata_folder in possible_tessdata_folders:
+            _, available_languages = get_languages(str(tessdata_folder))
+            if available_languages:
+                tesspath = tessdata_folder
+                found_valid_tessdata_folder = True
+                break
+
+        if not found_valid_tessdata_folder:
+            print(
+                f"Invalid tessdata path specified or the folder \"{tesspath.absolute()}\" doesn't contain any .traineddata file."
+                " Make sure you have set the TESSDATA_PREFIX environment variable correctly."
+            )
+            exit(1)
+
+    for l in requested_languages:
+        if l not in available_languages:
+            print(
+                f"Failed to load language '{l}', make sure you have specified the correct language code"
+                " and that the corresponding Tesseract language pack is installed on your system."
+            )
+            exit(1)
+
+    return str(tesspath)
+
+
+def _tessdata_memo_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+    return Path(cache_home).joinpath("pgsocr", "tessdata_path.json")
+
+
+def find_tessdata(requested_languages: list[str]) -> str:
+    # Probing every possible tessdata folder is slow, so the folder found last time is
+    # reused as long as TESSDATA_PREFIX is unchanged and it has all requested languages
+    memo_path = _tessdata_memo_path()
+    prefix = os.environ.get("TESSDATA_PREFIX")
+    try:
+        memo = json.loads(memo_path.read_text())
+        if memo["prefix"] == prefix and all(
+            Path(memo["path"]).joinpath(f"{l}.traineddata").exists()
+            for l in requested_languages
+        ):
+            return memo["path"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    tesspath = _discover_tessdata(requested_languages)
+    try:
+        memo_path.parent.mkdir(parents=True, exist_ok=True)
+        memo_path.write_text(json.dumps({"prefix": prefix, "path": tesspath}))
+    except OSError:
+        pass
+    return tesspath
 
 
 class TesseractOCREngine:
-    def __init__(self, requested_languages: list[str], blacklist: str):
-        tesspath, available_languages = get_languages()
-        tesspath = Path(tesspath)
-        if not available_languages:
-            system_name = system()
-
-            # Try to find the system tessdata folder.
-            # Based on https://tesseract-ocr.github.io/tessdoc/Installation.html
-            possible_tessdata_folders: list[Path] = []
-            if system_name == "Windows":
-                possible_tessdata_folders = [
-                    Path("C:\\Program Files\\Tesseract-OCR\\tessdata"),
-                    Path("C:\\Program Files (x86)\\Tesseract-OCR\\tessdata")
-                ]
-            elif system_name == "Linux":
-                possible_tessdata_folders = [
-                    Path("/usr/share/tesseract-ocr/tessdata"),
-                    Path("/usr/share/tessdata")
-                ]
-
-                # Verify if path like "/usr/share/tesseract-ocr/4.00/tessdata" exist
-                default_installation_path = Path("/usr/share/tesseract-ocr")
-                if default_installation_path.exists() and default_installation_path.is_dir():
-                    for child in default_installation_path.iterdir():
-                        if not child.is_dir():
-                            continue
-                        tessdata_folder = child.joinpath("tessdata")
-                        if tessdata_folder.exists() and tessdata_folder.is_dir():
-                            possible_tessdata_folders.append(tessdata_folder)
-            elif system_name == "Darwin":
-                # Verify if path like "/usr/local/Cellar/tesseract/3.05.02/share/tessdata" exist
-                default_installation_path = Path("/usr/local/Cellar/tesseract")
-                if default_installation_path.exists() and default_installation_path.is_dir():
-                    for child in default_installation_path.iterdir():
-                        if not child.is_dir():
-                            continue
-                        tessdata_folder = child.joinpath("share").joinpath("tessdata")
-                        if tessdata_folder.exists() and tessdata_folder.is_dir():
-                            possible_tessdata_folders.append(tessdata_folder)
-
-            found_valid_tessdata_folder = False
-            for tessdata_folder in possible_tessdata_folders:
-                _, available_languages = get_languages(str(tessdata_folder))
-                if available_languages:
-                    tesspath = tessdata_folder
-                    found_valid_tessdata_folder = True
-                    break
-
-            if not found_valid_tessdata_folder:
-                print(
-                    f"Invalid tessdata path specified or the folder \"{tesspath.absolute()}\" doesn't contain any .traineddata file."
-                    " Make sure you have set the TESSDATA_PREFIX environment variable correctly."
-                )
-                exit(1)
-
-        for l in requested_languages:
-            if l not in available_languages:
-                print(
-                    f"Failed to load language '{l}', make sure you have specified the correct language code"
-                    " and that the corresponding Tesseract language pack is installed on your system."
-                )
-                exit(1)
+    def __init__(
+        self,
+        requested_languages: list[str],
+        blacklist: str,
+        psm: int = 6,
+        tessdata_path: Optional[str] = None,
+    ):
+        if tessdata_path is None:
+            tessdata_path = find_tessdata(requested_languages)
+
+        # Identifies the engine setup in the OCR result cache
+        self.config_key = ("tesseract", tuple(requested_languages), blacklist, psm)
 
         langstring = "+".join(l for l in requested_languages)
-        self.engine = PyTessBaseAPI(path=str(tesspath), lang=langstring)  # type: ignore
+        self.engine = PyTessBaseAPI(path=tessdata_path, lang=langstring)  # type: ignore
         self.engine.SetVariable("debug_file", os.devnull)
-        self.engine.SetVariable("psm", "6")
+        # 6 treats the image as a uniform block of text, 7 as a single text line
+        self.engine.SetVariable("psm", str(psm))
         if blacklist:
             self.engine.SetVariable("tessedit_char_blacklist", blacklist)
 
@@ -81,5 +132,81 @@ class TesseractOCREngine:
         self.engine.SetImage(im)
         return self.engine.GetUTF8Text().strip()
 
+    def get_ocr_text_conf(self, im: Image.Image) -> tuple[str, int]:
+        # Mean word confidence from 0 to 100 along with the text
+        text = self.get_ocr_text(im)
+        return text, self.engine.MeanTextConf()
+
     def quit(self):
         self.engine.End()
+
+
+# Several Tesseract instances driven from threads. tesserocr releases the GIL while
+# recognizing, so this runs in parallel without the memory and pickling costs of processes.
+class TesseractEnginePool:
+    def __init__(
+        self,
+        requested_languages: list[str],
+        blacklist: str,
+        threads: int,
+        psm: int = 6,
+        max_pending: Optional[int] = None,
+    ):
+        tessdata_path = find_tessdata(requested_languages)
+        self.engines = [
+            TesseractOCREngine(requested_languages, blacklist, psm, tessdata_path)
+            for _ in range(threads)
+        ]
+        self.config_key = self.engines[0].config_key
+        self.max_pending = max_pending if max_pending is not None else threads * 4
+        self.idle: SimpleQueue[TesseractOCREngine] = SimpleQueue()
+        for engine in self.engines:
+            self.idle.put(engine)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="tesseract")
+
+    def _run(self, im: Image.Image) -> str:
+        engine = self.idle.get()
+        try:
+            return engine.get_ocr_text(im)
+        finally:
+            self.idle.put(engine)
+
+    def _run_conf(self, im: Image.Image) -> tuple[str, int]:
+        engine = self.idle.get()
+        try:
+            return engine.get_ocr_text_conf(im)
+        finally:
+            self.idle.put(engine)
+
+    def get_ocr_text(self, im: Image.Image) -> str:
+        return self._run(im)
+
+    def submit(self, im: Image.Image) -> Future[str]:
+        return self.executor.submit(self._run, im)
+
+    def get_ocr_text_conf(self, im: Image.Image) -> tuple[str, int]:
+        return self._run_conf(im)
+
+    def submit_conf(self, im: Image.Image) -> Future[tuple[str, int]]:
+        return self.executor.submit(self._run_conf, im)
+
+    def imap_conf(self, images: Iterable[Image.Image]) -> Iterator[tuple[str, int]]:
+        return ordered_imap(self.submit_conf, images, self.max_pending)  # type: ignore
+
+    def map(self, images: Iterable[Image.Image]) -> list[str]:
+        return list(self.imap(images))
+
+    def imap(self, images: Iterable[Image.Image]) -> Iterator[str]:
+        return ordered_imap(self.submit, images, self.max_pending)
+
+    def quit(self):
+        # Wait for running recognitions before the engines are torn down
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for engine in self.engines:
+            engine.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
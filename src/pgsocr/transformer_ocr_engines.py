@@ -2,6 +2,8 @@ from PIL import Image
 from transformers import AutoProcessor, AutoModelForCausalLM
 import os
 import torch
+from typing import Iterable, Iterator, Optional
+from pgsocr.img_utils import pad_to_square
 
 # workaround for unnecessary flash_attn requirement
 from unittest.mock import patch
@@ -15,39 +17,104 @@ def fixed_get_imports(filename: str | os.PathLike) -> list[str]:
     return imports
 
 
+MODEL_IDS = {
+    "base": "microsoft/Florence-2-base-ft",
+    "large": "microsoft/Florence-2-large-ft",
+}
+
+
 class Florence2OCREngine:
-    def __init__(self):
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        model_id = "microsoft/Florence-2-large-ft"
+    def __init__(
+        self,
+        batch_size: int = 1,
+        model: str = "large",
+        model_path: Optional[str] = None,
+        quantize: bool = False,
+        num_beams: int = 3,
+        threads: Optional[int] = None,
+    ):
+        if threads is not None:
+            torch.set_num_threads(threads)
+        # Dynamically quantized layers only have CPU kernels
+        use_cuda = torch.cuda.is_available() and not quantize
+        self.device = "cuda:0" if use_cuda else "cpu"
+        self.batch_size = batch_size
+        self.num_beams = num_beams
+        # A local copy of the model is loaded without touching the network
+        model_id = model_path if model_path is not None else MODEL_IDS[model]
+        local_files_only = model_path is not None
+        # Identifies the engine setup in the OCR result cache
+        self.config_key: tuple = ("florence2", model_id)
+        if quantize or num_beams != 3:
+            self.config_key += ("int8" if quantize else "fp32", num_beams)
         with patch(
             "transformers.dynamic_module_utils.get_imports", fixed_get_imports
         ):  # workaround for unnecessary flash_attn requirement
             self.model = AutoModelForCausalLM.from_pretrained(
-                model_id, attn_implementation="sdpa", trust_remote_code=True
+                model_id,
+                attn_implementation="sdpa",
+                trust_remote_code=True,
+                local_files_only=local_files_only,
             ).to(self.device)
-        self.processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
+        if quantize:
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self.model.eval()
+        self.processor = AutoProcessor.from_pretrained(
+            model_id, trust_remote_code=True, local_files_only=local_files_only
+        )
 
     def get_ocr_text(self, im: Image.Image):
+        return self.get_ocr_text_batch([im])[0]
+
+    def get_ocr_text_batch(self, images: list[Image.Image]) -> list[str]:
         task_prompt = "<OCR_WITH_REGION>"
-        inputs = self.processor(text=task_prompt, images=im, return_tensors="pt")
+        # The processor resizes to 768x768 without keeping the aspect ratio, cropped lines are
+        # padded instead of being stretched
+        images = [pad_to_square(im.convert("RGB")) for im in images]
+        # The processor resizes every image to the same size, so pixel_values stack into one batch
+        inputs = self.processor(
+            text=[task_prompt] * len(images), images=images, return_tensors="pt"
+        )
 
         generated_ids = self.model.generate(
             input_ids=inputs["input_ids"].to(self.device),
             pixel_values=inputs["pixel_values"].to(self.device),
             max_new_tokens=1024,
-            num_beams=3,
+            # A single beam is greedy decoding
+            num_beams=self.num_beams,
             do_sample=False,
         )
-        generated_text = self.processor.batch_decode(
+        generated_texts = self.processor.batch_decode(
             generated_ids, skip_special_tokens=False
-        )[0]
-
-        parsed_answer = self.processor.post_process_generation(
-            generated_text, task=task_prompt, image_size=(im.width, im.height)
-        )
-        return "\n".join(
-            s.replace("</s>", "").strip() for s in parsed_answer[task_prompt]["labels"]
         )
 
+        results = []
+        pad_token = self.processor.tokenizer.pad_token
+        for im, generated_text in zip(images, generated_texts):
+            # Shorter sequences in a batch are padded up to the longest one
+            generated_text = generated_text.replace(pad_token, "")
+            parsed_answer = self.processor.post_process_generation(
+                generated_text, task=task_prompt, image_size=(im.width, im.height)
+            )
+            results.append(
+                "\n".join(
+                    s.replace("</s>", "").strip()
+                    for s in parsed_answer[task_prompt]["labels"]
+                )
+            )
+        return results
+
+    def imap(self, images: Iterable[Image.Image]) -> Iterator[str]:
+        batch = []
+        for im in images:
+            batch.append(im)
+            if len(batch) >= self.batch_size:
+                yield from self.get_ocr_text_batch(batch)
+                batch = []
+        if batch:
+            yield from self.get_ocr_text_batch(batch)
+
     def quit(self):
         pass
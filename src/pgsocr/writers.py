@@ -0,0 +1,227 @@
+import json
+import os
+from typing import Optional, Sequence, TextIO
+from pgsocr.checkpoint import Checkpoint
+from pgsocr.pgsparser import PGSImageObject, PGStream, PGStreamReader
+
+# Output is flushed every few hundred events instead of on every line
+BUFFER_SIZE = 1 << 16
+
+
+def _split_ms(millis: int) -> tuple[int, int, int, int]:
+    seconds, milliseconds = divmod(millis, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return hours, minutes, seconds, milliseconds
+
+
+class SubtitleWriter:
+    extension = ""
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+
+    def header(self) -> str:
+        return ""
+
+    def event(
+        self,
+        index: int,
+        img_obj: PGSImageObject,
+        text: str,
+        confidence: Optional[int] = None,
+    ) -> str:
+        raise NotImplementedError
+
+
+class SRTWriter(SubtitleWriter):
+    extension = "srt"
+
+    @staticmethod
+    def timecode(millis: int) -> str:
+        hours, minutes, seconds, milliseconds = _split_ms(millis)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+    def event(
+        self,
+        index: int,
+        img_obj: PGSImageObject,
+        text: str,
+        confidence: Optional[int] = None,
+    ) -> str:
+        return f"{index}\n{self.timecode(img_obj.start_ms)} --> {self.timecode(img_obj.end_ms)}\n{text}\n\n"
+
+
+class ASSWriter(SubtitleWriter):
+    extension = "ass"
+
+    @staticmethod
+    def timecode(millis: int) -> str:
+        hours, minutes, seconds, milliseconds = _split_ms(millis)
+        return f"{hours}:{minutes:02d}:{seconds:02d}.{milliseconds // 10:02d}"
+
+    def header(self) -> str:
+        return f"""
+[Script Info]
+ScriptType: v4.00+
+WrapStyle: 0
+PlayResX: {self.width}
+PlayResY: {self.height}
+LayoutResX: {self.width}
+LayoutResY: {self.height}
+ScaledBorderAndShadow: yes
+YCbCr Matrix: TV.709
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,LTFinnegan Medium,72,&H00FFFFFF,&H00FFFFFF,&H00000000,&HA0000000,0,0,0,0,100,100,0,0,1,3.6,1.5,2,200,200,60,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+    def event(
+        self,
+        index: int,
+        img_obj: PGSImageObject,
+        text: str,
+        confidence: Optional[int] = None,
+    ) -> str:
+        text = text.replace("\n", "\\N")
+        posx = img_obj.x_pos + (img_obj.img.width) // 2
+        posy = img_obj.y_pos + (img_obj.img.height) // 2
+        return f"Dialogue: 0,{self.timecode(img_obj.start_ms)},{self.timecode(img_obj.end_ms)},Default,,0,0,0,,{{\\an5}}{{\\pos({posx}, {posy})}}{text}\n"
+
+
+class WebVTTWriter(SubtitleWriter):
+    extension = "vtt"
+
+    @staticmethod
+    def timecode(millis: int) -> str:
+        hours, minutes, seconds, milliseconds = _split_ms(millis)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+    def header(self) -> str:
+        return "WEBVTT\n\n"
+
+    def event(
+        self,
+        index: int,
+        img_obj: PGSImageObject,
+        text: str,
+        confidence: Optional[int] = None,
+    ) -> str:
+        settings = ""
+        if self.width and self.height:
+            # Centers the cue where the subtitle was shown, like the ASS output
+            posx = (img_obj.x_pos + img_obj.img.width / 2) * 100 / self.width
+            posy = (img_obj.y_pos + img_obj.img.height / 2) * 100 / self.height
+            settings = f" position:{posx:.0f}% line:{posy:.0f}%,center align:center"
+        # A blank line would end the cue early
+        text = "\n".join(line for line in text.split("\n") if line.strip())
+        text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        return f"{index}\n{self.timecode(img_obj.start_ms)} --> {self.timecode(img_obj.end_ms)}{settings}\n{text}\n\n"
+
+
+class JSONLWriter(SubtitleWriter):
+    extension = "jsonl"
+
+    def event(
+        self,
+        index: int,
+        img_obj: PGSImageObject,
+        text: str,
+        confidence: Optional[int] = None,
+    ) -> str:
+        event = {
+            "index": index,
+            "start_ms": img_obj.start_ms,
+            "end_ms": img_obj.end_ms,
+            "x": img_obj.x_pos,
+            "y": img_obj.y_pos,
+            "width": img_obj.img.width,
+            "height": img_obj.img.height,
+            "text": text,
+        }
+        if confidence is not None:
+            event["confidence"] = confidence
+        return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+WRITERS: dict[str, type[SubtitleWriter]] = {
+    w.extension: w for w in (SRTWriter, ASSWriter, WebVTTWriter, JSONLWriter)
+}
+
+
+def formats(fmt: str | Sequence[str]) -> list[str]:
+    fmts = [fmt] if isinstance(fmt, str) else list(dict.fromkeys(fmt))
+    for f in fmts:
+        if f not in WRITERS:
+            raise ValueError(f"Unknown format '{f}' specified.")
+    return fmts
+
+
+def output_file(out_path: str, file_name: str, fmt: str) -> str:
+    return f"{out_path}/{file_name.split('.')[0]}.{fmt}"
+
+
+class SubtitleOutput:
+    def __init__(
+        self,
+        supfile: PGStream | PGStreamReader,
+        out_path: str,
+        fmt: str | Sequence[str],
+        checkpoint: Optional[Checkpoint] = None,
+    ):
+        # Every format gets its own .part file that replaces the output once the whole
+        # input is converted, so an output file is never left half written
+        fmts = formats(fmt)
+        self.writers = [WRITERS[f](supfile.res_width, supfile.res_height) for f in fmts]
+        self.out_files = [output_file(out_path, supfile.file_name, f) for f in fmts]
+        self.checkpoint = checkpoint
+        # Only JSONL has a place for the OCR confidence
+        self.confidence = "jsonl" in fmts
+        self.events = checkpoint.events if checkpoint is not None else 0
+        self.finished = False
+
+        resumed = checkpoint is not None and checkpoint.restore()
+        self.files: list[TextIO] = [
+            open(
+                f + ".part",
+                "a" if resumed else "w",
+                encoding="utf-8",
+                buffering=BUFFER_SIZE,
+            )
+            for f in self.out_files
+        ]
+        if not resumed:
+            for writer, f in zip(self.writers, self.files):
+                f.write(writer.header())
+
+    def write(
+        self, img_obj: PGSImageObject, text: str, confidence: Optional[int] = None
+    ) -> None:
+        self.events += 1
+        for writer, f in zip(self.writers, self.files):
+            f.write(writer.event(self.events, img_obj, text, confidence))
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.files, self.events)
+
+    def finish(self) -> None:
+        if self.checkpoint is not None:
+            self.checkpoint.finish(self.files, self.events)
+        else:
+            for f, out_file in zip(self.files, self.out_files):
+                f.close()
+                os.replace(out_file + ".part", out_file)
+        self.finished = True
+
+    def close(self) -> None:
+        for f in self.files:
+            f.close()
+        # Unfinished output is only kept when a checkpoint can continue it
+        if not self.finished and self.checkpoint is None:
+            for out_file in self.out_files:
+                if os.path.exists(out_file + ".part"):
+                    os.remove(out_file + ".part")
@@ -0,0 +1,60 @@
+import hashlib
+from typing import Optional
+import numpy as np
+from pgsocr.img_utils import compose_image
+from pgsocr.pgsparser import PaletteEntry, PGSImageObject
+
+
+def make_palette(alpha: int = 255) -> list[PaletteEntry]:
+    # Transparent background, black outline, white fill and a gray edge at index 0 to 3
+    pal = [PaletteEntry(16, 128, 128, 0)] * 256
+    pal[1] = PaletteEntry(16, 128, 128, alpha)
+    pal[2] = PaletteEntry(235, 128, 128, alpha)
+    pal[3] = PaletteEntry(125, 128, 128, alpha * 3 // 4)
+    return pal
+
+
+def make_event(
+    px: np.ndarray,
+    start_ms: int,
+    end_ms: Optional[int] = None,
+    pal: Optional[list[PaletteEntry]] = None,
+    x_pos: int = 0,
+    y_pos: int = 0,
+) -> PGSImageObject:
+    if pal is None:
+        pal = make_palette()
+    lut = np.array(pal, dtype=np.uint8)
+    return PGSImageObject(
+        compose_image(px, lut),
+        x_pos,
+        y_pos,
+        start_ms,
+        start_ms + 1000 if end_ms is None else end_ms,
+        pal,
+        px,
+    )
+
+
+class FakeEngine:
+    # Names every image after its content, so reruns and cache hits give the same text
+    config_key = ("fake",)
+
+    def __init__(self, fail_after: int = -1):
+        self.calls = 0
+        self.conf_calls = 0
+        self.fail_after = fail_after
+
+    def get_ocr_text(self, im) -> str:
+        if self.calls == self.fail_after:
+            raise RuntimeError("interrupted")
+        self.calls += 1
+        return hashlib.sha1(im.tobytes()).hexdigest()[:8]
+
+    def get_ocr_text_conf(self, im) -> tuple[str, int]:
+        self.conf_calls += 1
+        text = self.get_ocr_text(im)
+        return text, int(text[:2], 16) * 100 // 255
+
+    def quit(self):
+        pass
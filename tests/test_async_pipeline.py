@@ -0,0 +1,118 @@
+import asyncio
+import gc
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from pgsocr.async_pipeline import supconvert_async
+from pgsocr.img_utils import extract_images
+from pgsocr.supconvert import prepare_images, supconvert
+from pgsocr.synthetic import write_sup
+from tests.conftest import FakeEngine
+
+EVENTS = 40
+
+
+@pytest.fixture
+def sup_path(tmp_path):
+    path = str(tmp_path / "movie.sup")
+    write_sup(path, events=EVENTS, object_width=200, object_height=30, seed=7)
+    return path
+
+
+def convert(sup_path: str, out_path: str, engine) -> int:
+    return asyncio.run(
+        supconvert_async(sup_path, out_path, engine, "srt", queue_size=4)
+    )
+
+
+def test_output_matches_supconvert(sup_path, tmp_path):
+    os.mkdir(tmp_path / "sync")
+    supconvert(sup_path, str(tmp_path / "sync"), FakeEngine(), "srt", progress=False)
+    assert convert(sup_path, str(tmp_path), FakeEngine()) == EVENTS
+    with open(tmp_path / "movie.srt") as a, open(tmp_path / "sync" / "movie.srt") as b:
+        assert a.read() == b.read()
+
+
+def failing_extract(*args, **kwargs):
+    for i, img_obj in enumerate(extract_images(*args, **kwargs)):
+        if i == 10:
+            raise ValueError("broken stream")
+        yield img_obj
+
+
+def failing_prepare(img_obj, *args):
+    if img_obj.start_ms > 10000:
+        raise ValueError("broken image")
+    return prepare_images(img_obj)
+
+
+@pytest.mark.parametrize(
+    "target, replacement, error",
+    [
+        (None, None, RuntimeError),
+        ("img_utils.extract_images", failing_extract, ValueError),
+        ("prepare_images", failing_prepare, ValueError),
+    ],
+)
+def test_stage_errors_are_raised(
+    sup_path, tmp_path, monkeypatch, caplog, target, replacement, error
+):
+    if target is not None:
+        monkeypatch.setattr(f"pgsocr.async_pipeline.{target}", replacement)
+    threads = set(threading.enumerate())
+    # The engine fails in the first case, the extraction and preprocessing otherwise
+    engine = FakeEngine(fail_after=10 if target is None else -1)
+    with pytest.raises(error):
+        convert(sup_path, str(tmp_path), engine)
+    # Nothing is left running and no output was finished
+    assert set(threading.enumerate()) == threads
+    gc.collect()
+    assert not [r for r in caplog.records if r.name == "asyncio"]
+    assert not os.path.exists(tmp_path / "movie.srt")
+
+
+class FailingPool:
+    # The tenth image fails late, every image after it fails right away
+    config_key = ("pool",)
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(4)
+        self.calls = 0
+
+    def _run(self, im, n: int) -> str:
+        if n == 10:
+            time.sleep(0.05)
+        if n >= 10:
+            raise RuntimeError("interrupted")
+        return str(n)
+
+    def submit(self, im):
+        self.calls += 1
+        return self.executor.submit(self._run, im, self.calls)
+
+    def quit(self):
+        self.executor.shutdown()
+
+
+def test_failed_recognitions_are_collected(sup_path, tmp_path, caplog):
+    engine = FailingPool()
+    with pytest.raises(RuntimeError):
+        convert(sup_path, str(tmp_path), engine)
+    engine.quit()
+    assert engine.calls > 10
+    gc.collect()
+    assert not [r for r in caplog.records if r.name == "asyncio"]
+
+
+def test_jsonl_has_the_confidence_in_both_pipelines(sup_path, tmp_path):
+    os.mkdir(tmp_path / "sync")
+    supconvert(sup_path, str(tmp_path / "sync"), FakeEngine(), "jsonl", progress=False)
+    asyncio.run(supconvert_async(sup_path, str(tmp_path), FakeEngine(), "jsonl"))
+    with open(tmp_path / "movie.jsonl") as a, open(tmp_path / "sync/movie.jsonl") as b:
+        lines = a.read().splitlines()
+        assert lines == b.read().splitlines()
+    assert len(lines) == EVENTS
+    assert all(isinstance(json.loads(line)["confidence"], int) for line in lines)
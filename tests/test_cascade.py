@@ -0,0 +1,76 @@
+from functools import partial
+from PIL import Image
+from pgsocr.batch import batch_convert
+from pgsocr.cascade_ocr_engine import CascadeOCREngine
+from pgsocr.ocr_pool import ProcessOCRPool, engine_usage
+from pgsocr.supconvert import supconvert
+from pgsocr.synthetic import write_sup
+
+
+class Primary:
+    # The width of every image is its number, odd numbers are uncertain
+    def get_ocr_text_conf(self, im: Image.Image) -> tuple[str, int]:
+        return f"primary {im.width}", 40 if im.width % 2 else 90
+
+    def quit(self):
+        pass
+
+
+class Fallback:
+    batch_size = 3
+
+    def __init__(self):
+        self.batches: list[int] = []
+
+    def get_ocr_text_batch(self, images: list[Image.Image]) -> list[str]:
+        self.batches.append(len(images))
+        return [self.get_ocr_text(im) for im in images]
+
+    def get_ocr_text(self, im: Image.Image) -> str:
+        return f"fallback {im.width}"
+
+    def quit(self):
+        pass
+
+
+def test_results_keep_order_and_engines_are_counted():
+    engine = CascadeOCREngine(Primary, Fallback, 60)
+    images = [Image.new("L", (n, 10)) for n in range(1, 21)]
+    texts = list(engine.imap(images))
+    assert texts == [f"fallback {n}" if n % 2 else f"primary {n}" for n in range(1, 21)]
+    assert (engine.primary_lines, engine.fallback_lines) == (10, 10)
+    # Uncertain images are batched, the rest goes in a last smaller batch
+    assert engine.fallback.batches == [3, 3, 3, 1]
+
+
+def test_single_image_matches_imap():
+    engine = CascadeOCREngine(Primary, Fallback, 60)
+    assert engine.get_ocr_text(Image.new("L", (3, 10))) == "fallback 3"
+    assert engine.get_ocr_text(Image.new("L", (4, 10))) == "primary 4"
+    assert (engine.primary_lines, engine.fallback_lines) == (1, 1)
+
+
+def test_pool_counts_lines_of_the_worker_engines():
+    pool = ProcessOCRPool(partial(CascadeOCREngine, Primary, Fallback, 60), 2)
+    try:
+        images = [Image.new("L", (n, 10)) for n in range(1, 21)]
+        texts = list(pool.imap(images))
+    finally:
+        pool.quit()
+    assert texts == [f"fallback {n}" if n % 2 else f"primary {n}" for n in range(1, 21)]
+    assert (pool.primary_lines, pool.fallback_lines) == (10, 10)
+
+
+def test_batch_counts_lines_of_the_worker_engines(tmp_path):
+    paths = []
+    for seed in range(3):
+        paths.append(str(tmp_path / f"{seed}.sup"))
+        write_sup(paths[-1], events=10, object_width=200, object_height=30, seed=seed)
+    factory = partial(CascadeOCREngine, Primary, Fallback, 60)
+    usage = batch_convert(paths, str(tmp_path), factory, "srt", 2)
+
+    engine = factory()
+    for path in paths:
+        supconvert(path, str(tmp_path), engine, "srt", progress=False)
+    assert usage == engine_usage(engine)
+    assert sum(usage) == 30
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import pytest
+from pgsocr.async_pipeline import supconvert_async
+from pgsocr.checkpoint import Checkpoint
+from pgsocr.supconvert import open_checkpoint, supconvert
+from pgsocr.synthetic import write_sup
+from tests.conftest import FakeEngine
+
+EVENTS = 60
+FORMATS = ["srt", "vtt"]
+
+
+@pytest.fixture
+def sup_path(tmp_path):
+    path = str(tmp_path / "movie.sup")
+    write_sup(path, events=EVENTS, object_width=200, object_height=30, seed=5)
+    return path
+
+
+def convert(sup_path: str, out_path: str, engine: FakeEngine):
+    return supconvert(sup_path, out_path, engine, FORMATS, progress=False, resume=True)
+
+
+def read_outputs(out_path: str) -> list[str]:
+    outputs = []
+    for fmt in FORMATS:
+        with open(os.path.join(out_path, f"movie.{fmt}"), encoding="utf-8") as f:
+            outputs.append(f.read())
+    return outputs
+
+
+def reference_outputs(sup_path: str, tmp_path) -> list[str]:
+    out_path = str(tmp_path / "reference")
+    os.mkdir(out_path)
+    supconvert(sup_path, out_path, FakeEngine(), FORMATS, progress=False)
+    return read_outputs(out_path)
+
+
+def test_converted_file_is_skipped(sup_path, tmp_path):
+    out_path = str(tmp_path)
+    assert convert(sup_path, out_path, FakeEngine()) == EVENTS
+    engine = FakeEngine()
+    assert convert(sup_path, out_path, engine) == EVENTS
+    assert engine.calls == 0
+    assert read_outputs(out_path) == reference_outputs(sup_path, tmp_path)
+
+
+def test_removed_output_is_converted_again(sup_path, tmp_path):
+    out_path = str(tmp_path)
+    convert(sup_path, out_path, FakeEngine())
+    # Opened with the settings of the conversion, so the saved state is used
+    checkpoint = open_checkpoint(
+        sup_path, out_path, FORMATS, FakeEngine(), "crop", False
+    )
+    assert checkpoint.done and checkpoint.events == EVENTS
+
+    os.remove(os.path.join(out_path, "movie.vtt"))
+    checkpoint = open_checkpoint(
+        sup_path, out_path, FORMATS, FakeEngine(), "crop", False
+    )
+    assert not checkpoint.done
+    assert checkpoint.events == 0 and checkpoint.offsets == []
+
+    engine = FakeEngine()
+    assert convert(sup_path, out_path, engine) == EVENTS
+    assert engine.calls == EVENTS
+    assert read_outputs(out_path) == reference_outputs(sup_path, tmp_path)
+
+
+def test_interrupted_conversion_resumes(sup_path, tmp_path):
+    out_path = str(tmp_path)
+    with pytest.raises(RuntimeError):
+        convert(sup_path, out_path, FakeEngine(fail_after=40))
+    assert not os.path.exists(os.path.join(out_path, "movie.srt"))
+    assert os.path.exists(os.path.join(out_path, "movie.srt.part"))
+
+    # Only the events after the last checkpoint are recognized again
+    done = 40 // Checkpoint.INTERVAL * Checkpoint.INTERVAL
+    engine = FakeEngine()
+    assert convert(sup_path, out_path, engine) == EVENTS
+    assert engine.calls == EVENTS - done
+    assert read_outputs(out_path) == reference_outputs(sup_path, tmp_path)
+
+
+def test_async_pipeline_resumes_the_same_way(sup_path, tmp_path):
+    out_path = str(tmp_path)
+    with pytest.raises(RuntimeError):
+        convert(sup_path, out_path, FakeEngine(fail_after=40))
+
+    done = 40 // Checkpoint.INTERVAL * Checkpoint.INTERVAL
+    engine = FakeEngine()
+    lines = asyncio.run(
+        supconvert_async(sup_path, out_path, engine, FORMATS, resume=True)
+    )
+    assert lines == EVENTS
+    assert engine.calls == EVENTS - done
+    assert read_outputs(out_path) == reference_outputs(sup_path, tmp_path)
+
+    engine = FakeEngine()
+    lines = asyncio.run(
+        supconvert_async(sup_path, out_path, engine, FORMATS, resume=True)
+    )
+    assert lines == EVENTS and engine.calls == 0
@@ -0,0 +1,87 @@
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+import pytest
+
+HEAVY_MODULES = ("numpy", "PIL", "tqdm", "tesserocr")
+
+# Runs the command line in a fresh interpreter and reports what it imported
+SCRIPT = """
+import json, sys
+sys.argv = ["pgsocr", *json.loads(sys.argv[1])]
+from pgsocr.main import main
+try:
+    main()
+    code = 0
+except SystemExit as e:
+    code = e.code
+print(json.dumps({"code": code, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def run(argv: list[str]) -> tuple[dict, str]:
+    src = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+    env = dict(os.environ, PYTHONPATH=src)
+    proc = subprocess.run(
+        [sys.executable, "-c", SCRIPT, json.dumps(argv)],
+        capture_output=True,
+        text=True,
+        env=env,
+        timeout=60,
+    )
+    *output, result = proc.stdout.splitlines()
+    return json.loads(result), "\n".join(output) + proc.stderr
+
+
+class ReplyHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            job = json.loads(line)
+            reply = {"ok": True, "lines": len(job["format"])}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / "pgsocr.sock")
+    with socketserver.UnixStreamServer(path, ReplyHandler) as srv:
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        yield path
+        srv.shutdown()
+        thread.join()
+
+
+def test_help_and_argument_errors_skip_heavy_imports(tmp_path):
+    sup = tmp_path / "a.sup"
+    sup.write_bytes(b"")
+    out = str(tmp_path)
+    cases = [
+        (["--help"], 0, "--connect"),
+        (["-i", str(sup)], 2, "required"),
+        (["-i", str(sup), "-o", out, "-m", "other"], 2, "invalid choice"),
+        (["-i", str(tmp_path / "missing.sup"), "-o", out], 1, "Input file not found"),
+        (["-i", "-", "-o", out, "--connect", "x.sock"], 1, "not supported"),
+        (
+            ["-i", str(sup), "-o", out, "--connect", str(tmp_path / "none")],
+            1,
+            "Could not reach",
+        ),
+    ]
+    for argv, code, message in cases:
+        result, output = run(argv)
+        assert result == {"code": code, "heavy": []}, argv
+        assert message in output, argv
+
+
+def test_connect_skips_heavy_imports(tmp_path, server):
+    sup = tmp_path / "a.sup"
+    sup.write_bytes(b"")
+    result, output = run(
+        ["-i", str(sup), "-o", str(tmp_path), "-f", "srt", "vtt", "--connect", server]
+    )
+    assert result == {"code": 0, "heavy": []}
+    assert f"{sup}: 2 lines" in output
@@ -0,0 +1,276 @@
+import io
+import zlib
+from pgsocr import demux
+from pgsocr.checkpoint import HashingReader, file_digest
+from pgsocr.img_utils import extract_images
+from pgsocr.pgsparser import PGStream
+from pgsocr.supconvert import open_container
+from pgsocr.synthetic import generate_stream
+
+VIDEO_PID = 0x1011
+
+
+def split_segments(data: bytes) -> list[tuple[int, bytes]]:
+    # PTS and type, size and payload of every segment of a SUP stream
+    segments = []
+    idx = 0
+    while idx < len(data):
+        end = idx + 13 + int.from_bytes(data[idx + 11 : idx + 13], byteorder="big")
+        pts = int.from_bytes(data[idx + 2 : idx + 6], byteorder="big")
+        segments.append((pts, bytes(data[idx + 10 : end])))
+        idx = end
+    return segments
+
+
+def split_display_sets(data: bytes) -> list[list[tuple[int, bytes]]]:
+    display_sets: list[list[tuple[int, bytes]]] = [[]]
+    for pts, segment in split_segments(data):
+        display_sets[-1].append((pts, segment))
+        if segment[0] == 0x80:
+            display_sets.append([])
+    return display_sets[:-1]
+
+
+def pes_timestamp(value: int, marker: int) -> bytes:
+    return bytes(
+        [
+            (marker << 4) | ((value >> 29) & 0x0E) | 1,
+            (value >> 22) & 0xFF,
+            ((value >> 14) & 0xFE) | 1,
+            (value >> 7) & 0xFF,
+            ((value << 1) & 0xFE) | 1,
+        ]
+    )
+
+
+def ts_packets(pid: int, payload: bytes, counters: dict[int, int]) -> list[bytes]:
+    packets = []
+    first = True
+    while first or payload:
+        counter = counters.get(pid, 0)
+        counters[pid] = (counter + 1) & 0x0F
+        chunk, payload = payload[:184], payload[184:]
+        head = bytes([0x47, (0x40 if first else 0) | (pid >> 8), pid & 0xFF])
+        if len(chunk) < 184:
+            # Stuffing in the adaptation field fills the last packet
+            stuffing = 184 - len(chunk) - 1
+            field = bytes([stuffing]) + (
+                b"\x00" + b"\xff" * (stuffing - 1) if stuffing else b""
+            )
+            packets.append(head + bytes([0x30 | counter]) + field + chunk)
+        else:
+            packets.append(head + bytes([0x10 | counter]) + chunk)
+        first = False
+    return packets
+
+
+def psi_packets(pid: int, table_id: int, body: bytes, counters: dict) -> list[bytes]:
+    section = (
+        bytes([table_id])
+        + (0xB000 | (len(body) + 9)).to_bytes(2, byteorder="big")
+        + b"\x00\x01\xc1\x00\x00"
+        + body
+        + bytes(4)
+    )
+    return ts_packets(pid, b"\x00" + section, counters)
+
+
+def make_m2ts(streams: list[bytes], timecodes: bool = True) -> bytes:
+    # One PES packet per segment like on Blu-ray, interleaved with video packets
+    counters: dict[int, int] = {}
+    pids = [0x1200 + i for i in range(len(streams))]
+    pmt = (0xE000 | VIDEO_PID).to_bytes(2, byteorder="big") + b"\xf0\x00"
+    pmt += bytes([0x1B, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00])
+    for pid in pids:
+        pmt += bytes([0x90, 0xE0 | (pid >> 8), pid & 0xFF, 0xF0, 0x00])
+    packets = psi_packets(0, 0, b"\x00\x01\xe1\x00", counters)
+    packets += psi_packets(0x100, 2, pmt, counters)
+
+    units = []
+    for pid, data in zip(pids, streams):
+        for pts, segment in split_segments(data):
+            header = bytes([0x81, 0xC0, 10]) + pes_timestamp(pts, 3)
+            header += pes_timestamp(pts, 1)
+            body = header + segment
+            length = len(body) if len(body) < 0x10000 else 0
+            pes = b"\x00\x00\x01\xbd" + length.to_bytes(2, byteorder="big") + body
+            units.append((pts, pid, pes))
+    units.sort(key=lambda unit: unit[0])
+    for i, (_, pid, pes) in enumerate(units):
+        packets += ts_packets(pid, pes, counters)
+        if i % 5 == 0:
+            packets += ts_packets(VIDEO_PID, bytes(300), counters)
+    prefix = bytes(4) if timecodes else b""
+    return b"".join(prefix + packet for packet in packets)
+
+
+def vint(value: int) -> bytes:
+    length = next(n for n in range(1, 9) if value < (1 << (7 * n)) - 1)
+    return ((1 << (7 * length)) | value).to_bytes(length, byteorder="big")
+
+
+def element(element_id: int, data: bytes) -> bytes:
+    return (
+        element_id.to_bytes((element_id.bit_length() + 7) // 8, byteorder="big")
+        + vint(len(data))
+        + data
+    )
+
+
+def uint(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), byteorder="big")
+
+
+def make_mkv(streams: list[tuple[bytes, str]], compression: str = "") -> bytes:
+    # One block per display set and one cluster per block, next to a video track
+    tracks = element(
+        demux.EBML_TRACK_ENTRY,
+        element(demux.EBML_TRACK_NUMBER, uint(9))
+        + element(demux.EBML_CODEC_ID, b"V_MPEG4/ISO/AVC"),
+    )
+    for number, (_, language) in enumerate(streams, 1):
+        entry = element(demux.EBML_TRACK_NUMBER, uint(number)) + element(
+            demux.EBML_CODEC_ID, demux.PGS_CODEC_ID.encode()
+        )
+        if language:
+            entry += element(demux.EBML_LANGUAGE, language.encode())
+        if compression == "zlib":
+            settings = element(demux.EBML_CONTENT_COMP_ALGO, uint(demux.COMP_ZLIB))
+        elif compression == "strip":
+            settings = element(
+                demux.EBML_CONTENT_COMP_ALGO, uint(demux.COMP_HEADER_STRIPPING)
+            ) + element(demux.EBML_CONTENT_COMP_SETTINGS, b"\x16")
+        if compression:
+            entry += element(
+                demux.EBML_CONTENT_ENCODINGS,
+                element(
+                    demux.EBML_CONTENT_ENCODING,
+                    element(demux.EBML_CONTENT_COMPRESSION, settings),
+                ),
+            )
+        tracks += element(demux.EBML_TRACK_ENTRY, entry)
+
+    blocks = []
+    for number, (data, _) in enumerate(streams, 1):
+        for display_set in split_display_sets(data):
+            payload = b"".join(segment for _, segment in display_set)
+            if compression == "zlib":
+                payload = zlib.compress(payload)
+            elif compression == "strip":
+                # Every display set starts with the type of its PCS
+                payload = payload[1:]
+            blocks.append((display_set[0][0] // 90, number, payload))
+    blocks.sort()
+
+    clusters = b""
+    for ms, number, payload in blocks:
+        block = vint(number) + bytes([0, 0, 0x80]) + payload
+        if number % 2:
+            group = element(demux.EBML_SIMPLE_BLOCK, block)
+        else:
+            group = element(demux.EBML_BLOCK_GROUP, element(demux.EBML_BLOCK, block))
+        video = element(demux.EBML_SIMPLE_BLOCK, vint(9) + bytes(3) + b"video" * 40)
+        clusters += element(
+            demux.EBML_CLUSTER,
+            element(demux.EBML_CLUSTER_TIMESTAMP, uint(ms)) + group + video,
+        )
+
+    segment = (
+        element(
+            demux.EBML_INFO, element(demux.EBML_TIMESTAMP_SCALE, uint(1000000))
+        )
+        + element(demux.EBML_TRACKS, tracks)
+        + clusters
+    )
+    header = element(0x1A45DFA3, element(0x4282, b"matroska"))
+    return header + element(demux.EBML_SEGMENT, segment)
+
+
+def streams() -> list[bytes]:
+    return [
+        generate_stream(
+            events=4,
+            objects=2,
+            object_width=400,
+            object_height=50,
+            fragment_size=700,
+            palette_updates=1,
+            refreshes=1,
+            seed=seed,
+        )
+        for seed in (1, 2)
+    ]
+
+
+def test_m2ts_round_trip(tmp_path):
+    sups = streams()
+    for timecodes, name in ((True, "movie.m2ts"), (False, "movie.ts")):
+        path = str(tmp_path / name)
+        with open(path, "wb") as f:
+            f.write(make_m2ts(sups, timecodes))
+        tracks = demux.demux(path)
+        assert list(tracks) == ["1200", "1201"]
+        for data, sup in zip(tracks.values(), sups):
+            # The DTS comes from the PES header, everything else is unchanged
+            assert split_segments(data) == split_segments(sup)
+
+
+def test_mkv_round_trip(tmp_path):
+    sups = streams()
+    for compression in ("", "zlib", "strip"):
+        path = str(tmp_path / f"movie_{compression}.mkv")
+        with open(path, "wb") as f:
+            f.write(make_mkv([(sups[0], "eng"), (sups[1], "")], compression))
+        tracks = demux.demux(path)
+        assert list(tracks) == ["1_eng", "2"]
+        for data, sup in zip(tracks.values(), sups):
+            assert split_segments(data) == split_segments(sup)
+
+
+def test_open_tracks(tmp_path):
+    sups = streams()
+    path = str(tmp_path / "movie.mkv")
+    with open(path, "wb") as f:
+        f.write(make_mkv([(sups[0], "eng"), (sups[1], "fra")]))
+    tracks = demux.open_tracks(path)
+    assert [t.file_name for t in tracks] == ["movie_1_eng.sup", "movie_2_fra.sup"]
+    for track, sup in zip(tracks, sups):
+        expected = list(extract_images(PGStream.from_bytes(sup, "movie.sup")))
+        events = list(extract_images(track))
+        assert [(e.start_ms, e.end_ms, e.x_pos, e.y_pos) for e in events] == [
+            (e.start_ms, e.end_ms, e.x_pos, e.y_pos) for e in expected
+        ]
+        assert all((a.px == b.px).all() for a, b in zip(events, expected))
+
+
+class CountingFile(io.BytesIO):
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_container_is_hashed_while_demuxing(tmp_path):
+    sups = streams()
+    for name, data in (
+        ("movie.mkv", make_mkv([(sups[0], "eng"), (sups[1], "")])),
+        ("movie.m2ts", make_m2ts(sups)),
+    ):
+        path = str(tmp_path / name)
+        with open(path, "wb") as f:
+            f.write(data)
+        tracks, input_hash = open_container(path, resume=True)
+        assert len(tracks) == 2
+        assert input_hash == file_digest(path)
+
+        source = CountingFile(data)
+        reader = HashingReader(source)
+        assert len(demux.open_tracks(path, reader)) == 2  # type: ignore
+        assert reader.hexdigest() == input_hash
+        # Skipped video blocks are read for the hash, nothing is read twice but the
+        # few bytes M2TS reads to detect the packet size
+        assert len(data) <= source.bytes_read < len(data) + 1024
@@ -0,0 +1,132 @@
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from pgsocr import synthetic
+from pgsocr.img_utils import extract_images, merge_similar
+from pgsocr.metrics import Metrics
+from pgsocr.pgsparser import COMPOSITION_STATE, PGStream, PGSImageObject
+from tests.conftest import make_event, make_palette
+
+FONT = ImageFont.load_default()
+
+
+def text_px(text: str, width: int = 240, height: int = 40) -> np.ndarray:
+    # Palette index 2 for the text, 0 for the transparent background
+    im = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(im).text((10, 10), text, fill=2, font=FONT)
+    return np.asarray(im, dtype=np.uint8)
+
+
+def merge(events: list[PGSImageObject]) -> tuple[list[PGSImageObject], int]:
+    metrics = Metrics()
+    merged = list(merge_similar(events, metrics))
+    return merged, metrics.counters.get("events_merged", 0)
+
+
+def test_distinct_lines_are_not_merged():
+    lines = ["Yes.", "No.", "Maybe.", "I know."]
+    events = [
+        make_event(text_px(line), 1000 + i * 2000, 3000 + i * 2000)
+        for i, line in enumerate(lines)
+    ]
+    merged, count = merge(events)
+    assert count == 0
+    assert [(e.start_ms, e.end_ms) for e in merged] == [
+        (1000, 3000),
+        (3000, 5000),
+        (5000, 7000),
+        (7000, 9000),
+    ]
+
+
+def test_resent_copy_is_merged():
+    px = text_px("Yes.")
+    events = [
+        make_event(px, 1000, 2000),
+        # Re-sent as a new object right where it was
+        make_event(px.copy(), 2000, 3000),
+        # Moved as a whole by a few pixels
+        make_event(px.copy(), 3020, 4000, x_pos=3, y_pos=2),
+        make_event(text_px("No."), 4000, 5000),
+    ]
+    merged, count = merge(events)
+    assert count == 2
+    assert [(e.start_ms, e.end_ms) for e in merged] == [(1000, 4000), (4000, 5000)]
+
+
+def test_faded_copy_is_merged():
+    px = text_px("I know.")
+    events = [
+        make_event(px, 1000, 1200, pal=make_palette(64)),
+        make_event(px, 1200, 1400, pal=make_palette(160)),
+        make_event(px, 1400, 3000, pal=make_palette(255)),
+        make_event(px, 3000, 3200, pal=make_palette(96)),
+    ]
+    merged, count = merge(events)
+    assert count == 3
+    assert [(e.start_ms, e.end_ms) for e in merged] == [(1000, 3200)]
+    # The most opaque step is the one recognized
+    assert merged[0].pal[2].Alpha == 255
+
+
+def test_copy_after_a_gap_is_not_merged():
+    px = text_px("Yes.")
+    events = [make_event(px, 1000, 2000), make_event(px, 2500, 3500)]
+    merged, count = merge(events)
+    assert count == 0 and len(merged) == 2
+
+
+def hidden_by_palette_stream() -> bytes:
+    # Shown at 1000, hidden by a palette update at 3000 and still hidden when it is
+    # refreshed at 6000, shown again at 9000 and cleared at 12000
+    px = text_px("Yes.")
+    hidden = [(y, cb, cr, 0) for y, cb, cr, _ in synthetic.DEFAULT_PALETTE]
+    placement = [(0, 800, 900)]
+    out = synthetic.make_pcs(
+        1000, 1920, 1080, 0, COMPOSITION_STATE.EPOCH_START, False, 0, placement
+    )
+    out += synthetic.make_wds(1000, 1920, 1080)
+    out += synthetic.make_pds(1000, 0, 0, synthetic.DEFAULT_PALETTE)
+    out += synthetic.make_ods(1000, 0, 0, px) + synthetic.make_end(1000)
+    out += synthetic.make_pcs(
+        3000, 1920, 1080, 1, COMPOSITION_STATE.NORMAL, True, 0, placement
+    )
+    out += synthetic.make_pds(3000, 0, 1, hidden) + synthetic.make_end(3000)
+    out += synthetic.make_pcs(
+        6000, 1920, 1080, 2, COMPOSITION_STATE.ACQUISITION_POINT, False, 0, placement
+    )
+    out += synthetic.make_wds(6000, 1920, 1080)
+    out += synthetic.make_pds(6000, 0, 1, hidden)
+    out += synthetic.make_ods(6000, 0, 0, px) + synthetic.make_end(6000)
+    out += synthetic.make_pcs(
+        9000, 1920, 1080, 3, COMPOSITION_STATE.NORMAL, True, 0, placement
+    )
+    out += synthetic.make_pds(9000, 0, 2, synthetic.DEFAULT_PALETTE)
+    out += synthetic.make_end(9000)
+    out += synthetic.make_pcs(
+        12000, 1920, 1080, 4, COMPOSITION_STATE.NORMAL, False, 0, []
+    )
+    out += synthetic.make_wds(12000, 1920, 1080) + synthetic.make_end(12000)
+    return out
+
+
+def test_subtitle_hidden_by_palette_ends_its_event():
+    stream = PGStream.from_bytes(hidden_by_palette_stream(), "hidden.sup")
+    events = list(extract_images(stream, merge=True))
+    assert [(e.start_ms, e.end_ms) for e in events] == [(1000, 3000), (9000, 12000)]
+
+
+def test_fade_steps_continue_the_event_only_when_merging():
+    data = synthetic.generate_stream(
+        events=3, object_width=200, object_height=30, palette_updates=3
+    )
+    merged = list(extract_images(PGStream.from_bytes(data, "fade.sup"), merge=True))
+    assert [(e.start_ms, e.end_ms) for e in merged] == [
+        (1000, 3000),
+        (3500, 5500),
+        (6000, 8000),
+    ]
+    # The most opaque step is the one recognized
+    assert all(max(entry.Alpha for entry in e.pal) == 255 for e in merged)
+    # Without merging every palette update is composed as a new showing
+    plain = list(extract_images(PGStream.from_bytes(data, "fade.sup")))
+    assert [e.start_ms for e in plain] == [2500, 5000, 7500]
@@ -0,0 +1,65 @@
+import sqlite3
+import numpy as np
+from pgsocr.ocr_cache import OCRCache
+from pgsocr.supconvert import ocr_images
+from pgsocr.synthetic import text_bitmap
+from tests.conftest import FakeEngine, make_event, make_palette
+
+
+def test_key_depends_on_palette():
+    px = text_bitmap(np.random.default_rng(0), 300, 40)
+    opaque = OCRCache.make_key(px, make_palette(255), ("e",))
+    assert opaque == OCRCache.make_key(px.copy(), make_palette(255), ("e",))
+    assert opaque != OCRCache.make_key(px, make_palette(0), ("e",))
+    assert opaque != OCRCache.make_key(px, make_palette(128), ("e",))
+    assert opaque != OCRCache.make_key(px, make_palette(255), ("other",))
+
+
+def test_same_bitmap_with_another_palette_is_recognized_again():
+    px = text_bitmap(np.random.default_rng(1), 300, 40)
+    events = [
+        make_event(px, 0, pal=make_palette(0)),
+        make_event(px, 2000, pal=make_palette(255)),
+        make_event(px, 4000, pal=make_palette(255)),
+    ]
+    engine = FakeEngine()
+    texts = [text for _, text, _ in ocr_images(engine, events, OCRCache())]
+    # The transparent showing must not answer for the opaque one, the repeated opaque
+    # showing comes from the cache
+    assert texts[0] != texts[1] and texts[1] == texts[2]
+    assert engine.calls == 2
+
+
+def test_confidence_is_kept_with_the_cached_text():
+    rng = np.random.default_rng(2)
+    px = text_bitmap(rng, 300, 40)
+    events = [make_event(px, 0), make_event(text_bitmap(rng, 300, 40), 2000)]
+    events.append(make_event(px, 4000))
+    engine = FakeEngine()
+    results = list(ocr_images(engine, events, OCRCache(), confidence=True))
+    confs = [conf for _, _, conf in results]
+    assert None not in confs and confs[0] == confs[2]
+    assert engine.conf_calls == 2
+
+    # Not asked for, the engine is used without it
+    engine = FakeEngine()
+    results = list(ocr_images(engine, events, OCRCache()))
+    assert [conf for _, _, conf in results] == [None, None, None]
+    assert engine.conf_calls == 0
+
+
+def test_store_from_before_confidences(tmp_path):
+    db_path = str(tmp_path / "ocr.db")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+    db.execute("INSERT INTO ocr VALUES ('old', 'text')")
+    db.commit()
+    db.close()
+
+    cache = OCRCache(db_path=db_path)
+    cache.put("new", "other", 87)
+    cache.close()
+    cache = OCRCache(db_path=db_path)
+    assert cache.get("old") == ("text", None)
+    assert cache.get("new") == ("other", 87)
+    cache.close()
@@ -0,0 +1,32 @@
+import threading
+from concurrent.futures import Future
+from pgsocr.ocr_pool import ordered_imap
+
+
+def test_results_keep_submission_order():
+    # Futures are completed in reverse order, each one once a later image is queued
+    futures: list[Future] = []
+    in_flight = []
+
+    def submit(im) -> Future:
+        future: Future = Future()
+        futures.append(future)
+        in_flight.append(sum(not f.done() for f in futures))
+        if len(futures) % 4 == 0:
+            for i in reversed(range(len(futures) - 4, len(futures))):
+                futures[i].set_result(f"text {i}")
+        return future
+
+    results = list(ordered_imap(submit, range(12), max_pending=4))
+    assert results == [f"text {i}" for i in range(12)]
+    assert max(in_flight) <= 4
+
+
+def test_results_from_threads_keep_order():
+    # Later images finish first
+    def submit(im: int) -> Future:
+        future: Future = Future()
+        threading.Timer(0.01 * (10 - im), future.set_result, (im,)).start()
+        return future
+
+    assert list(ordered_imap(submit, range(10), max_pending=5)) == list(range(10))
@@ -0,0 +1,61 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pgsocr.metrics import Metrics
+from pgsocr.supconvert import ocr_images
+from pgsocr.synthetic import text_bitmap
+from tests.conftest import FakeEngine, make_event
+
+
+class SlowEngine(FakeEngine):
+    def get_ocr_text(self, im) -> str:
+        time.sleep(0.02)
+        return super().get_ocr_text(im)
+
+
+class SlowPool:
+    # Same interface as the process and thread pools
+    config_key = ("pool",)
+    max_pending = 4
+
+    def __init__(self):
+        self.engine = SlowEngine()
+        self.executor = ThreadPoolExecutor(1)
+
+    def submit(self, im):
+        return self.executor.submit(self.engine.get_ocr_text, im)
+
+    def quit(self):
+        self.executor.shutdown()
+
+
+def slow_events(count: int):
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        # Extraction and preprocessing are not engine time
+        time.sleep(0.1)
+        yield make_event(text_bitmap(rng, 200, 30), i * 2000)
+
+
+def test_engine_time_is_recorded_per_image():
+    metrics = Metrics()
+    results = list(ocr_images(SlowEngine(), slow_events(4), metrics=metrics))
+    assert len(results) == 4
+    samples = metrics.timings["ocr"]
+    assert len(samples) == 4
+    assert all(0.02 <= s < 0.1 for s in samples)
+
+
+def test_pool_time_is_recorded_per_future():
+    metrics = Metrics()
+    pool = SlowPool()
+    try:
+        results = list(ocr_images(pool, slow_events(4), metrics=metrics))
+    finally:
+        pool.quit()
+    assert [text for _, text, _ in results] == [
+        text for _, text, _ in ocr_images(FakeEngine(), slow_events(4))
+    ]
+    samples = metrics.timings["ocr"]
+    assert len(samples) == 4
+    assert all(0.02 <= s < 0.1 for s in samples)
@@ -0,0 +1,35 @@
+from pgsocr.img_utils import PaletteCache, extract_images
+from pgsocr.pgsparser import PaletteDefinitionSegment, PGStream
+from pgsocr.synthetic import DEFAULT_PALETTE, generate_stream, make_pds
+
+
+def pds(palette_id: int, version: int, alpha: int = 255) -> PaletteDefinitionSegment:
+    entries = [(y, cb, cr, min(a, alpha)) for y, cb, cr, a in DEFAULT_PALETTE]
+    return PaletteDefinitionSegment(make_pds(0, palette_id, version, entries))
+
+
+def test_invalidate_drops_only_that_palette():
+    cache = PaletteCache()
+    cache.get(pds(0, 0))
+    cache.get(pds(0, 1, 128))
+    cache.get(pds(1, 0))
+    cache.get(pds(0, 0))
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    cache.invalidate(0)
+    assert [key[:2] for key in cache.luts] == [(1, 0)]
+    cache.get(pds(0, 0))
+    cache.get(pds(1, 0))
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_palette_updates_replace_the_cached_tables():
+    data = generate_stream(
+        events=3, object_width=200, object_height=30, palette_updates=4, epoch_size=3
+    )
+    cache = PaletteCache()
+    events = list(extract_images(PGStream.from_bytes(data, "a.sup"), cache))
+    assert len(events) == 3
+    # Only the table of the last fade step is left, earlier ones were dropped by the
+    # updates that replaced them
+    assert [key[:2] for key in cache.luts] == [(0, 12)]
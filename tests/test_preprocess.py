@@ -0,0 +1,91 @@
+import argparse
+import numpy as np
+import pytest
+from PIL import Image
+from pgsocr.img_utils import (
+    pad_to_square,
+    preprocess_lines,
+    split_lines,
+    text_lines,
+)
+from pgsocr.main import (
+    add_conversion_arguments,
+    add_engine_arguments,
+    conversion_options,
+)
+from pgsocr.supconvert import prepare_images
+from tests.conftest import make_event, make_palette
+
+
+def parse(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    add_engine_arguments(parser)
+    add_conversion_arguments(parser)
+    return parser.parse_args(argv)
+
+
+@pytest.mark.parametrize(
+    "argv, mode",
+    [
+        ([], "crop"),
+        (["-m", "tesseract"], "crop"),
+        (["-m", "hybrid"], "crop"),
+        (["-m", "florence2"], "canvas"),
+        (["-m", "florence2", "-p", "crop"], "crop"),
+        (["-m", "tesseract", "-p", "canvas"], "canvas"),
+    ],
+)
+def test_default_preprocess_depends_on_engine(argv, mode):
+    assert conversion_options(parse(argv))["preprocess"] == mode
+
+
+def test_pad_to_square_keeps_aspect_ratio():
+    line = np.full((40, 300), 255, dtype=np.uint8)
+    line[10:30, 20:280] = 0
+    for im in (Image.fromarray(line), Image.fromarray(line).convert("RGB")):
+        padded = pad_to_square(im)
+        assert padded.size == (300, 300) and padded.mode == im.mode
+        px = np.asarray(padded.convert("L"))
+        # The line is centered unscaled on white
+        assert np.array_equal(px[130:170], line)
+        assert (px[:130] == 255).all() and (px[170:] == 255).all()
+    square = Image.new("L", (50, 50))
+    assert pad_to_square(square) is square
+
+
+def test_split_lines_keeps_accents_with_their_line():
+    px = np.zeros((100, 200), dtype=np.uint8)
+    # An accent above the first line, a dot below the second one
+    px[5:8, 30:40] = 2
+    px[10:40, 10:190] = 2
+    px[55:85, 10:190] = 2
+    px[88:91, 100:104] = 2
+    lines = split_lines(px, make_palette())
+    assert [line.shape for line in lines] == [(35, 200), (36, 200)]
+    assert np.array_equal(lines[0], px[5:40]) and np.array_equal(lines[1], px[55:91])
+
+
+def test_split_lines_of_single_and_empty_images():
+    px = np.zeros((40, 200), dtype=np.uint8)
+    assert split_lines(px, make_palette()) == []
+    px[2:5, 50:60] = 2
+    px[10:30, 10:190] = 2
+    lines = split_lines(px, make_palette())
+    assert len(lines) == 1 and np.array_equal(lines[0], px[2:30])
+
+
+def test_split_lines_follows_the_preprocessing_mode():
+    px = np.zeros((100, 200), dtype=np.uint8)
+    px[10:40, 10:190] = 2
+    px[55:85, 10:190] = 2
+    img_obj = make_event(px, 0)
+    crops = preprocess_lines(img_obj, "crop")
+    assert [im.mode for im in crops] == ["L", "L"]
+    canvases = preprocess_lines(img_obj, "canvas")
+    assert [(im.mode, im.size) for im in canvases] == [("RGB", (1000, 1000))] * 2
+    # Every canvas has one of the lines on it
+    for im in canvases:
+        assert len(text_lines(np.array(im.convert("L")) < 128)) == 1
+    assert prepare_images(img_obj, "canvas", True)[0].size == (1000, 1000)
+    with pytest.raises(ValueError):
+        preprocess_lines(img_obj, "other")
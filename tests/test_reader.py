@@ -0,0 +1,47 @@
+import io
+import numpy as np
+from pgsocr.img_utils import extract_images
+from pgsocr.pgsparser import PGStream, PGStreamReader
+from pgsocr.synthetic import generate_stream
+
+
+class CountingReader(io.BytesIO):
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_events_are_extracted_before_the_epoch_is_read():
+    # A single epoch for the whole stream
+    data = generate_stream(events=50, object_width=300, object_height=40, epoch_size=50)
+    source = CountingReader(data)
+    events = extract_images(PGStreamReader(source))
+    first = next(events)
+    assert (first.start_ms, first.end_ms) == (1000, 3000)
+    # The first event ends with the second display set
+    assert source.bytes_read < len(data) // 10
+    assert len(list(events)) == 49
+    assert source.bytes_read == len(data)
+
+
+def test_reader_extracts_the_same_events():
+    data = generate_stream(
+        events=12,
+        objects=2,
+        object_width=300,
+        object_height=40,
+        palette_updates=2,
+        epoch_size=4,
+        refreshes=1,
+    )
+    expected = list(extract_images(PGStream.from_bytes(data, "a.sup"), merge=True))
+    events = list(extract_images(PGStreamReader(io.BytesIO(data)), merge=True))
+    assert [(e.start_ms, e.end_ms, e.x_pos, e.y_pos) for e in events] == [
+        (e.start_ms, e.end_ms, e.x_pos, e.y_pos) for e in expected
+    ]
+    assert all(np.array_equal(a.px, b.px) for a, b in zip(events, expected))
@@ -0,0 +1,96 @@
+import warnings
+import numpy as np
+import pytest
+from pgsocr.img_utils import decode_rle, read_rle_bytes
+from pgsocr.synthetic import encode_rle
+
+
+def reference_decode(data: bytes, width: int) -> np.ndarray:
+    # Short rows are left padded with 255, as px_rgb_a did with read_rle_bytes
+    rows = read_rle_bytes(data)
+    return np.array([[255] * (width - len(l)) + l for l in rows], dtype=np.uint8)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_bitmaps_match_reference(seed):
+    rng = np.random.default_rng(seed)
+    height = int(rng.integers(1, 40))
+    width = int(rng.integers(1, 400))
+    # Long runs of few colors, with some noise for single pixel runs
+    px = np.repeat(
+        rng.integers(0, 4, (height, width // 8 + 1), dtype=np.uint8), 8, axis=1
+    )[:, :width]
+    noise = rng.random((height, width)) < 0.05
+    px[noise] = rng.integers(0, 256, int(noise.sum()), dtype=np.uint8)
+    data = encode_rle(px)
+
+    decoded = decode_rle(data, width, height)
+    assert decoded.dtype == np.uint8
+    np.testing.assert_array_equal(decoded, px)
+    np.testing.assert_array_equal(decoded, reference_decode(data, width))
+
+
+def test_extended_length_runs():
+    # Runs of 64 and more use the two byte length forms, for color 0 and other colors
+    px = np.zeros((3, 5000), dtype=np.uint8)
+    px[0, 100:4000] = 7
+    px[1, :63] = 9
+    px[1, 63:127] = 9
+    px[2, 1:] = 200
+    data = encode_rle(px)
+    assert bytes([0, 0x40 | (4900 >> 8), 4900 & 0xFF]) in encode_rle(
+        np.zeros((1, 4900), dtype=np.uint8)
+    )
+    np.testing.assert_array_equal(decode_rle(data, 5000, 3), px)
+    np.testing.assert_array_equal(
+        decode_rle(data, 5000, 3), reference_decode(data, 5000)
+    )
+
+
+def test_colored_zero_index_runs():
+    # Color 0 written in the colored run forms instead of the short zero forms
+    data = bytes([0, 0x80 | 5, 0, 3, 0, 0xC0 | 0, 70, 0, 0, 0])
+    decoded = decode_rle(data, 76, 1)
+    np.testing.assert_array_equal(decoded, reference_decode(data, 76))
+    assert decoded[0, 5] == 3 and not decoded[0, :5].any() and not decoded[0, 6:].any()
+
+
+def test_short_rows_are_padded():
+    # The second row is 4 pixels short of the object width
+    data = bytes([1, 2, 3, 4, 5, 6, 0, 0, 7, 8, 0, 0])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        decoded = decode_rle(data, 6, 2)
+    np.testing.assert_array_equal(decoded, reference_decode(data, 6))
+    np.testing.assert_array_equal(decoded[1], [255, 255, 255, 255, 7, 8])
+
+
+def test_empty_input():
+    assert decode_rle(b"", 10, 0).shape == (0, 10)
+    with pytest.warns(RuntimeWarning):
+        decoded = decode_rle(b"", 10, 2)
+    np.testing.assert_array_equal(decoded, np.full((2, 10), 255, dtype=np.uint8))
+
+
+def test_row_count_mismatch():
+    px = np.arange(12, dtype=np.uint8).reshape(3, 4) + 1
+    data = encode_rle(px)
+    reference = reference_decode(data, 4)
+
+    # More rows than the object height: the extra rows are dropped
+    with pytest.warns(RuntimeWarning, match="Decoded 3 lines"):
+        decoded = decode_rle(data, 4, 2)
+    np.testing.assert_array_equal(decoded, reference[:2])
+
+    # Fewer rows: the missing rows stay padding
+    with pytest.warns(RuntimeWarning, match="Decoded 3 lines"):
+        decoded = decode_rle(data, 4, 5)
+    np.testing.assert_array_equal(decoded[:3], reference)
+    np.testing.assert_array_equal(decoded[3:], np.full((2, 4), 255, dtype=np.uint8))
+
+
+def test_hanging_pixels_warn():
+    # Pixels after the last end of line marker
+    data = bytes([1, 2, 0, 0, 3])
+    with pytest.warns(RuntimeWarning, match="hanging"):
+        decode_rle(data, 2, 1)
@@ -0,0 +1,104 @@
+import numpy as np
+from pgsocr.img_utils import decode_rle, extract_images
+from pgsocr.pgsparser import COMPOSITION_STATE, ObjectDefinitionSegment, PGStream
+from pgsocr.sup_index import build_index
+from pgsocr.synthetic import generate_stream, text_bitmap, write_sup
+
+OPTIONS = dict(
+    events=6,
+    objects=2,
+    object_width=300,
+    object_height=40,
+    fragment_size=500,
+    palette_updates=2,
+    epoch_size=3,
+    refreshes=1,
+    duration_ms=2000,
+    seed=3,
+)
+
+
+def expected_bitmaps(options: dict) -> list[np.ndarray]:
+    # generate_stream draws every object of every event from one generator in order
+    rng = np.random.default_rng(options["seed"])
+    return [
+        text_bitmap(rng, options["object_width"], options["object_height"])
+        for _ in range(options["events"] * options["objects"])
+    ]
+
+
+def test_stream_parses():
+    stream = PGStream.from_bytes(generate_stream(**OPTIONS), "synthetic.sup")
+    assert (stream.res_width, stream.res_height) == (1920, 1080)
+    # The event, its palette updates and refreshes and the clear of the screen
+    assert len(stream.display_sets) == 6 * (1 + 2 + 1 + 1)
+    assert len(stream.epochs) == 2
+    states = [ds.composition_state for ds in stream.display_sets[:5]]
+    assert states[0] == COMPOSITION_STATE.EPOCH_START
+    assert COMPOSITION_STATE.ACQUISITION_POINT in states
+    numbers = [ds.pcs[0].composition_number for ds in stream.display_sets]
+    assert numbers == list(range(len(numbers)))
+
+
+def test_extract_images():
+    stream = PGStream.from_bytes(generate_stream(**OPTIONS), "synthetic.sup")
+    # Fades continue the event when merging
+    events = list(extract_images(stream, merge=True))
+    bitmaps = expected_bitmaps(OPTIONS)
+    assert len(events) == len(bitmaps)
+    for i, (img_obj, px) in enumerate(zip(events, bitmaps)):
+        start = 1000 + i // 2 * 2500
+        assert (img_obj.start_ms, img_obj.end_ms) == (start, start + 2000)
+        assert np.array_equal(img_obj.px, px)
+        assert img_obj.img.size == (300, 40)
+        assert max(entry.Alpha for entry in img_obj.pal) == 255
+
+
+def test_index_counts(tmp_path):
+    path = str(tmp_path / "synthetic.sup")
+    write_sup(path, **OPTIONS)
+    stream = PGStream(path)
+    summary = build_index(path).summary
+    assert summary["segments"] == len(list(stream.raw_segments()))
+    assert summary["display_sets"] == len(stream.display_sets)
+    assert summary["epochs"] == 2
+    # Refreshes send the same object versions again and are not counted as events
+    assert summary["events"] == 12
+    assert summary["bitmap_area"] == 12 * 300 * 40
+    assert (summary["width"], summary["height"]) == (1920, 1080)
+    assert (summary["start_ms"], summary["end_ms"]) == (1000, 1000 + 5 * 2500 + 2000)
+
+
+def test_composition_numbers_wrap():
+    # Enough fade steps to use more than 65536 composition numbers
+    data = generate_stream(
+        events=2,
+        object_width=64,
+        object_height=24,
+        palette_updates=33000,
+        duration_ms=70000,
+    )
+    stream = PGStream.from_bytes(data, "long.sup")
+    numbers = [ds.pcs[0].composition_number for ds in stream.display_sets]
+    assert len(numbers) == 2 * (33000 + 2)
+    assert numbers[65535:65538] == [65535, 0, 1]
+    # Numbers used again after wrapping are not mistaken for repeated display sets
+    events = list(extract_images(stream, merge=True))
+    # The fades reach full transparency, which ends the events, before the clears
+    assert [(e.start_ms, e.end_ms) for e in events] == [
+        (1000, 66744),
+        (71500, 137244),
+    ]
+
+
+def test_fragments_are_joined_only_for_decoding():
+    stream = PGStream.from_bytes(generate_stream(**OPTIONS), "synthetic.sup")
+    objects = [s for s in stream.segments if isinstance(s, ObjectDefinitionSegment)]
+    fragmented = [ods for ods in objects if len(ods.fragments) > 1]
+    assert fragmented
+    for ods in fragmented:
+        # The object keeps windows into the stream instead of a joined copy
+        assert all(isinstance(fragment, memoryview) for fragment in ods.fragments)
+        assert len(ods.img_data) == ods.data_len - 4
+    px = decode_rle(fragmented[0].img_data, 300, 40)
+    assert any(np.array_equal(px, bitmap) for bitmap in expected_bitmaps(OPTIONS))
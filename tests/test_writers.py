@@ -0,0 +1,54 @@
+import json
+import numpy as np
+from pgsocr.writers import JSONLWriter, SRTWriter, WebVTTWriter
+from tests.conftest import make_event
+
+
+def event(start_ms: int = 3_723_045, end_ms: int = 3_725_500):
+    px = np.zeros((40, 300), dtype=np.uint8)
+    px[10:30, 10:290] = 2
+    return make_event(px, start_ms, end_ms, x_pos=810, y_pos=900)
+
+
+def test_webvtt_escapes_markup_and_drops_blank_lines():
+    cue = WebVTTWriter(1920, 1080).event(7, event(), "<i>Tom & Jerry</i>\n\n  \n-> go")
+    assert cue == (
+        "7\n01:02:03.045 --> 01:02:05.500 position:50% line:85%,center align:center\n"
+        "&lt;i&gt;Tom &amp; Jerry&lt;/i&gt;\n-&gt; go\n\n"
+    )
+
+
+def test_webvtt_without_resolution_has_no_settings():
+    cue = WebVTTWriter(0, 0).event(1, event(0, 1000), "text")
+    assert cue == "1\n00:00:00.000 --> 00:00:01.000\ntext\n\n"
+
+
+def test_jsonl_fields():
+    line = JSONLWriter(1920, 1080).event(3, event(), "Ça va?\nOui")
+    assert line.endswith("\n") and "Ça va?" in line
+    assert json.loads(line) == {
+        "index": 3,
+        "start_ms": 3_723_045,
+        "end_ms": 3_725_500,
+        "x": 810,
+        "y": 900,
+        "width": 300,
+        "height": 40,
+        "text": "Ça va?\nOui",
+    }
+
+
+def test_srt_timecodes():
+    assert SRTWriter(1920, 1080).event(2, event(), "text") == (
+        "2\n01:02:03,045 --> 01:02:05,500\ntext\n\n"
+    )
+
+
+def test_jsonl_confidence():
+    writer = JSONLWriter(1920, 1080)
+    assert json.loads(writer.event(1, event(), "text", 91))["confidence"] == 91
+    assert "confidence" not in json.loads(writer.event(1, event(), "text"))
+    # Other formats have no place for it
+    assert SRTWriter(1920, 1080).event(2, event(), "text", 91) == (
+        SRTWriter(1920, 1080).event(2, event(), "text")
+    )